@@ -1,69 +1,135 @@
+import json
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g, url_for, abort, jsonify
-from flask_debugtoolbar import DebugToolbarExtension
-from sqlalchemy.exc import IntegrityError
+import requests
+from flask import Blueprint, Flask, Response, current_app, render_template, request, flash, redirect, session, g, url_for, abort, jsonify, send_file
+from sqlalchemy.exc import IntegrityError, OperationalError
 
 from models import db, connect_db, User, Book, BookNote, BookList
 from forms import UserRegisterForm, UserEditForm, LoginForm, CreateEditBooklistForm, CreateEditNoteForm
-from open_library import keyword_search, fetch_availabilty_links, fetch_trending_books, fetch_book_data
-from seed import seed_data
+from open_library import SEARCH_PROFILES, keyword_search, project_works, stream_search, fetch_availabilty_links, fetch_book_data, upstream_stats
+from trending import trending_feeds
+from covers import cover_cache, proxy_cover_url, webp_supported, COVER_KINDS, COVER_SIZES
+from pagination import PAGE_SIZE
+from db_pool import engine_options, pool_settings, pool_stats, statement_timeout
+from principal import LazyUserGlobals, load_principal, store_principal, clear_principal, invalidate_principal
+from seed import init_db_command, seed_command
+from jobs import JOBS_URL, get_job_queue, jobs_stats_command, jobs_work_command
+from resync import resync_books_command
+from suggest import MAX_SUGGEST_LIMIT, SUGGEST_LIMIT, suggest_index
 
-CUR_USER_KEY = "cur_user"
 MUST_BE_LOGGED_IN = "You must be signed in to access that page!"
 
-app = Flask(__name__)
+# Covers never change for an id, let browsers keep them for a year
+COVER_MAX_AGE = 365 * 24 * 60 * 60
 
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-uri = os.getenv("DATABASE_URL", 'postgresql:///olreader')  # or other relevant config var
-if uri and uri.startswith("postgres://"):
-    uri = uri.replace("postgres://", "postgresql://", 1)
-app.config['SQLALCHEMY_DATABASE_URI'] = uri
+# Most books one add-many request may add
+MAX_BULK_ADD = int(os.getenv("MAX_BULK_ADD", 200))
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-# toolbar = DebugToolbarExtension(app)
+# Milliseconds the saved book search may take before only remote results are shown
+SEARCH_STATEMENT_TIMEOUT = int(os.getenv("SEARCH_STATEMENT_TIMEOUT", 3000))
+
+views = Blueprint("olreader", __name__)
+views.add_app_template_filter(proxy_cover_url, "cover_src")
+
+
+def create_app(config=None):
+    """Build and configure the app
+
+    Only reads config and registers things, nothing touches the database
+    until a request does. Create the schema with `flask db-init` and load
+    the sample data with `flask seed`.
+    """
+
+    app = Flask(__name__)
+    app.app_ctx_globals_class = LazyUserGlobals
+
+    # Get DB_URI from environ variable (useful for production/testing) or,
+    # if not set there, use development local db.
+    uri = os.getenv("DATABASE_URL", 'postgresql:///olreader')  # or other relevant config var
+    if uri and uri.startswith("postgres://"):
+        uri = uri.replace("postgres://", "postgresql://", 1)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ECHO'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(pool_settings())
+    app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+    app.config['JOBS_URL'] = os.environ.get('JOBS_URL', JOBS_URL)
+
+    if config is not None:
+        app.config.update(config)
+
+    # toolbar = DebugToolbarExtension(app)
 
-with app.app_context():
     connect_db(app)
-    seed_data(db)
+    app.register_blueprint(views)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(seed_command)
+    app.cli.add_command(jobs_work_command)
+    app.cli.add_command(jobs_stats_command)
+    app.cli.add_command(resync_books_command)
+
+    return app
+
 
 #
 # User actions
 #
 
-@app.before_request
+@views.before_app_request
 def add_user_to_g():
-    """If we're logged in, add cur_user to Flask global."""
+    """If we're logged in, add the session principal to Flask global.
+
+    g.user is only loaded from the db when a view or template uses it.
+    """
 
-    if CUR_USER_KEY in session:
-        # g.user = User.query.get(session[CUR_USER_KEY])
-        g.user = User.query.filter_by(id=session[CUR_USER_KEY]).one()
+    g.principal = load_principal(session)
 
-    else:
-        g.user = None
+
+@views.app_template_global()
+def user_list_menu():
+    """Id and title of the logged in user's lists, loaded once per request"""
+
+    if "list_menu" not in g:
+        g.list_menu = BookList.titles_for_user(g.principal.id) if g.principal else []
+    return g.list_menu
 
 
 def do_login(user):
     """Log in user."""
 
-    session[CUR_USER_KEY] = user.id
+    store_principal(session, user)
 
 
 def do_logout():
     """Logout user."""
 
-    if CUR_USER_KEY in session:
-        del session[CUR_USER_KEY]
+    clear_principal(session)
+
+
+def page_json(fetch, *args):
+    """
+    JSON for fetch(*args, after=..., limit=...) using the request's
+    after and limit args, 400 when they don't parse
+    """
+
+    try:
+        page = fetch(*args, after=request.args.get("after"), limit=request.args.get("limit", PAGE_SIZE))
+    except ValueError:
+        abort(400)
+
+    return jsonify({
+        "items": [item.to_dict() for item in page.items],
+        "next": page.next_cursor,
+    })
 
 #
 # Signup and Login routes
 #
 
-@app.route('/signup', methods=["GET", "POST"])
+@views.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
 
@@ -98,7 +164,7 @@ def signup():
         return render_template('users/signup.html', form=register_form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@views.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
 
@@ -116,19 +182,19 @@ def login():
 
     return render_template('users/login.html', form=form)
 
-@app.route('/logout')
+@views.route('/logout')
 def logout():
     """Handle logout of user."""
 
     do_logout()
     flash("Logged out!", "success")
-    return redirect(url_for("login"))
+    return redirect(url_for(".login"))
 
 #
 # "Public" routes
 #
 
-@app.route('/')
+@views.route('/')
 def home():
     """Show Home Page"""
 
@@ -139,60 +205,77 @@ def home():
 # Profile Routes
 #
 
-@app.route('/profile')
+@views.route('/profile')
 def show_profile():
     """Show logged in user profile"""
 
-    if not g.user:
+    if not g.principal:
         flash(MUST_BE_LOGGED_IN, "danger")
-        return redirect(url_for("login"))
+        return redirect(url_for(".login"))
     
-    return render_template("/users/profile.html", user_id=g.user.id)
+    user = User.get_profile(g.principal.id)
+    notes = BookNote.page_for_user(g.principal.id)
+    return render_template("/users/profile.html", user=user, notes=notes.items, next_cursor=notes.next_cursor, user_id=g.principal.id)
+
+
+@views.route('/profile/notes')
+def show_profile_notes():
+    """Page of the logged in user's notes as JSON"""
+
+    if not g.principal:
+        return jsonify({
+                "err": MUST_BE_LOGGED_IN,
+                "type": "danger",
+                })
+
+    return page_json(BookNote.page_for_user, g.principal.id)
 
 
-@app.route('/profile/edit', methods=['GET', 'POST'])
+@views.route('/profile/edit', methods=['GET', 'POST'])
 def edit_profile():
     """Edit logged in user profile"""
 
-    if not g.user:
+    if not g.principal:
         flash(MUST_BE_LOGGED_IN, "danger")
-        return redirect(url_for("login"))
+        return redirect(url_for(".login"))
     
     profile_form = UserEditForm(obj=g.user)
     if profile_form.validate_on_submit():
         profile_form.populate_obj(g.user)
         db.session.commit()
+        store_principal(session, g.user)
 
-        return redirect(url_for("show_profile"))
+        return redirect(url_for(".show_profile"))
     
-    return render_template("/users/edit-profile.html", form=profile_form, user_id=g.user.id)
+    return render_template("/users/edit-profile.html", form=profile_form, user_id=g.principal.id)
 
 
-@app.route('/profile/delete', methods=['POST']) # Maybe DELETE?
+@views.route('/profile/delete', methods=['POST']) # Maybe DELETE?
 def delete_profile():
     """Delete the logged in user"""
 
-    if not g.user:
+    if not g.principal:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     db.session.delete(g.user)
     db.session.commit()
-    
-    return redirect(url_for("logout"))
+    invalidate_principal(g.principal.id)
+
+    return redirect(url_for(".logout"))
 
 
 #
 # Booklist Routes
 #
 
-@app.route('/lists/create', methods=['GET', 'POST'])
+@views.route('/lists/create', methods=['GET', 'POST'])
 def create_booklist():
     """Create Booklist"""
 
-    if not g.user:
+    if not g.principal:
         flash(MUST_BE_LOGGED_IN, "danger")
-        return redirect(url_for("login"))
+        return redirect(url_for(".login"))
     
     if request.method == "GET":
         book_olid = request.args.get("bookid")
@@ -206,7 +289,7 @@ def create_booklist():
 
     if list_form.validate_on_submit():
         new_list = BookList()
-        new_list.user_id = g.user.id
+        new_list.user_id = g.principal.id
         list_form.populate_obj(new_list)
 
         db.session.add(new_list)
@@ -214,18 +297,21 @@ def create_booklist():
 
         olid = list_form.book_olid.data
         if olid is not None and len(olid) > 0:
-            new_list.add_olid(olid)
+            try:
+                new_list.add_olid(olid)
+            except ValueError:
+                flash(f"Failed to find {olid}", "danger")
 
-        return redirect(url_for("show_booklist", list_id=new_list.id))
+        return redirect(url_for(".show_booklist", list_id=new_list.id))
     
     return render_template("/booklists/create-list.html", form=list_form)
 
 
-@app.route('/lists/createlist', methods=['POST'])
+@views.route('/lists/createlist', methods=['POST'])
 def create_booklist_json():
     """Create Booklist from JSON object"""
 
-    if not g.user:
+    if not g.principal:
         return jsonify({
                 "err": MUST_BE_LOGGED_IN,
                 "type": "danger",
@@ -237,7 +323,7 @@ def create_booklist_json():
 
     if (title is not None and len(title) > 0):
         new_list = BookList()
-        new_list.user_id = g.user.id
+        new_list.user_id = g.principal.id
         new_list.title = title
         new_list.blurb = blurb
 
@@ -245,7 +331,14 @@ def create_booklist_json():
         db.session.commit()
         
         if olid is not None and len(olid) > 0:
-            new_list.add_olid(olid)
+            try:
+                new_list.add_olid(olid)
+            except ValueError:
+                return jsonify({
+                        "err": f"Failed to find {olid}",
+                        "type": "danger",
+                        "listId": new_list.id,
+                        })
     else:
         return jsonify({
                 "err": f"Title is required!",
@@ -259,24 +352,32 @@ def create_booklist_json():
         })
 
 
-@app.route('/lists/<int:list_id>')
+@views.route('/lists/<int:list_id>')
 def show_booklist(list_id):
     """Display the list"""
 
     booklist = BookList.query.get_or_404(list_id)
-    return render_template("/booklists/view-list.html", booklist=booklist)
+    books = BookList.books_page(list_id)
+    return render_template("/booklists/view-list.html", booklist=booklist, books=books.items, next_cursor=books.next_cursor)
 
 
-@app.route('/lists/<int:list_id>/add', methods=['GET', 'POST'])
+@views.route('/lists/<int:list_id>/books')
+def show_booklist_books(list_id):
+    """Page of the list's books as JSON"""
+
+    return page_json(BookList.books_page, list_id)
+
+
+@views.route('/lists/<int:list_id>/add', methods=['GET', 'POST'])
 def add_books_booklist(list_id):
     """Add Books to Booklist"""
 
-    if not g.user:
+    if not g.principal:
         flash(MUST_BE_LOGGED_IN, "danger")
-        return redirect(url_for("login"))
+        return redirect(url_for(".login"))
     
     add_list = BookList.query.get_or_404(list_id)
-    if add_list.user_id != g.user.id:
+    if add_list.user_id != g.principal.id:
         flash("Access unauthorized.", "danger")
         return redirect("/")
     
@@ -297,8 +398,14 @@ def add_books_booklist(list_id):
                         })
 
             else:
-                # add the book!
-                book_record = Book.create_book(olid, isbn)
+                # add the book, its details are filled in in the background
+                try:
+                    book_record = Book.create_placeholder(olid, isbn)
+                except ValueError:
+                    return jsonify({
+                        "err": f"Failed to find {olid}",
+                        "type": "danger",
+                        })
                 add_list.books.append(book_record)
                 db.session.commit()
 
@@ -309,18 +416,52 @@ def add_books_booklist(list_id):
             "type": "danger",
             })
     
-    return render_template("/booklists/add-list.html", booklist=add_list)
+    books = BookList.books_page(list_id)
+    return render_template("/booklists/add-list.html", booklist=add_list, books=books.items, next_cursor=books.next_cursor)
+
+@views.route('/lists/<int:list_id>/add-many', methods=['POST'])
+def add_many_books_booklist(list_id):
+    """Add many books to a Booklist from {"olids": [...], "isbns": [...]}"""
+
+    if not g.principal:
+        return jsonify({
+                "err": MUST_BE_LOGGED_IN,
+                "type": "danger",
+                })
+
+    add_list = BookList.query.get_or_404(list_id)
+    if add_list.user_id != g.principal.id:
+        return jsonify({
+                "err": "Access unauthorized.",
+                "type": "danger",
+                })
+
+    olids = [olid.strip() for olid in request.json.get("olids", []) if isinstance(olid, str) and olid.strip()]
+    isbns = [isbn.replace("-", "").strip() for isbn in request.json.get("isbns", []) if isinstance(isbn, str) and isbn.strip()]
+    if len(olids) + len(isbns) > MAX_BULK_ADD:
+        return jsonify({
+                "err": f"Add at most {MAX_BULK_ADD} books at a time",
+                "type": "warning",
+                })
+
+    results = add_list.add_books(olids, isbns)
 
-@app.route('/lists/<int:list_id>/remove', methods=['POST'])
+    return jsonify({
+        "results": results,
+        "added": sum(1 for result in results if result["status"] == "added"),
+    })
+
+
+@views.route('/lists/<int:list_id>/remove', methods=['POST'])
 def remove_books_booklist(list_id):
     """Remove Books from Booklist"""
 
-    if not g.user:
+    if not g.principal:
         flash(MUST_BE_LOGGED_IN, "danger")
-        return redirect(url_for("login"))
+        return redirect(url_for(".login"))
     
     remove_list = BookList.query.get_or_404(list_id)
-    if remove_list.user_id != g.user.id:
+    if remove_list.user_id != g.principal.id:
         flash("Access unauthorized.", "danger")
         return redirect("/")
     
@@ -347,16 +488,16 @@ def remove_books_booklist(list_id):
                 })
 
 
-@app.route('/lists/<int:list_id>/edit', methods=['GET', 'POST'])
+@views.route('/lists/<int:list_id>/edit', methods=['GET', 'POST'])
 def edit_booklist(list_id):
     """Edit Booklist"""
 
-    if not g.user:
+    if not g.principal:
         flash(MUST_BE_LOGGED_IN, "danger")
-        return redirect(url_for("login"))
+        return redirect(url_for(".login"))
     
     edit_list = BookList.query.get_or_404(list_id)
-    if edit_list.user_id != g.user.id:
+    if edit_list.user_id != g.principal.id:
         flash("Access unauthorized.", "danger")
         return redirect("/")
     
@@ -365,58 +506,71 @@ def edit_booklist(list_id):
         list_form.populate_obj(edit_list)
         db.session.commit()
 
-        return redirect(url_for("show_booklist", list_id=edit_list.id))
+        return redirect(url_for(".show_booklist", list_id=edit_list.id))
     
     return render_template("/booklists/edit-list.html", form=list_form, booklist=edit_list)
 
 
-@app.route('/lists/<int:list_id>/delete', methods=['POST']) # Maybe DELETE?
+@views.route('/lists/<int:list_id>/delete', methods=['POST']) # Maybe DELETE?
 def delete_booklist(list_id):
     """Delete the list"""
 
-    if not g.user:
+    if not g.principal:
         flash(MUST_BE_LOGGED_IN, "danger")
-        return redirect(url_for("login"))
+        return redirect(url_for(".login"))
     
     delete_list = BookList.query.get_or_404(list_id)
-    if delete_list.user_id != g.user.id:
+    if delete_list.user_id != g.principal.id:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     db.session.delete(delete_list)
     db.session.commit()
     
-    return redirect(url_for("show_profile"))
+    return redirect(url_for(".show_profile"))
 
 
-@app.route('/lists/read')
+@views.route('/lists/read')
 def show_read_books():
     """Pseudo list which shows the books the logged in user has read"""
 
-    if not g.user:
+    if not g.principal:
         flash(MUST_BE_LOGGED_IN, "danger")
-        return redirect(url_for("login"))
+        return redirect(url_for(".login"))
     
-    read_list = [note.book for note in g.user.notes if note.read == True]
+    read_list = Book.read_by(g.principal.id)
+
+    return render_template("/booklists/read-list.html", books=read_list.items, next_cursor=read_list.next_cursor)
+
+
+@views.route('/lists/read/books')
+def show_read_books_json():
+    """Page of the books the logged in user has read as JSON"""
 
-    return render_template("/booklists/read-list.html", books=read_list)
+    if not g.principal:
+        return jsonify({
+                "err": MUST_BE_LOGGED_IN,
+                "type": "danger",
+                })
+
+    return page_json(Book.read_by, g.principal.id)
 
 
 #
 # Book Routes
 #
 
-@app.route('/books/<book_id>')
+@views.route('/books/<book_id>')
 def show_book(book_id):
     """Display the Book"""
 
-    if not g.user:
+    if not g.principal:
         flash(MUST_BE_LOGGED_IN, "danger")
-        return redirect(url_for("login"))
+        return redirect(url_for(".login"))
 
     book = Book.query.get_or_404(book_id)
-    note = BookNote.query.filter_by(user_id=g.user.id).filter_by(book_olid=book.olid).first()
-    lists = [bl for bl in book.lists if bl.user_id == g.user.id]
+    note = BookNote.for_user_book(g.principal.id, book.olid)
+    lists = BookList.user_lists_with_book(g.principal.id, book.olid)
 
     links = fetch_availabilty_links(book.olid)
 
@@ -426,46 +580,49 @@ def show_book(book_id):
 # BookNote Routes
 #
 
-@app.route('/notes/create', methods=['GET', 'POST'])
+@views.route('/notes/create', methods=['GET', 'POST'])
 def create_note():
     """Create BookNote"""
 
-    if not g.user:
+    if not g.principal:
         flash(MUST_BE_LOGGED_IN, "danger")
-        return redirect(url_for("login"))
+        return redirect(url_for(".login"))
     
     if request.method == "GET":
         book_olid = request.args.get("bookid")
 
         if book_olid is not None:
-            for note in g.user.notes:
-                if note.book_olid == book_olid:
-                    flash("A note already exists for this book!", "warning")
-                    return redirect(url_for("show_note", note_id=note.id))
+            note = BookNote.for_user_book(g.principal.id, book_olid)
+            if note is not None:
+                flash("A note already exists for this book!", "warning")
+                return redirect(url_for(".show_note", note_id=note.id))
 
             note_form = CreateEditNoteForm(data={"book_olid": book_olid})
         else:
             flash("Search for a book first!", "warning")
-            return redirect(url_for("search_create_note"))
+            return redirect(url_for(".search_create_note"))
     else:
         note_form = CreateEditNoteForm()
     
     if note_form.validate_on_submit():
         new_note = BookNote()
-        new_note.user_id = g.user.id
+        new_note.user_id = g.principal.id
         note_form.populate_obj(new_note)
 
         olid = new_note.book_olid
         book = Book.query.filter_by(olid=olid).first()
         if (book is None):
-            # add the book!
-            book_record = Book.create_book(olid, None)
-            db.session.commit()
+            # add the book, its details are filled in in the background
+            try:
+                Book.create_placeholder(olid)
+            except ValueError:
+                flash(f"Failed to find {olid}", "danger")
+                return redirect(url_for(".search_create_note"))
 
         db.session.add(new_note)
         db.session.commit()
 
-        return redirect(url_for("show_note", note_id=new_note.id))
+        return redirect(url_for(".show_note", note_id=new_note.id))
     
     book_olid = request.args.get("bookid")
     note_form.book_olid = book_olid
@@ -475,38 +632,38 @@ def create_note():
     return render_template("/booknotes/create-note.html", form=note_form, book_preview=book_preview)
 
 
-@app.route('/notes/create/search')
+@views.route('/notes/create/search')
 def search_create_note():
     """Search for a book to create a note for"""
 
-    if not g.user:
+    if not g.principal:
         flash(MUST_BE_LOGGED_IN, "danger")
-        return redirect(url_for("login"))
+        return redirect(url_for(".login"))
     
     return render_template("/booknotes/search-note.html")
 
 
-@app.route('/notes/<int:note_id>')
+@views.route('/notes/<int:note_id>')
 def show_note(note_id):
     """Display the BookNote"""
 
-    note = BookNote.query.get_or_404(note_id)
+    note = BookNote.get_with_book(note_id)
     book = note.book
-    lists = [bl for bl in book.lists if bl.user_id == g.user.id]
+    lists = BookList.user_lists_with_book(g.principal.id, book.olid) if g.principal else []
 
     return render_template("/books/view-book.html", book=book, note=note, lists=lists)
 
 
-@app.route('/notes/<int:note_id>/edit', methods=['GET', 'POST'])
+@views.route('/notes/<int:note_id>/edit', methods=['GET', 'POST'])
 def edit_note(note_id):
     """Edit BookNote"""
 
-    if not g.user:
+    if not g.principal:
         flash(MUST_BE_LOGGED_IN, "danger")
-        return redirect(url_for("login"))
+        return redirect(url_for(".login"))
     
     edit_note = BookNote.query.get_or_404(note_id)
-    if edit_note.user_id != g.user.id:
+    if edit_note.user_id != g.principal.id:
         flash("Access unauthorized.", "danger")
         return redirect("/")
     
@@ -515,43 +672,130 @@ def edit_note(note_id):
         note_form.populate_obj(edit_note)
         db.session.commit()
 
-        return redirect(url_for("show_note", note_id=edit_note.id))
+        return redirect(url_for(".show_note", note_id=edit_note.id))
     
     return render_template("/booknotes/edit-note.html", form=note_form, note=edit_note)
 
 
-@app.route('/notes/<int:note_id>/delete', methods=['POST']) # Maybe DELETE?
+@views.route('/notes/<int:note_id>/delete', methods=['POST']) # Maybe DELETE?
 def delete_note(note_id):
     """Delete the BookNote"""
 
-    if not g.user:
+    if not g.principal:
         flash(MUST_BE_LOGGED_IN, "danger")
-        return redirect(url_for("login"))
+        return redirect(url_for(".login"))
     
     delete_note = BookNote.query.get_or_404(note_id)
-    if delete_note.user_id != g.user.id:
+    if delete_note.user_id != g.principal.id:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     db.session.delete(delete_note)
     db.session.commit()
     
-    return redirect(url_for("show_profile"))
+    return redirect(url_for(".show_profile"))
 
 
 #
 # Search
 #
 
-@app.route('/search/<term>')
+def search_profile():
+    """The SEARCH_PROFILES entry named by the profile arg, 400 if unknown"""
+
+    name = request.args.get("profile", "compact")
+    if name not in SEARCH_PROFILES:
+        abort(400)
+    return SEARCH_PROFILES[name]
+
+
+def search_books(term, page=1, source="all", profile=SEARCH_PROFILES["results"]):
+    """
+    Search saved books, openlibrary.org or both
+
+    source is "local", "remote" or "all". Local hits only come with the
+    first page and are listed ahead of the remote works they duplicate.
+    profile sets the page size, the fields asked for and the keys returned.
+    """
+
+    if not term:
+        return {"total": 0, "num_returned": 0, "works": []}
+
+    local_works = []
+    if source in ("local", "all") and str(page) == "1":
+        try:
+            local_works = project_works([book.to_search_result() for book in Book.search_local(term)], profile.keys)
+        except OperationalError as err:
+            # statement timeout, the remote results are still worth showing
+            db.session.rollback()
+            print(f"WARNING: Local search for { term } failed: { err }")
+
+    if source == "local":
+        return {
+            "total": len(local_works),
+            "num_returned": len(local_works),
+            "works": local_works,
+        }
+
+    try:
+        results = keyword_search(term, profile.fields, profile.limit, page)
+    except requests.RequestException as err:
+        # the saved books are still worth showing
+        print(f"WARNING: Search for { term } failed: { err }")
+        results = {"total": 0, "num_returned": 0, "works": [], "err": "Search failed, please try again.", "type": "danger"}
+    suggest_index.add_works(results["works"])
+    results["works"] = project_works(results["works"], profile.keys)
+    if len(local_works) > 0:
+        local_olids = {work["olid"] for work in local_works}
+        results["works"] = local_works + [work for work in results["works"] if work["olid"] not in local_olids]
+
+    return results
+
+
+@views.route('/search/suggest')
+@statement_timeout(SEARCH_STATEMENT_TIMEOUT)
+def suggest_books():
+    """
+    Titles starting with ?prefix= from saved books and recent searches,
+    answered from memory so it can run on every keystroke. No suggestions
+    without a prefix.
+    """
+
+    prefix = request.args.get("prefix", "")
+    try:
+        limit = min(int(request.args.get("limit", SUGGEST_LIMIT)), MAX_SUGGEST_LIMIT)
+    except ValueError:
+        abort(400)
+    if limit < 1:
+        abort(400)
+
+    if not prefix.strip():
+        return jsonify({"suggestions": []})
+
+    suggestions = suggest_index.suggest(prefix, limit)
+    if not suggest_index.ensure_fresh(current_app._get_current_object()) and len(suggestions) < limit:
+        # the saved books are still loading, find them the slow way meanwhile
+        try:
+            saved = [{"olid": book.olid, "title": book.title, "author_name": book.author}
+                     for book in Book.search_local(prefix, limit)]
+            saved_olids = {suggestion["olid"] for suggestion in saved}
+            suggestions = (saved + [suggestion for suggestion in suggestions if suggestion["olid"] not in saved_olids])[:limit]
+        except OperationalError as err:
+            db.session.rollback()
+            print(f"WARNING: Local search for { prefix } failed: { err }")
+
+    return jsonify({"suggestions": suggestions})
+
+
+@views.route('/search/<term>')
+@statement_timeout(SEARCH_STATEMENT_TIMEOUT)
 def do_search_json(term):
-    """Keyword search"""
+    """Keyword search, ?profile= results, compact (default) or typeahead"""
 
     page = request.args.get("page", 1)
-    results = keyword_search(term, page=page)
-
-    if g.user:
-        lists = [{"listId": user_list.id, "listTitle": user_list.title} for user_list in g.user.lists]
+    source = request.args.get("source", "all")
+    results = search_books(term, page=page, source=source, profile=search_profile())
+    lists = user_list_menu()
 
     return jsonify({
         "user_lists": lists,
@@ -559,13 +803,72 @@ def do_search_json(term):
     })
 
 
-@app.route('/search')
+@views.route('/search/<term>/stream')
+@statement_timeout(SEARCH_STATEMENT_TIMEOUT)
+def do_search_stream(term):
+    """
+    Keyword search as NDJSON, one line at a time as results arrive:
+    {"user_lists", "works"} with the saved books, {"total"}, {"works"} for
+    each batch of openlibrary.org works and {"done", "num_returned"}. An
+    {"err", "type"} line (with the upstream "status" if there was one)
+    comes before "done" when the search failed.
+    Takes the same profile arg as do_search_json.
+    """
+
+    try:
+        page = int(request.args.get("page", 1))
+    except ValueError:
+        abort(400)
+
+    profile = search_profile()
+    lists = user_list_menu()
+    local_works = search_books(term, page=page, source="local", profile=profile)["works"]
+    local_olids = {work["olid"] for work in local_works}
+
+    def generate():
+        yield ndjson_line({"user_lists": lists, "works": local_works})
+
+        num_returned = 0
+        try:
+            for name, value in stream_search(term, profile.fields, profile.limit, page, profile.first_limit):
+                if name == "total":
+                    yield ndjson_line({"total": value})
+                    continue
+                if name == "error":
+                    print(f"WARNING: Streaming search for { term } failed: HTTP { value }")
+                    yield ndjson_line({"err": "Search failed, please try again.", "type": "danger", "status": value})
+                    continue
+
+                num_returned += len(value)
+                suggest_index.add_works(value)
+                works = [work for work in project_works(value, profile.keys) if work["olid"] not in local_olids]
+                if works:
+                    yield ndjson_line({"works": works})
+        except (requests.RequestException, ValueError) as err:
+            print(f"WARNING: Streaming search for { term } failed: { err }")
+            yield ndjson_line({"err": "Search failed, please try again.", "type": "danger"})
+
+        yield ndjson_line({"done": True, "num_returned": num_returned})
+
+    # the view's context is gone by the time this runs, it only streams
+    response = Response(generate(), mimetype="application/x-ndjson")
+    # let proxies pass each line on as it comes
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+def ndjson_line(data):
+    return json.dumps(data, separators=(",", ":")) + "\n"
+
+
+@views.route('/search')
+@statement_timeout(SEARCH_STATEMENT_TIMEOUT)
 def do_search():
     """Keyword search"""
 
     term = request.args.get("term")
     page = request.args.get("page", 1)
-    json = keyword_search(term, page=page)
+    json = search_books(term, page=page)
 
     return render_template("search/search.html", term=term, results=json)
 
@@ -573,26 +876,109 @@ def do_search():
 #
 # Trending
 #
-@app.route('/trending')
+@views.route('/trending')
 def show_trending():
     """Show trending books page"""
 
     return render_template("books/trending.html")
 
 
-@app.route('/trending/fetch')
+@views.route('/trending/fetch')
 def fetch_trending():
     """Get trending books"""
     
     trending_type = request.args.get("type")
 
-    trending_books = fetch_trending_books(trending_type)
-    lists = []
+    # refreshed in the background, serves the last good snapshot
+    trending_feeds.start()
+    trending_books, age = trending_feeds.get(trending_type)
+    lists = user_list_menu()
 
-    if g.user:
-        lists = [{"listId": user_list.id, "listTitle": user_list.title} for user_list in g.user.lists]
-
-    return jsonify({
+    response = jsonify({
         "user_lists": lists,
         "trending_books": trending_books,
-    })
\ No newline at end of file
+    })
+    if age is not None:
+        response.headers["Age"] = str(int(age))
+
+    return response
+
+
+#
+# Covers
+#
+
+@views.route('/covers/<kind>/<cover_key>-<size>.jpg')
+def show_cover(kind, cover_key, size):
+    """Serve a cover from the disk cache, WebP when the browser takes it"""
+
+    if kind not in COVER_KINDS or size not in COVER_SIZES:
+        abort(404)
+
+    fmt = "jpeg"
+    if webp_supported() and "image/webp" in request.headers.get("Accept", ""):
+        fmt = "webp"
+
+    blank_cover = os.path.join(current_app.static_folder, "images", "blank_cover-M.webp")
+    try:
+        cached = cover_cache.get(kind, cover_key, size, fmt)
+    except requests.RequestException as err:
+        # upstream trouble, not a missing cover: ask again next time
+        print(f"WARNING: Fetching cover { kind }/{ cover_key }-{ size } failed: { err }")
+        response = send_file(blank_cover, max_age=0)
+        response.cache_control.no_store = True
+        response.vary.add("Accept")
+        return response
+
+    if cached is None:
+        response = send_file(blank_cover, max_age=24 * 60 * 60)
+    else:
+        path, digest = cached
+        response = send_file(path, mimetype=f"image/{fmt}", etag=digest, max_age=COVER_MAX_AGE, conditional=True)
+        response.cache_control.immutable = True
+
+    response.vary.add("Accept")
+    return response
+
+
+
+#
+# Internal
+#
+
+@views.route('/internal/db-pool')
+def show_db_pool():
+    """Connection pool usage for each database, admins only"""
+
+    if not g.principal or not g.user.is_admin:
+        abort(404)
+
+    return jsonify({
+        bind_key or "default": pool_stats(engine)
+        for bind_key, engine in db.engines.items()
+    })
+
+
+@views.route('/internal/jobs')
+def show_jobs():
+    """Background job queue depth and latency, admins only"""
+
+    if not g.principal or not g.user.is_admin:
+        abort(404)
+
+    return jsonify(get_job_queue().stats())
+
+
+@views.route('/internal/upstream')
+def show_upstream():
+    """Open Library circuit breakers and retry budget, admins only"""
+
+    if not g.principal or not g.user.is_admin:
+        abort(404)
+
+    return jsonify(upstream_stats())
+
+
+
+# gunicorn app:app, `flask --app app` and the tests use this instance
+app = create_app()
@@ -0,0 +1,81 @@
+"""Rate limit queue wait benchmark
+
+Background threads (a resync, jobs) keep asking a shared token bucket for
+tokens as fast as it hands them out while interactive callers (page loads)
+arrive now and then. Reports how long each kind waited with priorities,
+and with every call treated as interactive, as before priorities existed.
+
+    python bench_ratelimit.py [--rate 20] [--seconds 5] [--background 4] [--store sqlite]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from ratelimit import BACKGROUND, INTERACTIVE, TokenBucket, percentile, priority, store_from_url
+
+
+def run(bucket, args, priorities):
+    """Hammer the bucket for args.seconds, returns the waits in seconds by kind of caller"""
+
+    stop = threading.Event()
+    waits = {INTERACTIVE: [], BACKGROUND: []}
+
+    def timed_acquire(kind):
+        waits[kind].append(bucket.acquire())
+
+    def background():
+        with priority(BACKGROUND if priorities else INTERACTIVE):
+            while not stop.is_set():
+                timed_acquire(BACKGROUND)
+
+    def interactive():
+        rand = random.Random(0)
+        while not stop.is_set():
+            # about one page load a second, each making two calls
+            stop.wait(rand.expovariate(1))
+            timed_acquire(INTERACTIVE)
+            timed_acquire(INTERACTIVE)
+
+    threads = [threading.Thread(target=background, daemon=True) for _ in range(args.background)]
+    threads.append(threading.Thread(target=interactive, daemon=True))
+    for thread in threads:
+        thread.start()
+
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    return waits
+
+
+def report(name, waits):
+    print(f"  {name:<12} calls {len(waits):>5}   wait p50 {percentile(waits, 0.5) * 1000:>7.1f} ms"
+          f"   p95 {percentile(waits, 0.95) * 1000:>7.1f} ms   max {max(waits, default=0) * 1000:>7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=20)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--background", type=int, default=4, help="background threads")
+    parser.add_argument("--store", choices=("memory", "sqlite"), default="sqlite")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "ratelimit.db")
+    url = f"sqlite:///{path}" if args.store == "sqlite" else "memory://"
+
+    print(f"{args.rate:g} calls/s, {args.background} background threads, {args.store} store, {args.seconds:g} s each")
+    for label, priorities in (("all interactive", False), ("with priorities", True)):
+        waits = run(TokenBucket(args.rate, store=store_from_url(url), name=label), args, priorities)
+        print(label)
+        report("interactive", waits[INTERACTIVE])
+        report("background", waits[BACKGROUND])
+
+
+if __name__ == "__main__":
+    main()
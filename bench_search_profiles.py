@@ -0,0 +1,92 @@
+"""Search profile payload benchmark
+
+For each of open_library.SEARCH_PROFILES, builds the search.json body
+openlibrary.org sends for the profile's fields and page size, then reports
+its size and how long decoding and parsing it takes. Docs are shaped like
+real ones (a popular work carries dozens of ISBNs), --live TERM measures
+real responses instead.
+
+    python bench_search_profiles.py [--runs 50] [--isbns 24] [--live watchmen]
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+import open_library
+from open_library import SEARCH_PROFILES, parse_search_results, project_works, search_url
+
+AVAILABILITY = {
+    "status": "borrow_available", "available_to_browse": False, "available_to_borrow": True,
+    "available_to_waitlist": False, "is_printdisabled": True, "is_readable": False, "is_lendable": True,
+    "is_previewable": True, "identifier": "watchmen0000moor", "isbn": "0930289234", "oclc": None,
+    "openlibrary_work": "OL2897798W", "openlibrary_edition": "OL2415581M", "last_loan_date": None,
+    "num_waitlist": None, "last_waitlist_date": None, "is_restricted": True, "is_browseable": False,
+    "__src__": "core.models.lending.get_availability",
+}
+
+
+def fake_doc(num, isbns):
+    """A search.json doc with every field DEFAULT_SEARCH_FIELDS asks for"""
+
+    return {
+        "key": f"/works/OL{2897798 + num}W",
+        "title": f"Watchmen {num}",
+        "author_name": ["Alan Moore", "Dave Gibbons"],
+        "isbn": [f"{9781401248192 + num * 100 + i}" for i in range(isbns)],
+        "lending_edition_s": f"OL{2415581 + num}M",
+        "ia": [f"watchmen{i:04d}moor" for i in range(6)],
+        "availability": AVAILABILITY,
+        "cover_i": 6459694 + num,
+    }
+
+
+def fake_body(profile, isbns):
+    """search.json body for profile, with only the fields it asks for"""
+
+    fields = profile.fields.split(",")
+    docs = [{field: doc[field] for field in fields if field in doc} for doc in
+            (fake_doc(num, isbns) for num in range(profile.limit))]
+    return json.dumps({"numFound": 1000, "start": 0, "numFoundExact": True, "docs": docs}).encode("utf-8")
+
+
+def live_body(profile, term):
+    """search.json body from openlibrary.org for profile"""
+
+    response = open_library.http_get(search_url(f"q={ term }", profile.fields, profile.limit, 1))
+    response.raise_for_status()
+    return response.content
+
+
+def time_parse(body, profile, runs):
+    """Median seconds to decode body, parse the works and project them"""
+
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        results = parse_search_results(json.loads(body))
+        project_works(results["works"], profile.keys)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), len(results["works"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--isbns", type=int, default=24, help="ISBNs per fake doc")
+    parser.add_argument("--live", metavar="TERM", help="measure openlibrary.org responses for TERM")
+    args = parser.parse_args()
+
+    source = f"openlibrary.org, q={args.live}" if args.live else f"fake docs with {args.isbns} ISBNs"
+    print(f"{args.runs} runs, {source}")
+    print(f"{'profile':<10} {'docs':>5} {'bytes':>9} {'bytes/doc':>10} {'parse ms':>9} {'us/doc':>8}")
+    for name, profile in SEARCH_PROFILES.items():
+        body = live_body(profile, args.live) if args.live else fake_body(profile, args.isbns)
+        seconds, docs = time_parse(body, profile, args.runs)
+        print(f"{name:<10} {docs:>5} {len(body):>9} {len(body) // max(docs, 1):>10} "
+              f"{seconds * 1000:>9.3f} {seconds * 1e6 / max(docs, 1):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Search time-to-first-result benchmark
+
+Serves a fake search.json locally whose response time grows with the
+number of docs asked for (like openlibrary.org's does), then times how long
+keyword_search and stream_search take to hand out their first result and
+the whole page.
+
+    python bench_search_stream.py [--runs 10] [--base-ms 150] [--per-doc-ms 4]
+"""
+
+import argparse
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import open_library
+
+
+def fake_docs(count, offset):
+    return [{
+        "key": f"/works/OL{offset + num}W",
+        "title": f"Book {offset + num}",
+        "author_name": ["Author"],
+        "isbn": [f"{9780000000000 + offset + num}"],
+        "cover_i": offset + num,
+    } for num in range(count)]
+
+
+def make_handler(base_ms, per_doc_ms):
+    class SearchHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            limit = int(query["limit"][0])
+            offset = int(query.get("offset", [0])[0])
+            time.sleep((base_ms + per_doc_ms * limit) / 1000)
+
+            body = json.dumps({"numFound": 1000, "start": offset, "docs": fake_docs(limit, offset)}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return SearchHandler
+
+
+def time_search(search):
+    """Seconds until the first work and until the whole page"""
+
+    start = time.perf_counter()
+    first = None
+    for _ in search():
+        if first is None:
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+def full_page(term):
+    yield from open_library.keyword_search(term)["works"]
+
+
+def streamed_page(term):
+    for name, value in open_library.stream_search(term):
+        if name == "works":
+            yield from value
+
+
+def report(name, samples):
+    print(f"{name:<24} median {statistics.median(samples) * 1000:8.1f} ms"
+          f"   min {min(samples) * 1000:8.1f} ms   max {max(samples) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--base-ms", type=float, default=150)
+    parser.add_argument("--per-doc-ms", type=float, default=4)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(args.base_ms, args.per_doc_ms))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    open_library.BASE_URL = f"http://127.0.0.1:{server.server_address[1]}"
+
+    results = {"keyword_search": ([], []), "stream_search": ([], [])}
+    for run in range(args.runs):
+        for name, search in (("keyword_search", full_page), ("stream_search", streamed_page)):
+            # a new term every run, nothing comes from the cache
+            first, total = time_search(lambda: search(f"{name} {run}"))
+            results[name][0].append(first)
+            results[name][1].append(total)
+
+    server.shutdown()
+    print(f"{args.runs} runs, upstream {args.base_ms:g} ms + {args.per_doc_ms:g} ms per doc")
+    for name, (firsts, totals) in results.items():
+        report(f"{name} first", firsts)
+        report(f"{name} page", totals)
+
+
+if __name__ == "__main__":
+    main()
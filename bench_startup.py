@@ -0,0 +1,64 @@
+"""Worker cold start benchmark
+
+Times `import app` in fresh interpreters, which is what every gunicorn
+worker, test module and flask command pays before serving anything.
+
+    python bench_startup.py [--runs 10]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+IMPORT_APP = """
+import time
+start = time.perf_counter()
+import app
+print(time.perf_counter() - start)
+"""
+
+CREATE_APP = """
+import time
+import app
+start = time.perf_counter()
+app.create_app()
+print(time.perf_counter() - start)
+"""
+
+
+def time_in_subprocess(code):
+    """Seconds measured inside a fresh interpreter and the wall time around it"""
+
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    wall = time.perf_counter() - start
+    return float(result.stdout.strip().splitlines()[-1]), wall
+
+
+def report(name, samples):
+    print(f"{name:<12} median {statistics.median(samples) * 1000:8.1f} ms"
+          f"   min {min(samples) * 1000:8.1f} ms   max {max(samples) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    imports, walls, creates = [], [], []
+    for _ in range(args.runs):
+        seconds, wall = time_in_subprocess(IMPORT_APP)
+        imports.append(seconds)
+        walls.append(wall)
+        creates.append(time_in_subprocess(CREATE_APP)[0])
+
+    print(f"{args.runs} runs")
+    report("import app", imports)
+    report("process", walls)
+    report("create_app", creates)
+
+
+if __name__ == "__main__":
+    main()
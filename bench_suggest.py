@@ -0,0 +1,94 @@
+"""Search suggestion latency benchmark
+
+Fills a suggest.SuggestIndex with generated saved books and remote works,
+then times lookups for prefixes typed a character at a time, how long
+indexing one more book takes once it is full, and how long remembering a
+page of search results takes once the remote works are at their cap (each
+page pushes out as many older works).
+
+    python bench_suggest.py [--books 50000] [--remote 5000] [--lookups 20000] [--page 100]
+"""
+
+import argparse
+import random
+import time
+from types import SimpleNamespace
+
+from suggest import SuggestIndex
+
+WORDS = ("the", "of", "and", "night", "dark", "house", "river", "war", "peace", "dune", "garden", "secret",
+         "history", "moon", "empire", "winter", "stone", "city", "ghost", "queen", "sea", "fire", "last", "little",
+         "lost", "island", "book", "children", "time", "song", "machine", "world", "shadow", "light", "bridge")
+NAMES = ("Frank", "Ursula", "Toni", "Octavia", "Kazuo", "Iain", "Zadie", "Herbert", "Le Guin", "Morrison",
+         "Butler", "Ishiguro", "Banks", "Smith", "Hartley", "Moore", "Atwood", "Pratchett", "Mantel", "Tolkien")
+
+
+def fake_title(rand):
+    return " ".join(rand.choice(WORDS) for _ in range(rand.randint(1, 5))).title() + f" {rand.randint(1, 999)}"
+
+
+def fake_author(rand):
+    return f"{rand.choice(NAMES)} {rand.choice(NAMES)}"
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def report(name, samples):
+    print(f"{name:<16} p50 {percentile(samples, 50) * 1e6:8.1f} us   p99 {percentile(samples, 99) * 1e6:8.1f} us"
+          f"   max {max(samples) * 1e6:8.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=50000)
+    parser.add_argument("--remote", type=int, default=5000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--page", type=int, default=100, help="works per search page")
+    args = parser.parse_args()
+
+    rand = random.Random(0)
+    index = SuggestIndex(remote_max=args.remote)
+
+    start = time.perf_counter()
+    index.add_books(SimpleNamespace(olid=f"OL{num}M", title=fake_title(rand), author=fake_author(rand))
+                    for num in range(args.books))
+    index.add_works([{"olid": f"OL{num}W", "title": fake_title(rand), "author_name": fake_author(rand)}
+                     for num in range(args.remote)])
+    print(f"{len(index)} books, {len(index._keys)} keys, built in {time.perf_counter() - start:.2f} s")
+
+    # what someone typing a title or author sends, one request per character
+    typed = []
+    while len(typed) < args.lookups:
+        text = fake_title(rand) if rand.random() < 0.7 else fake_author(rand)
+        typed.extend(text[:length] for length in range(2, min(len(text), 12) + 1))
+
+    samples = []
+    for prefix in typed[:args.lookups]:
+        start = time.perf_counter()
+        index.suggest(prefix)
+        samples.append(time.perf_counter() - start)
+    report("suggest", samples)
+
+    samples = []
+    for num in range(1000):
+        book = SimpleNamespace(olid=f"OLnew{num}M", title=fake_title(rand), author=fake_author(rand))
+        start = time.perf_counter()
+        index.add_books([book])
+        samples.append(time.perf_counter() - start)
+    report("add one book", samples)
+
+    samples = []
+    for num in range(200):
+        works = [{"olid": f"OLpage{num}x{i}W", "title": fake_title(rand), "author_name": fake_author(rand)}
+                 for i in range(args.page)]
+        start = time.perf_counter()
+        index.add_works(works)
+        samples.append(time.perf_counter() - start)
+    report(f"add {args.page} works", samples)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+"""Two-tier TTL cache for Open Library data
+
+A small in-process LRU sits in front of an optional shared backend that all
+workers can see. Values are stored as JSON so every read hands back a fresh
+copy that callers are free to modify.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """In-process LRU cache bounded by entry count and total bytes"""
+
+    def __init__(self, max_entries=1024, max_bytes=8 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the stored string for key or None if missing or expired"""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        """Store the string value for ttl seconds, evicting the oldest entries"""
+
+        size = len(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, time.time() + ttl)
+            self.num_bytes += size
+
+            while len(self._entries) > self.max_entries or self.num_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def delete(self, key):
+        """Remove key if present"""
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        """Remove everything"""
+
+        with self._lock:
+            self._entries.clear()
+            self.num_bytes = 0
+
+    def _remove(self, key):
+        value, expires_at = self._entries.pop(key)
+        self.num_bytes -= len(value)
+
+
+#
+# Shared backends
+#
+
+class MemoryBackend:
+    """Shared cache stand-in that lives in this process (tests, single worker)"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+
+    def add(self, key, value, ttl):
+        """Set key only if it is missing or expired, returns True if it was set"""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                return False
+
+            self._entries[key] = (value, time.time() + ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend:
+    """Shared cache kept in a SQLite file that every worker on the host can open"""
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            value, expires_at = row
+            if expires_at <= time.time():
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl))
+
+    def add(self, key, value, ttl):
+        """Set key only if it is missing or expired, returns True if it was set"""
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ? AND expires_at <= ?", (key, now))
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, now + ttl))
+            return cursor.rowcount == 1
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+
+    def purge_expired(self):
+        """Drop expired rows, returns the number removed"""
+
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+            return cursor.rowcount
+
+
+class RedisBackend:
+    """Shared cache on a Redis server, client is any redis-py compatible client"""
+
+    def __init__(self, client, prefix="olreader:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(f"{self.prefix}{key}")
+        if isinstance(value, bytes):
+            value = value.decode("utf-8")
+        return value
+
+    def set(self, key, value, ttl):
+        self.client.setex(f"{self.prefix}{key}", max(int(ttl), 1), value)
+
+    def add(self, key, value, ttl):
+        return bool(self.client.set(f"{self.prefix}{key}", value, ex=max(int(ttl), 1), nx=True))
+
+    def delete(self, key):
+        self.client.delete(f"{self.prefix}{key}")
+
+    def clear(self):
+        for key in self.client.scan_iter(f"{self.prefix}*"):
+            self.client.delete(key)
+
+
+def backend_from_url(url):
+    """
+    Build a shared backend from a url like:
+    memory://, sqlite:///path/to/cache.db or redis://host:6379/0
+
+    returns None for an empty url (local LRU only)
+    """
+
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return MemoryBackend()
+    if url.startswith("sqlite://"):
+        path = url[len("sqlite:///"):] or ":memory:"
+        return SQLiteBackend(path)
+    if url.startswith("redis://"):
+        import redis  # only needed when a Redis cache is configured
+        return RedisBackend(redis.Redis.from_url(url))
+
+    raise ValueError(f"Unsupported cache backend: {url}")
+
+
+#
+# Two-tier cache
+#
+
+class TieredCache:
+    """Per-worker LRU in front of an optional shared backend, with hit/miss counters"""
+
+    def __init__(self, local=None, backend=None):
+        self.local = local if local is not None else LRUCache()
+        self.backend = backend
+        self.local_hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, key):
+        """Return a fresh copy of the cached value or None"""
+
+        value = self.local.get(key)
+        if value is not None:
+            self._count("local_hits")
+            return json.loads(value)
+
+        if self.backend is not None:
+            entry = self.backend.get(key)
+            if entry is not None:
+                self._count("backend_hits")
+                stored = json.loads(entry)
+                # keep the local copy no longer than the shared one
+                ttl = stored["expires_at"] - time.time()
+                if ttl > 0:
+                    self.local.set(key, json.dumps(stored["value"]), ttl)
+                return stored["value"]
+
+        self._count("misses")
+        return None
+
+    def set(self, key, value, ttl):
+        """Cache a JSON serializable value in both tiers for ttl seconds"""
+
+        serialized = json.dumps(value)
+        self.local.set(key, serialized, ttl)
+
+        if self.backend is not None:
+            entry = json.dumps({"value": value, "expires_at": time.time() + ttl})
+            self.backend.set(key, entry, ttl)
+
+    def delete(self, key):
+        """Remove key from both tiers"""
+
+        self.local.delete(key)
+        if self.backend is not None:
+            self.backend.delete(key)
+
+    def clear(self):
+        """Empty both tiers and reset the counters"""
+
+        self.local.clear()
+        if self.backend is not None:
+            self.backend.clear()
+
+        with self._stats_lock:
+            self.local_hits = 0
+            self.backend_hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Hit/miss counters and the size of the local tier"""
+
+        with self._stats_lock:
+            hits = self.local_hits + self.backend_hits
+            total = hits + self.misses
+
+            return {
+                "local_hits": self.local_hits,
+                "backend_hits": self.backend_hits,
+                "misses": self.misses,
+                "hit_ratio": hits / total if total else 0.0,
+                "local_entries": len(self.local),
+                "local_bytes": self.local.num_bytes,
+            }
+
+    def _count(self, counter):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+#
+# Request collapsing
+#
+
+class _Call:
+    """One in-flight call that other callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one: the first caller
+    runs the function and everyone else waiting on that key gets its result
+    (or exception). The result object is shared, copy it before modifying.
+
+    With a shared backend the callers in other workers are collapsed too:
+    one worker holds a lock in the backend while it calls fn and the others
+    wait for the JSON serialized result it leaves behind.
+    """
+
+    def __init__(self, backend=None, lock_ttl=15, result_ttl=2, poll_interval=0.05):
+        self.backend = backend
+        self.lock_ttl = lock_ttl
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.collapsed = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) unless a call for key is already running"""
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self.collapsed += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            if self.backend is not None:
+                call.result = self._do_shared(key, fn, *args, **kwargs)
+            else:
+                call.result = fn(*args, **kwargs)
+        except BaseException as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+    def _do_shared(self, key, fn, *args, **kwargs):
+        """Run fn in at most one worker at a time, the rest wait for its result"""
+
+        lock_key = f"flight-lock:{key}"
+        result_key = f"flight-result:{key}"
+        deadline = time.monotonic() + self.lock_ttl
+
+        while True:
+            stored = self.backend.get(result_key)
+            if stored is not None:
+                self.collapsed += 1
+                return json.loads(stored)
+
+            if self.backend.add(lock_key, "1", self.lock_ttl):
+                try:
+                    result = fn(*args, **kwargs)
+                    self.backend.set(result_key, json.dumps(result), self.result_ttl)
+                    return result
+                finally:
+                    self.backend.delete(lock_key)
+
+            # another worker is on it, unless it takes too long
+            if time.monotonic() >= deadline:
+                return fn(*args, **kwargs)
+            time.sleep(self.poll_interval)
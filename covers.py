@@ -0,0 +1,151 @@
+"""Cover image proxy with an on-disk, content-addressed cache"""
+
+import hashlib
+import io
+import os
+import re
+import tempfile
+import time
+
+from cache import SingleFlight
+from open_library import COVERS_URL, resilient_get, work_type
+
+try:
+    from PIL import Image
+except ImportError:  # WebP variants need Pillow, JPEG is served as is
+    Image = None
+
+COVER_CACHE_DIR = os.getenv("COVER_CACHE_DIR", os.path.join(tempfile.gettempdir(), "olreader-covers"))
+COVER_KINDS = ("id", "olid", "isbn")
+COVER_SIZES = ("S", "M", "L")
+
+# How long to remember that Open Library has no cover before asking again
+MISSING_TTL = 24 * 60 * 60
+
+COVER_URL_RE = re.compile(rf"^{re.escape(COVERS_URL)}/[bw]/(id|olid|isbn)/([^/]+)$")
+
+
+def proxy_cover_url(cover_url, size="M"):
+    """Turn a covers.openlibrary.org url into a /covers/ url for size"""
+
+    match = COVER_URL_RE.match(cover_url or "")
+    if match is None:
+        return f"{cover_url}-{size}.jpg"
+
+    kind, cover_key = match.groups()
+    return f"/covers/{kind}/{cover_key}-{size}.jpg"
+
+
+def upstream_cover_url(kind, cover_key, size):
+    """covers.openlibrary.org url, 404s instead of a blank image when missing"""
+
+    img_type = "w" if kind == "olid" and work_type(cover_key) == "works" else "b"
+    return f"{COVERS_URL}/{img_type}/{kind}/{cover_key}-{size}.jpg?default=false"
+
+
+class CoverCache:
+    """
+    Image bytes are stored once under their sha256 in blobs/, and a small
+    index file per cover variant points at the blob (or records a miss)
+    """
+
+    def __init__(self, root=COVER_CACHE_DIR):
+        self.root = root
+        self.flight = SingleFlight()
+
+    def get(self, kind, cover_key, size, fmt="jpeg"):
+        """
+        Return (path, digest) for the cover variant, fetching it once
+
+        returns None when Open Library has no cover, raises
+        requests.RequestException when it can't be reached
+        """
+
+        variant = f"{kind}/{cover_key}-{size}.{fmt}"
+        entry = self._lookup(variant)
+        if entry is not None:
+            return entry if entry != "missing" else None
+
+        return self.flight.do(variant, self._fill, kind, cover_key, size, fmt)
+
+    def _fill(self, kind, cover_key, size, fmt):
+        variant = f"{kind}/{cover_key}-{size}.{fmt}"
+        original = self._lookup(f"{kind}/{cover_key}-{size}.jpeg")
+
+        if original is None:
+            # through the breaker, retry budget and rate limit like every
+            # other Open Library GET, errors reach the caller uncached
+            response = resilient_get(upstream_cover_url(kind, cover_key, size))
+            if response.status_code == 404:
+                self._store_index(f"{kind}/{cover_key}-{size}.jpeg", "missing")
+                original = "missing"
+            else:
+                response.raise_for_status()
+                original = self._store(f"{kind}/{cover_key}-{size}.jpeg", response.content, "jpg")
+
+        if original == "missing":
+            if fmt != "jpeg":
+                self._store_index(variant, "missing")
+            return None
+
+        if fmt == "jpeg":
+            return original
+
+        path, digest = original
+        with Image.open(path) as image:
+            buffer = io.BytesIO()
+            image.convert("RGB").save(buffer, format="WEBP", quality=80)
+        return self._store(variant, buffer.getvalue(), "webp")
+
+    def _store(self, variant, data, ext):
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.root, "blobs", digest[:2], f"{digest}.{ext}")
+        if not os.path.exists(path):
+            self._write(path, data)
+
+        self._store_index(variant, path)
+        return path, digest
+
+    def _store_index(self, variant, target):
+        self._write(self._index_path(variant), target.encode("utf-8"))
+
+    def _lookup(self, variant):
+        """(path, digest), "missing" or None when the variant isn't cached"""
+
+        index_path = self._index_path(variant)
+        try:
+            with open(index_path, encoding="utf-8") as index_file:
+                target = index_file.read()
+        except FileNotFoundError:
+            return None
+
+        if target == "missing":
+            if os.path.getmtime(index_path) + MISSING_TTL < time.time():
+                return None
+            return "missing"
+
+        if not os.path.exists(target):
+            return None
+        return target, os.path.basename(target).split(".")[0]
+
+    def _index_path(self, variant):
+        name = hashlib.sha256(variant.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, "index", name[:2], name)
+
+    def _write(self, path, data):
+        """Write through a temp file so readers never see partial files"""
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+
+
+def webp_supported():
+    """WebP variants can be made"""
+
+    return Image is not None
+
+
+cover_cache = CoverCache()
@@ -0,0 +1,179 @@
+"""Database connection pool settings and stats
+
+Pool settings come from a named preset (DB_POOL_PRESET) and can be
+overridden one at a time from the environment:
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT (milliseconds, 0 for none)
+
+The pool times every checkout, so waits for a free connection show up in
+pool_stats() instead of as unexplained latency.
+"""
+
+import functools
+import os
+import threading
+import time
+
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+
+from models import db
+
+POOL_PRESETS = {
+    # SQLAlchemy's defaults, plus pre-ping so a restarted local db doesn't error
+    "development": {
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_timeout": 30,
+        "pool_recycle": -1,
+        "pool_pre_ping": True,
+        "statement_timeout": 0,
+    },
+    # per worker: a steady pool, little overflow, fail fast when exhausted
+    # and drop connections before the server or a proxy does
+    "production": {
+        "pool_size": 10,
+        "max_overflow": 5,
+        "pool_timeout": 5,
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+        "statement_timeout": 15000,
+    },
+    # many workers sharing a small connection limit (hobby plans, pgbouncer)
+    "small": {
+        "pool_size": 2,
+        "max_overflow": 2,
+        "pool_timeout": 10,
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+        "statement_timeout": 15000,
+    },
+}
+
+ENV_SETTINGS = {
+    "pool_size": ("DB_POOL_SIZE", int),
+    "max_overflow": ("DB_MAX_OVERFLOW", int),
+    "pool_timeout": ("DB_POOL_TIMEOUT", float),
+    "pool_recycle": ("DB_POOL_RECYCLE", int),
+    "pool_pre_ping": ("DB_POOL_PRE_PING", lambda value: value.lower() in ("1", "true", "yes", "on")),
+    "statement_timeout": ("DB_STATEMENT_TIMEOUT", int),
+}
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+    def stats(self):
+        """Checked out and overflow connections and the checkout wait times"""
+
+        with self._stats_lock:
+            return {
+                "size": self.size(),
+                "checked_in": self.checkedin(),
+                "checked_out": self.checkedout(),
+                "overflow": max(self.overflow(), 0),
+                "max_overflow": self._max_overflow,
+                "timeout": self.timeout(),
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_total_ms": round(self.wait_total * 1000, 3),
+                "wait_avg_ms": round(self.wait_total * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+            }
+
+
+def pool_settings(environ=os.environ):
+    """The preset named by DB_POOL_PRESET with any DB_* overrides applied"""
+
+    preset = environ.get("DB_POOL_PRESET", "development")
+    if preset not in POOL_PRESETS:
+        raise ValueError(f"Unknown DB_POOL_PRESET: {preset}")
+
+    settings = dict(POOL_PRESETS[preset])
+    for name, (env_name, convert) in ENV_SETTINGS.items():
+        if environ.get(env_name):
+            settings[name] = convert(environ[env_name])
+
+    return settings
+
+
+def engine_options(settings):
+    """SQLALCHEMY_ENGINE_OPTIONS for the pool settings"""
+
+    options = {key: value for key, value in settings.items() if key != "statement_timeout"}
+    options["poolclass"] = TimedQueuePool
+
+    # the server applies it to every statement, no extra round trip
+    if settings["statement_timeout"]:
+        options["connect_args"] = {"options": f"-c statement_timeout={settings['statement_timeout']}"}
+
+    return options
+
+
+def pool_stats(engine):
+    """Stats for the engine's pool, only the size for pools that aren't timed"""
+
+    pool = engine.pool
+    if isinstance(pool, TimedQueuePool):
+        return pool.stats()
+    return {"status": pool.status()}
+
+
+def statement_timeout(milliseconds):
+    """
+    View decorator, statements the view runs get their own timeout instead
+    of the connection default. Applied when a transaction begins, so views
+    that never touch the db don't pay for it.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            g.statement_timeout = milliseconds
+            if db.session().in_transaction():
+                # begun before the view ran (loading the principal)
+                set_statement_timeout(db.session.connection(), milliseconds)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def set_statement_timeout(connection, milliseconds):
+    """statement_timeout for the rest of the connection's transaction"""
+
+    connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(milliseconds)}")
+
+
+@event.listens_for(Session, "after_begin")
+def apply_statement_timeout(session, transaction, connection):
+    """Every transaction a decorated view begins gets its timeout"""
+
+    if has_request_context() and g.get("statement_timeout"):
+        set_statement_timeout(connection, g.statement_timeout)
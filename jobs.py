@@ -0,0 +1,404 @@
+"""Background jobs
+
+Work that doesn't have to finish before the response (fetching a book's
+details from Open Library) is queued and run by worker threads. The queue
+is a SQLite file (JOBS_URL, sqlite:///path/to/jobs.db) that every worker
+process on the host shares, so jobs survive a restart and any worker can
+run them. sqlite:// keeps the queue in memory for a single process. The
+queue is opened the first time a job is queued or run, not on import.
+
+    from jobs import job, enqueue
+
+    @job("enrich_book")
+    def enrich_book(olid):
+        ...
+
+    enqueue("enrich_book", {"olid": olid}, key=f"enrich_book:{olid}")
+
+Jobs are keyed: enqueueing a key that is already queued or running does
+nothing. Failed jobs are retried with exponential backoff and jitter up to
+JOB_MAX_ATTEMPTS times, and a job whose worker died is picked up again once
+its lease runs out. Workers start in the web process on the first enqueue
+(JOB_WORKERS threads, 0 for none) or run on their own with `flask jobs-work`.
+"""
+
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from ratelimit import BACKGROUND, priority
+
+JOBS_URL = os.getenv("JOBS_URL", f"sqlite:///{os.path.join(tempfile.gettempdir(), 'olreader-jobs.db')}")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+# seconds before the first retry, doubled after every failure up to the max
+JOB_BACKOFF = float(os.getenv("JOB_BACKOFF", 2))
+JOB_MAX_BACKOFF = float(os.getenv("JOB_MAX_BACKOFF", 5 * 60))
+# seconds a worker may hold a job before another worker takes it over
+JOB_LEASE = float(os.getenv("JOB_LEASE", 60))
+# seconds an idle worker sleeps before looking for jobs queued by other processes
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1))
+# seconds finished jobs are kept for stats
+JOB_KEEP_FINISHED = float(os.getenv("JOB_KEEP_FINISHED", 60 * 60))
+
+Job = namedtuple("Job", ["id", "kind", "key", "payload", "attempts", "enqueued_at"])
+
+HANDLERS = {}
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying can't help"""
+
+
+def job(kind):
+    """Register the decorated function as the handler for kind"""
+
+    def decorator(handler):
+        HANDLERS[kind] = handler
+        return handler
+    return decorator
+
+
+def percentile(values, fraction):
+    """Value at fraction (0..1) of the sorted values, 0.0 when empty"""
+
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class JobQueue:
+    """Keyed job queue kept in a SQLite file every worker on the host can open"""
+
+    def __init__(self, path=":memory:", max_attempts=JOB_MAX_ATTEMPTS, backoff=JOB_BACKOFF,
+                 max_backoff=JOB_MAX_BACKOFF, lease=JOB_LEASE):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+        # set on enqueue so this process's workers don't wait out the poll
+        self.available = threading.Event()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, kind TEXT NOT NULL, "
+            "payload TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL, "
+            "run_at REAL NOT NULL, lease_until REAL, enqueued_at REAL NOT NULL, "
+            "started_at REAL, finished_at REAL, error TEXT)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_status_run_at ON jobs (status, run_at)")
+
+    def enqueue(self, kind, payload, key=None, delay=0.0):
+        """
+        Queue kind(**payload), returns False if key is already queued or running
+
+        A key whose last job finished or failed is queued again.
+        """
+
+        key = key or f"{kind}:{uuid.uuid4().hex}"
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (key, kind, payload, status, attempts, run_at, enqueued_at) "
+                "VALUES (?, ?, ?, 'queued', 0, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET kind = excluded.kind, payload = excluded.payload, "
+                "status = 'queued', attempts = 0, run_at = excluded.run_at, lease_until = NULL, "
+                "enqueued_at = excluded.enqueued_at, started_at = NULL, finished_at = NULL, error = NULL "
+                "WHERE jobs.status IN ('done', 'failed')",
+                (key, kind, json.dumps(payload), now + delay, now))
+            queued = cursor.rowcount == 1
+
+        if queued:
+            self.available.set()
+        return queued
+
+    def claim(self):
+        """
+        Lease the next job that is due, or one whose lease ran out
+
+        returns a Job or None when nothing is due
+        """
+
+        now = time.time()
+        with self._lock:
+            # a job that keeps killing its worker stops being retried
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, error = 'lease expired' "
+                "WHERE status = 'running' AND lease_until <= ? AND attempts >= ?",
+                (now, now, self.max_attempts))
+            row = self._conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, "
+                "lease_until = ?, started_at = ? "
+                "WHERE id = (SELECT id FROM jobs "
+                "WHERE (status = 'queued' AND run_at <= ?) OR (status = 'running' AND lease_until <= ?) "
+                "ORDER BY run_at LIMIT 1) "
+                "RETURNING id, kind, key, payload, attempts, enqueued_at",
+                (now + self.lease, now, now, now)).fetchone()
+
+        if row is None:
+            return None
+        return Job(row[0], row[1], row[2], json.loads(row[3]), row[4], row[5])
+
+    def complete(self, job):
+        """Mark a claimed job done, ignored if its lease was taken over"""
+
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'done', finished_at = ?, lease_until = NULL, error = NULL "
+                "WHERE id = ? AND status = 'running' AND attempts = ?",
+                (time.time(), job.id, job.attempts))
+
+    def fail(self, job, error, retry=True):
+        """Queue a claimed job again after a backoff, or mark it failed for good"""
+
+        now = time.time()
+        if retry and job.attempts < self.max_attempts:
+            status, run_at, finished_at = "queued", now + self.retry_delay(job.attempts), None
+        else:
+            status, run_at, finished_at = "failed", now, now
+
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, run_at = ?, finished_at = ?, lease_until = NULL, error = ? "
+                "WHERE id = ? AND status = 'running' AND attempts = ?",
+                (status, run_at, finished_at, str(error)[:1000], job.id, job.attempts))
+
+    def retry_delay(self, attempts):
+        """Exponential backoff, jittered so retries after an outage spread out"""
+
+        delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def purge(self, older_than=JOB_KEEP_FINISHED):
+        """Drop jobs that finished more than older_than seconds ago, returns the number removed"""
+
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at <= ?",
+                (time.time() - older_than,))
+            return cursor.rowcount
+
+    def clear(self):
+        """Remove every job"""
+
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs")
+
+    def stats(self, window=15 * 60):
+        """
+        Queue depth by status, age of the oldest due job, and the latency
+        (enqueue to done) and run time of jobs finished in the last window
+        seconds, in milliseconds
+        """
+
+        now = time.time()
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, count(*) FROM jobs GROUP BY status").fetchall())
+            retrying = self._conn.execute(
+                "SELECT count(*) FROM jobs WHERE status = 'queued' AND attempts > 0").fetchone()[0]
+            oldest = self._conn.execute(
+                "SELECT min(run_at) FROM jobs WHERE status = 'queued' AND run_at <= ?", (now,)).fetchone()[0]
+            finished = self._conn.execute(
+                "SELECT finished_at - enqueued_at, finished_at - started_at FROM jobs "
+                "WHERE status = 'done' AND finished_at > ? ORDER BY finished_at DESC LIMIT 1000",
+                (now - window,)).fetchall()
+
+        latencies = [row[0] * 1000 for row in finished]
+        run_times = [row[1] * 1000 for row in finished]
+        return {
+            "queued": counts.get("queued", 0),
+            "retrying": retrying,
+            "running": counts.get("running", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "oldest_due_age_ms": round((now - oldest) * 1000, 3) if oldest is not None else 0.0,
+            "finished_in_window": len(finished),
+            "latency_p50_ms": round(percentile(latencies, 0.5), 3),
+            "latency_p95_ms": round(percentile(latencies, 0.95), 3),
+            "latency_max_ms": round(max(latencies, default=0.0), 3),
+            "run_avg_ms": round(sum(run_times) / len(run_times), 3) if run_times else 0.0,
+        }
+
+
+def queue_from_url(url):
+    """JobQueue for a url like sqlite:///path/to/jobs.db, sqlite:// for memory"""
+
+    if not url.startswith("sqlite://"):
+        raise ValueError(f"Unsupported job queue: {url}")
+    return JobQueue(url[len("sqlite:///"):] or ":memory:")
+
+
+_queues_lock = threading.Lock()
+
+
+def get_job_queue(app=None):
+    """
+    The app's queue, opened from its JOBS_URL config (the JOBS_URL
+    environment variable by default) on first use
+    """
+
+    app = app or current_app._get_current_object()
+    queue = app.extensions.get("job_queue")
+    if queue is None:
+        with _queues_lock:
+            queue = app.extensions.get("job_queue")
+            if queue is None:
+                queue = app.extensions["job_queue"] = queue_from_url(app.config.get("JOBS_URL", JOBS_URL))
+
+    return queue
+
+
+#
+# Running jobs
+#
+
+def run_job(queue, job):
+    """
+    Run a claimed job with its handler, then complete or fail it. Its
+    upstream calls wait behind the ones pages are waiting on.
+    """
+
+    handler = HANDLERS.get(job.kind)
+    if handler is None:
+        queue.fail(job, f"No handler for {job.kind}", retry=False)
+        return
+
+    try:
+        with priority(BACKGROUND):
+            handler(**job.payload)
+    except PermanentJobError as err:
+        queue.fail(job, err, retry=False)
+    except Exception as err:
+        print(f"WARNING: Job {job.key} failed (attempt {job.attempts}): {err}")
+        queue.fail(job, err)
+    else:
+        queue.complete(job)
+
+
+def run_pending(app, queue=None, limit=None):
+    """Run due jobs until none are left (or limit ran), returns how many ran"""
+
+    queue = queue or get_job_queue(app)
+    ran = 0
+    while limit is None or ran < limit:
+        job = queue.claim()
+        if job is None:
+            break
+        # a fresh context per job, so each gets its own db session
+        with app.app_context():
+            run_job(queue, job)
+        ran += 1
+
+    return ran
+
+
+def work(app, queue, stop, poll_interval=JOB_POLL_INTERVAL):
+    """Worker loop, runs jobs until stop is set"""
+
+    last_purge = 0.0
+    while not stop.is_set():
+        queue.available.clear()
+        if run_pending(app, queue):
+            continue
+
+        if time.monotonic() - last_purge > 60:
+            queue.purge()
+            last_purge = time.monotonic()
+
+        queue.available.wait(poll_interval)
+
+
+_workers = []
+_workers_pid = None
+_workers_lock = threading.Lock()
+
+
+def start_workers(app, count=JOB_WORKERS, queue=None):
+    """Start count worker threads in this process, once (again after a fork)"""
+
+    global _workers, _workers_pid
+
+    if count <= 0:
+        return
+
+    with _workers_lock:
+        if _workers_pid == os.getpid():
+            return
+
+        _workers = [
+            threading.Thread(target=work, args=(app, queue or get_job_queue(app), threading.Event()),
+                name=f"job-worker-{num}", daemon=True)
+            for num in range(count)
+        ]
+        _workers_pid = os.getpid()
+        for worker in _workers:
+            worker.start()
+
+
+def enqueue(kind, payload, key=None):
+    """
+    Queue a job and make sure this process has workers to run it
+
+    Tests (app.testing) get no workers and run jobs with run_pending.
+    """
+
+    app = current_app._get_current_object()
+    queued = get_job_queue(app).enqueue(kind, payload, key)
+
+    if not app.testing:
+        start_workers(app)
+
+    return queued
+
+
+#
+# Commands
+#
+
+@click.command("jobs-work")
+@click.option("--once", is_flag=True, help="Run the jobs that are due and exit.")
+@click.option("--workers", default=JOB_WORKERS, show_default=True, help="Worker threads.")
+@with_appcontext
+def jobs_work_command(once, workers):
+    """Run background jobs."""
+
+    app = current_app._get_current_object()
+    if once:
+        click.echo(f"Ran {run_pending(app)} jobs.")
+        return
+
+    queue = get_job_queue(app)
+    stop = threading.Event()
+    threads = [threading.Thread(target=work, args=(app, queue, stop), daemon=True) for _ in range(max(workers, 1))]
+    for thread in threads:
+        thread.start()
+    click.echo(f"Running jobs with {len(threads)} workers, Ctrl+C to stop.")
+
+    try:
+        while True:
+            time.sleep(JOB_POLL_INTERVAL)
+    except KeyboardInterrupt:
+        stop.set()
+        queue.available.set()
+
+
+@click.command("jobs-stats")
+@with_appcontext
+def jobs_stats_command():
+    """Show job queue depth and latency."""
+
+    click.echo(json.dumps(get_job_queue().stats(), indent=2))
@@ -0,0 +1,121 @@
+"""Online-safe schema changes for migrations
+
+Plain op.create_index / ALTER TABLE take locks that block writes (or reads)
+for as long as the change runs, which on a big table is an outage. These
+helpers build indexes CONCURRENTLY outside the migration transaction, add
+constraints from prebuilt indexes, and backfill columns in small committed
+batches so no lock is held for long. Each step can be re-run after a failure.
+
+    from migration_helpers import create_index_concurrently
+
+    def upgrade():
+        create_index_concurrently("ix_books_author", "books", ["author"])
+"""
+
+import time
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def index_state(name):
+    """True if the index exists and is valid, False if invalid, None if missing"""
+
+    return op.get_bind().execute(sa.text(
+        "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name AND pg_catalog.pg_table_is_visible(c.oid)"), {"name": name}).scalar()
+
+
+def constraint_exists(name, table):
+    return op.get_bind().execute(sa.text(
+        "SELECT 1 FROM pg_constraint WHERE conname = :name AND conrelid = CAST(:table AS regclass)"),
+        {"name": name, "table": table}).scalar() is not None
+
+
+def create_index_concurrently(name, table, columns, unique=False, **kw):
+    """
+    CREATE INDEX CONCURRENTLY, reads and writes carry on while it builds
+
+    A build that failed part way leaves an invalid index behind, that one
+    is dropped and built again.
+    """
+
+    with op.get_context().autocommit_block():
+        state = index_state(name)
+        if state:
+            return
+        if state is False:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
+
+        op.create_index(name, table, columns, unique=unique, postgresql_concurrently=True, **kw)
+
+
+def drop_index_concurrently(name, table):
+    """DROP INDEX CONCURRENTLY if it exists"""
+
+    with op.get_context().autocommit_block():
+        op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+
+
+def add_unique_constraint_concurrently(name, table, columns):
+    """
+    Build the unique index concurrently, then attach it as a constraint,
+    which only needs a brief lock instead of a full table scan under lock
+    """
+
+    if constraint_exists(name, table):
+        return
+
+    create_index_concurrently(name, table, columns, unique=True)
+    op.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" UNIQUE USING INDEX "{name}"')
+
+
+def set_not_null(table, column):
+    """
+    SET NOT NULL without scanning the table under an exclusive lock
+
+    A NOT VALID check is added instantly and validated under a lock that
+    lets writes through, postgres then trusts it for the SET NOT NULL.
+    """
+
+    check = f"ck_{table}_{column}_not_null"
+    with op.get_context().autocommit_block():
+        if not constraint_exists(check, table):
+            op.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{check}" CHECK ("{column}" IS NOT NULL) NOT VALID')
+        op.execute(f'ALTER TABLE "{table}" VALIDATE CONSTRAINT "{check}"')
+        op.execute(f'ALTER TABLE "{table}" ALTER COLUMN "{column}" SET NOT NULL')
+        op.execute(f'ALTER TABLE "{table}" DROP CONSTRAINT "{check}"')
+
+
+def backfill(table, assignments, where, key="id", batch_size=5000, pause=0.0, params=None):
+    """
+    UPDATE table SET assignments WHERE where, batch_size rows at a time
+
+    Walks the table in key order and commits every batch, so row locks are
+    short lived and replicas keep up. pause sleeps between batches to leave
+    room for other traffic.
+
+    returns the number of rows updated
+    """
+
+    updated = 0
+    last_key = None
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        while True:
+            after = f' AND "{key}" > :last_key' if last_key is not None else ""
+            statement = sa.text(
+                f'UPDATE "{table}" SET {assignments} WHERE "{key}" IN ('
+                f'SELECT "{key}" FROM "{table}" WHERE ({where}){after} '
+                f'ORDER BY "{key}" LIMIT :batch_size) '
+                f'RETURNING "{key}"')
+            values = dict(params or {}, batch_size=batch_size, last_key=last_key)
+
+            rows = bind.execute(statement, values).fetchall()
+            if not rows:
+                return updated
+
+            updated += len(rows)
+            last_key = max(row[0] for row in rows)
+            if pause:
+                time.sleep(pause)
@@ -0,0 +1,76 @@
+"""initial schema
+
+The tables as db.create_all() built them before migrations. Databases
+created that way can skip this with `flask db stamp 0001`.
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-18 08:57:47.259752
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('books',
+    sa.Column('olid', sa.Text(), nullable=False),
+    sa.Column('isbn', sa.Text(), nullable=True),
+    sa.Column('title', sa.Text(), nullable=False),
+    sa.Column('author', sa.Text(), nullable=False),
+    sa.Column('cover_url', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('olid'),
+    sa.UniqueConstraint('isbn')
+    )
+
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('email', sa.Text(), nullable=False),
+    sa.Column('username', sa.Text(), nullable=False),
+    sa.Column('bio', sa.Text(), nullable=True),
+    sa.Column('password', sa.Text(), nullable=False),
+    sa.Column('is_admin', sa.Boolean(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email'),
+    sa.UniqueConstraint('username')
+    )
+    op.create_table('booklists',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.Text(), nullable=True),
+    sa.Column('blurb', sa.Text(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('booknotes',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('book_olid', sa.Text(), nullable=False),
+    sa.Column('read', sa.Boolean(), nullable=True),
+    sa.Column('note', sa.Text(), nullable=True),
+    sa.ForeignKeyConstraint(['book_olid'], ['books.olid'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('booklist_books',
+    sa.Column('booklist', sa.Integer(), nullable=False),
+    sa.Column('book_olid', sa.Text(), nullable=False),
+    sa.ForeignKeyConstraint(['book_olid'], ['books.olid'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['booklist'], ['booklists.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('booklist', 'book_olid')
+    )
+
+
+def downgrade():
+    op.drop_table('booklist_books')
+    op.drop_table('booknotes')
+    op.drop_table('booklists')
+    op.drop_table('users')
+    op.drop_table('books')
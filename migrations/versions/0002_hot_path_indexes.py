@@ -0,0 +1,38 @@
+"""hot path indexes
+
+Indexes for the lookups every book page, search response and profile runs,
+and one note per user and book. Built concurrently so the tables stay
+writable while they build.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 08:58:04.734805
+
+"""
+from alembic import op
+
+from migration_helpers import add_unique_constraint_concurrently, create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # keep the first note when a user ended up with two for the same book
+    op.execute(
+        "DELETE FROM booknotes a USING booknotes b "
+        "WHERE a.user_id = b.user_id AND a.book_olid = b.book_olid AND a.id > b.id")
+    add_unique_constraint_concurrently('uq_booknotes_user_book', 'booknotes', ['user_id', 'book_olid'])
+
+    create_index_concurrently('ix_booklists_user_id', 'booklists', ['user_id', 'id'])
+    create_index_concurrently('ix_booklist_books_book_olid', 'booklist_books', ['book_olid', 'booklist'])
+
+
+def downgrade():
+    drop_index_concurrently('ix_booklist_books_book_olid', 'booklist_books')
+    drop_index_concurrently('ix_booklists_user_id', 'booklists')
+    op.drop_constraint('uq_booknotes_user_book', 'booknotes', type_='unique')
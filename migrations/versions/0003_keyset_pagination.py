@@ -0,0 +1,37 @@
+"""keyset pagination
+
+booklist_books remembers when each book was added so list pages have a
+stable order, plus the indexes the paged list, notes and read books
+queries walk. now() is stable, so adding the column with it as the default
+doesn't rewrite the table (existing rows share the migration's timestamp
+and fall back to olid order).
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 10:12:31.418532
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migration_helpers import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('booklist_books', sa.Column('added_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False), if_not_exists=True)
+
+    create_index_concurrently('ix_booklist_books_added', 'booklist_books', ['booklist', 'added_at', 'book_olid'])
+    create_index_concurrently('ix_booknotes_user_id_id', 'booknotes', ['user_id', 'id'])
+
+
+def downgrade():
+    drop_index_concurrently('ix_booknotes_user_id_id', 'booknotes')
+    drop_index_concurrently('ix_booklist_books_added', 'booklist_books')
+    op.drop_column('booklist_books', 'added_at')
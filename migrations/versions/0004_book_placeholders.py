@@ -0,0 +1,28 @@
+"""book placeholders
+
+books.pending marks a book saved before its details came back from Open
+Library. A constant default is stored in the catalog, so adding the NOT
+NULL column doesn't rewrite the table.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 15:42:07.903114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('books', sa.Column('pending', sa.Boolean(), server_default=sa.false(), nullable=False), if_not_exists=True)
+
+
+def downgrade():
+    op.drop_column('books', 'pending')
@@ -0,0 +1,34 @@
+"""book updated_at
+
+books.updated_at lets the search suggestion index read back only the books
+that changed since it last looked. Like booklist_books.added_at, now() as
+the default doesn't rewrite the table; existing rows share the migration's
+timestamp.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 19:06:52.217340
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migration_helpers import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('books', sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False), if_not_exists=True)
+
+    create_index_concurrently('ix_books_updated_at', 'books', ['updated_at'])
+
+
+def downgrade():
+    drop_index_concurrently('ix_books_updated_at', 'books')
+    op.drop_column('books', 'updated_at')
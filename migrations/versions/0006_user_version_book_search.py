@@ -0,0 +1,42 @@
+"""user version and book search
+
+users.version, which logs out sessions from before an account edit, and
+the full text and trigram indexes local search runs on. 0001 is the
+schema create_all built before migrations, so databases stamped there get
+these too. A constant default is stored in the catalog, so the NOT NULL
+column is added without rewriting the table and every existing user
+starts at version 1. The indexes are built concurrently so books stays
+writable.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 21:14:36.508213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migration_helpers import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('version', sa.Integer(), server_default=sa.text('1'), nullable=False), if_not_exists=True)
+    # databases migrated before this revision already have the column
+    op.alter_column('users', 'version', server_default=sa.text('1'))
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    create_index_concurrently('ix_books_search', 'books', [sa.text("to_tsvector('english', title || ' ' || author)")], postgresql_using='gin')
+    create_index_concurrently('ix_books_search_trgm', 'books', [sa.text("(title || ' ' || author) gin_trgm_ops")], postgresql_using='gin')
+
+
+def downgrade():
+    drop_index_concurrently('ix_books_search_trgm', 'books')
+    drop_index_concurrently('ix_books_search', 'books')
+    op.drop_column('users', 'version')
@@ -1,20 +1,27 @@
 """Models for reader"""
 
+import os
 from datetime import datetime
 
 from flask_bcrypt import Bcrypt
+from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import insert
 
-from open_library import fetch_book_data
+from jobs import PermanentJobError, enqueue, job
+from open_library import cached_book_data, fetch_book_data, fetch_many_book_data, is_book_olid, work_type, BASE_URL
+from pagination import PAGE_SIZE, Page, keyset_page
 
 bcrypt = Bcrypt()
 db = SQLAlchemy()
+migrate = Migrate(directory=os.path.join(os.path.dirname(__file__), "migrations"))
 
 def connect_db(app):
     """Connect to database"""
 
     db.app = app
     db.init_app(app)
+    migrate.init_app(app, db)
 
 class User(db.Model):
     """User in the system."""
@@ -30,6 +37,10 @@ class User(db.Model):
 
     is_admin = db.Column(db.Boolean, default=False)
 
+    # bumped on every update, sessions from before an edit are logged out
+    version = db.Column(db.Integer, nullable=False, server_default=db.text("1"))
+    __mapper_args__ = {"version_id_col": version}
+
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
@@ -71,17 +82,46 @@ class User(db.Model):
 
         return False
 
+    @classmethod
+    def get_profile(cls, user_id):
+        """User with lists loaded in 2 queries, notes are paged with BookNote.page_for_user"""
+
+        return (cls.query
+            .options(db.selectinload(cls.lists))
+            .execution_options(populate_existing=True)
+            .filter_by(id=user_id)
+            .one())
+
 
 class Book(db.Model):
     """Book in the system."""
 
     __tablename__ = 'books'
+    __table_args__ = (
+        # full text search over title and author, trigrams catch typos
+        # (spelled the way postgres reports it so `flask db check` matches)
+        db.Index(
+            "ix_books_search",
+            db.text("to_tsvector('english'::regconfig, (title || ' '::text) || author)"),
+            postgresql_using="gin",
+        ),
+        db.Index(
+            "ix_books_search_trgm",
+            db.text("(title || ' ' || author) gin_trgm_ops"),
+            postgresql_using="gin",
+        ),
+        # search suggestions read back the books changed since they last looked
+        db.Index("ix_books_updated_at", "updated_at"),
+    )
 
     olid = db.Column(db.Text, primary_key=True)
     isbn = db.Column(db.Text, unique=True)
     title = db.Column(db.Text, nullable=False)
     author = db.Column(db.Text, nullable=False)
     cover_url = db.Column(db.Text) # if None uses font awesome icon
+    # placeholder waiting for its details from Open Library
+    pending = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    updated_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now(), onupdate=db.func.now())
 
     def display_book(self):
         """Title by Author"""
@@ -102,30 +142,145 @@ class Book(db.Model):
             "cover_url": self.cover_url,
         }
         return book_dict
+
+    def to_search_result(self):
+        """return a dict in the same format as open_library.parse_search_data"""
+
+        return {
+            "workid": self.olid,
+            "olid": self.olid,
+            "isbn": self.isbn,
+            "title": self.title,
+            "author_name": self.author,
+            "cover_url": self.cover_url,
+            "book_url": f"{BASE_URL}/{work_type(self.olid)}/{self.olid}",
+        }
+
+    @classmethod
+    def search_local(cls, term, limit=20):
+        """
+        Search saved books by title and author
+
+        Uses the full text index and falls back to trigram similarity
+        when nothing matches (typos, partial words).
+        """
+
+        document = cls.title + " " + cls.author
+        vector = db.func.to_tsvector(db.literal_column("'english'"), document)
+        query = db.func.websearch_to_tsquery(db.literal_column("'english'"), term)
+
+        books = (cls.query
+            .filter(vector.op("@@")(query))
+            .order_by(db.func.ts_rank(vector, query).desc(), cls.olid)
+            .limit(limit)
+            .all())
+
+        if len(books) == 0:
+            books = (cls.query
+                .filter(db.literal(term).op("<%")(document.self_group()))
+                .order_by(db.func.word_similarity(term, document).desc(), cls.olid)
+                .limit(limit)
+                .all())
+
+        return books
+
+    @classmethod
+    def read_by(cls, user_id, after=None, limit=PAGE_SIZE):
+        """Page of the books the user marked read, in the order the notes were made"""
+
+        query = (db.session.query(cls, BookNote.id)
+            .join(BookNote, BookNote.book_olid == cls.olid)
+            .filter(BookNote.user_id == user_id, BookNote.read == True))
+
+        page = keyset_page(query, [BookNote.id], lambda row: [row.id], after, limit)
+        return Page([row.Book for row in page.items], page.next_cursor)
     
+    @staticmethod
+    def row_from_data(book_data, isbn=None):
+        """Column values for a book from open_library.fetch_many_book_data"""
+
+        return {
+            "olid": book_data["olid"],
+            "isbn": isbn,
+            "title": book_data["title"],
+            "author": (book_data.get("authors") or ["Unknown"])[0],
+            "cover_url": book_data.get("cover_url"),
+        }
+
     @classmethod
-    def create_book(cls, olid, isbn):
-        """Fetch the relevant data and create a book"""
+    def create_placeholder(cls, olid, isbn=None):
+        """
+        Create the book without waiting on Open Library
+
+        Uses the cached details when there are some, otherwise saves a
+        pending placeholder and queues a job to fill it in. Safe to call
+        again for the same olid. Raises ValueError for olids that aren't
+        an edition or work id.
+        """
+
+        if not is_book_olid(olid):
+            raise ValueError(f"Not a book olid: {olid}")
+
+        fetched_data = cached_book_data(olid)
+        if fetched_data is not None and fetched_data.get("title"):
+            values = cls.row_from_data(dict(fetched_data, olid=olid), isbn or None)
+        else:
+            values = {"olid": olid, "isbn": isbn or None, "title": olid, "author": "Unknown", "pending": True}
+
+        db.session.execute(insert(cls).values(values).on_conflict_do_nothing(index_elements=[cls.olid]))
+        db.session.commit()
+
+        book = db.session.get(cls, olid)
+        if book.pending:
+            enqueue("enrich_book", {"olid": olid}, key=f"enrich_book:{olid}")
+
+        return book
+
+    @classmethod
+    def enrich(cls, olid):
+        """
+        Fill in a placeholder's title, author and cover from Open Library.
+        A placeholder for a book it doesn't know is deleted (and with it the
+        list entries made for it) unless someone wrote a note on it. When
+        Open Library can't be reached or keeps failing the error is raised,
+        so the job is retried.
+        """
 
         fetched_data = fetch_book_data(olid)
+        if not fetched_data.get("title"):
+            # notes are the user's own writing, never delete them with it
+            db.session.execute(db.delete(cls).where(cls.olid == olid, cls.pending == True,
+                ~db.exists().where(BookNote.book_olid == cls.olid)))
+            db.session.commit()
+            raise PermanentJobError(f"No title for {olid}")
 
-        new_book = Book (
-            olid = olid,
-            isbn = isbn,
-            title = fetched_data["title"],
-            author = fetched_data.get("authors")[0] if "authors" in fetched_data else "Unknown",
-            cover_url = fetched_data["cover_url"]
-        )
-        db.session.add(new_book)
+        authors = fetched_data.get("authors") or ["Unknown"]
+        db.session.execute(db.update(cls)
+            .where(cls.olid == olid, cls.pending == True)
+            .values(title=fetched_data["title"], author=authors[0], cover_url=fetched_data.get("cover_url"), pending=False))
         db.session.commit()
 
-        return new_book
+
+job("enrich_book")(Book.enrich)
+
+
+db.event.listen(
+    Book.__table__,
+    "before_create",
+    db.DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"),
+)
 
 
 class BookNote(db.Model):
     """User's notes on a given Book"""
 
     __tablename__ = 'booknotes'
+    __table_args__ = (
+        # one note per user and book, also serves lookups by user_id
+        db.UniqueConstraint("user_id", "book_olid", name="uq_booknotes_user_book"),
+        # notes and read books pages walk the user's notes in id order
+        db.Index("ix_booknotes_user_id_id", "user_id", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -147,11 +302,45 @@ class BookNote(db.Model):
     user = db.relationship("User", backref="notes")
     book = db.relationship("Book", backref="notes")
 
+    @classmethod
+    def get_with_book(cls, note_id):
+        """Note joined with its book, 404 if missing"""
+
+        return cls.query.options(db.joinedload(cls.book)).filter_by(id=note_id).first_or_404()
+
+    @classmethod
+    def for_user_book(cls, user_id, book_olid):
+        """The user's note for a book or None"""
+
+        return cls.query.filter_by(user_id=user_id, book_olid=book_olid).first()
+
+    @classmethod
+    def page_for_user(cls, user_id, after=None, limit=PAGE_SIZE):
+        """Page of the user's notes with their books, oldest first"""
+
+        query = cls.query.options(db.joinedload(cls.book)).filter_by(user_id=user_id)
+        return keyset_page(query, [cls.id], lambda note: [note.id], after, limit)
+
+    def to_dict(self):
+        """return a dict version of self to jsonify and send to client"""
+
+        return {
+            "id": self.id,
+            "book_olid": self.book_olid,
+            "read": self.read,
+            "note": self.note,
+            "book": self.book.to_dict(),
+        }
+
 
 class BookList(db.Model):
     """User list of Books"""
 
     __tablename__ = 'booklists'
+    __table_args__ = (
+        # the user's lists in id order for the add to list menus
+        db.Index("ix_booklists_user_id", "user_id", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(
@@ -165,14 +354,101 @@ class BookList(db.Model):
     books = db.relationship("Book", secondary="booklist_books", backref="lists")
     user = db.relationship("User", backref="lists")
 
+    @classmethod
+    def books_page(cls, list_id, after=None, limit=PAGE_SIZE):
+        """Page of the list's books in the order they were added"""
+
+        query = (db.session.query(Book, BookListBooks.added_at)
+            .join(BookListBooks, BookListBooks.book_olid == Book.olid)
+            .filter(BookListBooks.booklist == list_id))
+
+        keys = [BookListBooks.added_at, BookListBooks.book_olid]
+        page = keyset_page(query, keys, lambda row: [row.added_at, row.Book.olid], after, limit)
+        return Page([row.Book for row in page.items], page.next_cursor)
+
+    @classmethod
+    def user_lists_with_book(cls, user_id, book_olid):
+        """The user's lists that contain the book, in one query"""
+
+        return (cls.query
+            .join(BookListBooks, BookListBooks.booklist == cls.id)
+            .filter(cls.user_id == user_id, BookListBooks.book_olid == book_olid)
+            .order_by(cls.id)
+            .all())
+
+    @classmethod
+    def titles_for_user(cls, user_id):
+        """Id and title of the user's lists for the add to list menus"""
+
+        rows = db.session.query(cls.id, cls.title).filter_by(user_id=user_id).order_by(cls.id).all()
+        return [{"listId": list_id, "listTitle": title} for list_id, title in rows]
+
+    def add_books(self, olids=(), isbns=()):
+        """
+        Add many books at once, fetching the ones that aren't saved yet
+
+        The saved books are found in one query, the rest are fetched from
+        Open Library in batches, then the new books and list entries are
+        bulk inserted and committed together. Only ids that pass
+        is_book_olid are looked up on Open Library. Returns one result per
+        requested id in order: {"olid" or "isbn", "status", "book"} where
+        status is "added", "in_list" or "not_found".
+        """
+
+        olids = list(dict.fromkeys(olids))
+        isbns = list(dict.fromkeys(isbns))
+
+        saved = Book.query.filter(db.or_(Book.olid.in_(olids), Book.isbn.in_(isbns))).all()
+        by_olid = {book.olid: book.to_dict() for book in saved}
+        by_isbn = {book.isbn: book.to_dict() for book in saved if book.isbn is not None}
+
+        fetched_olids, fetched_isbns = fetch_many_book_data(
+            [olid for olid in olids if olid not in by_olid and is_book_olid(olid)],
+            [isbn for isbn in isbns if isbn not in by_isbn],
+        )
+
+        new_books = {}
+        for isbn, book_data in fetched_isbns.items():
+            by_isbn[isbn] = new_books.setdefault(book_data["olid"], Book.row_from_data(book_data, isbn))
+        for olid, book_data in fetched_olids.items():
+            by_olid[olid] = new_books.setdefault(olid, Book.row_from_data(book_data))
+
+        requested = [("olid", olid, by_olid.get(olid)) for olid in olids]
+        requested += [("isbn", isbn, by_isbn.get(isbn)) for isbn in isbns]
+        list_olids = list(dict.fromkeys(book["olid"] for _, _, book in requested if book is not None))
+
+        added = set()
+        if new_books:
+            db.session.execute(insert(Book).values(list(new_books.values())).on_conflict_do_nothing())
+        if list_olids:
+            added = set(db.session.scalars(
+                insert(BookListBooks)
+                .values([{"booklist": self.id, "book_olid": olid} for olid in list_olids])
+                .on_conflict_do_nothing()
+                .returning(BookListBooks.book_olid)))
+        db.session.commit()
+
+        results = []
+        for id_type, book_id, book in requested:
+            if book is None:
+                status = "not_found"
+            elif book["olid"] in added:
+                status = "added"
+                # an olid and an isbn for the same book only add it once
+                added.discard(book["olid"])
+            else:
+                status = "in_list"
+            results.append({id_type: book_id, "status": status, "book": book})
+
+        return results
+
     def add_olid(self, olid):
-        """Add the book from olid to the list, create if it doesn't exist"""
+        """Add the book from olid to the list, create if it doesn't exist (ValueError for a bad olid)"""
 
         book = Book.query.filter_by(olid=olid).first()
         if book is None:
-            # add the book!
-            book = Book.create_book(olid, None)
-            db.session.commit()
+            # add the book, its details are filled in later
+            book = Book.create_placeholder(olid)
         self.books.append(book)
         db.session.commit()
 
@@ -181,6 +457,12 @@ class BookListBooks(db.Model):
     """Booklist and book relations"""
 
     __tablename__ = 'booklist_books'
+    __table_args__ = (
+        # the primary key covers booklist, this covers book.lists
+        db.Index("ix_booklist_books_book_olid", "book_olid", "booklist"),
+        # list pages walk the books in the order they were added
+        db.Index("ix_booklist_books_added", "booklist", "added_at", "book_olid"),
+    )
 
     booklist = db.Column(
         db.Integer,
@@ -193,3 +475,5 @@ class BookListBooks(db.Model):
         db.ForeignKey('books.olid', ondelete='CASCADE'),
         primary_key=True,
     )
+
+    added_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
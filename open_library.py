@@ -1,13 +1,429 @@
 """Handle OpenLibrary.org API calls"""
 
+import atexit
+import codecs
+import contextvars
+import copy
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from urllib.parse import urlsplit
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from cache import TieredCache, LRUCache, SingleFlight, backend_from_url
+from ratelimit import TokenBucket, current_limits, store_from_url
+from resilience import CircuitBreakers, CircuitOpenError, RetryBudget, hedged, jittered_backoff
 
 BASE_URL = "https://openlibrary.org"
 BOOK_URL = f"{BASE_URL}/api/books"
-COVER_ID_URL = "https://covers.openlibrary.org/b/id/"
+COVERS_URL = "https://covers.openlibrary.org"
+COVER_ID_URL = f"{COVERS_URL}/b/id/"
+
+BOOK_OLID_RE = re.compile(r"^OL[0-9]+[MW]$")
 
 DEFAULT_SEARCH_FIELDS = "key,isbn,author_name,title,lending_edition_s,ia,availability,cover_i"
 
+# Connection pool size per host and (connect, read) timeouts in seconds
+POOL_MAXSIZE = int(os.getenv("OL_POOL_MAXSIZE", 10))
+COVERS_POOL_MAXSIZE = int(os.getenv("OL_COVERS_POOL_MAXSIZE", 10))
+CONNECT_TIMEOUT = float(os.getenv("OL_CONNECT_TIMEOUT", 3.05))
+READ_TIMEOUT = float(os.getenv("OL_READ_TIMEOUT", 10))
+
+# Threads for concurrent lookups and the overall deadline for fetch_book_data
+FETCH_WORKERS = int(os.getenv("OL_FETCH_WORKERS", 8))
+BOOK_DATA_DEADLINE = float(os.getenv("OL_BOOK_DATA_DEADLINE", 15))
+# Threads fetch_many_book_data runs fetch_book_data on, one work each
+WORK_WORKERS = int(os.getenv("OL_WORK_WORKERS", 8))
+
+# Open Library API requests per second from this process, 0 for no limit
+RATE_LIMIT = float(os.getenv("OL_RATE_LIMIT", 0))
+RATE_LIMIT_BURST = float(os.getenv("OL_RATE_LIMIT_BURST", 0))
+# Where the tokens are kept, the default file is shared by every worker on
+# the host so together they stay under the rate. memory:// for per process.
+RATE_LIMIT_URL = os.getenv("OL_RATE_LIMIT_URL", f"sqlite:///{os.path.join(tempfile.gettempdir(), 'olreader-ratelimit.db')}")
+
+# An endpoint that fails this many times in a row isn't called for
+# OL_BREAKER_RESET seconds, then one request checks whether it is back
+BREAKER_FAILURES = int(os.getenv("OL_BREAKER_FAILURES", 5))
+BREAKER_RESET = float(os.getenv("OL_BREAKER_RESET", 30))
+
+# Timeouts, connection errors and these statuses are retried up to
+# OL_MAX_RETRIES times, while retries stay under OL_RETRY_BUDGET of the
+# requests in the last 10 seconds (plus one a second)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRIES = int(os.getenv("OL_MAX_RETRIES", 2))
+RETRY_BACKOFF = float(os.getenv("OL_RETRY_BACKOFF", 0.2))
+RETRY_MAX_BACKOFF = float(os.getenv("OL_RETRY_MAX_BACKOFF", 2))
+RETRY_BUDGET = float(os.getenv("OL_RETRY_BUDGET", 0.2))
+
+# Seconds before a slow GET is sent again and the first answer used, 0 to
+# never hedge. Hedges come out of the retry budget.
+HEDGE_AFTER = float(os.getenv("OL_HEDGE_AFTER", 0))
+HEDGE_WORKERS = int(os.getenv("OL_HEDGE_WORKERS", 16))
+
+# The last good response for each url is kept this long to answer with
+# while openlibrary.org can't be reached
+STALE_TTL = int(os.getenv("OL_STALE_TTL", 7 * 24 * 60 * 60))
+
+# Number of bibkeys sent in one Books API request
+BULK_CHUNK_SIZE = int(os.getenv("OL_BULK_CHUNK_SIZE", 50))
+
+# Metadata hardly ever changes upstream, TTLs in seconds per data_type
+DAY = 24 * 60 * 60
+CACHE_TTLS = {
+    "books": 7 * DAY,
+    "works": 7 * DAY,
+    "authors": 30 * DAY,
+    "cover": 7 * DAY,
+}
+
+# Per-worker LRU in front of the shared cache set by OL_CACHE_URL (if any)
+ol_cache = TieredCache(
+    LRUCache(
+        max_entries=int(os.getenv("OL_CACHE_MAX_ENTRIES", 2048)),
+        max_bytes=int(os.getenv("OL_CACHE_MAX_BYTES", 16 * 1024 * 1024)),
+    ),
+    backend=backend_from_url(os.getenv("OL_CACHE_URL")),
+)
+
+# Search results go stale quickly, keep them briefly in a smaller cache
+SEARCH_CACHE_TTL = int(os.getenv("OL_SEARCH_CACHE_TTL", 5 * 60))
+search_cache = TieredCache(
+    LRUCache(
+        max_entries=int(os.getenv("OL_SEARCH_CACHE_MAX_ENTRIES", 256)),
+        max_bytes=int(os.getenv("OL_SEARCH_CACHE_MAX_BYTES", 8 * 1024 * 1024)),
+    ),
+    backend=ol_cache.backend,
+)
+search_flight = SingleFlight()
+
+# urls get_json answered from stale_cache, collected by watch_stale()
+stale_urls = contextvars.ContextVar("stale_urls", default=None)
+
+# Last good responses by url, only read when upstream fails
+stale_cache = TieredCache(
+    LRUCache(
+        max_entries=int(os.getenv("OL_STALE_CACHE_MAX_ENTRIES", 1024)),
+        max_bytes=int(os.getenv("OL_STALE_CACHE_MAX_BYTES", 16 * 1024 * 1024)),
+    ),
+    backend=ol_cache.backend,
+)
+
+# Docs in the small upstream request a streamed search starts with
+SEARCH_FIRST_LIMIT = int(os.getenv("OL_SEARCH_FIRST_LIMIT", 20))
+# Bytes read from the upstream body at a time while streaming
+SEARCH_STREAM_CHUNK = int(os.getenv("OL_SEARCH_STREAM_CHUNK", 2048))
+
+# What each kind of caller asks upstream for and gets back: search.json
+# fields, docs per page, docs in a streamed first page and the result keys
+# sent to the client (None for all of them). Only the search page, which
+# links to the work, asks for everything. compact keeps the isbn, books
+# added to a list from its results are saved with it.
+SearchProfile = namedtuple("SearchProfile", ["fields", "limit", "first_limit", "keys"])
+SEARCH_PROFILES = {
+    "results": SearchProfile(DEFAULT_SEARCH_FIELDS, 100, SEARCH_FIRST_LIMIT, None),
+    "compact": SearchProfile(
+        "key,isbn,title,author_name,cover_i,lending_edition_s", 50, SEARCH_FIRST_LIMIT,
+        ("olid", "isbn", "title", "author_name", "cover_url")),
+    "typeahead": SearchProfile("key,title,author_name", 10, 10, ("olid", "title", "author_name")),
+}
+
+# Identical upstream GETs in flight share one request, set OL_SHARED_FLIGHT=1
+# to collapse them across workers through the shared cache backend as well
+SHARED_FLIGHT = os.getenv("OL_SHARED_FLIGHT", "0") == "1"
+http_flight = SingleFlight(backend=ol_cache.backend if SHARED_FLIGHT else None)
+
+ol_rate_limit = TokenBucket(RATE_LIMIT, RATE_LIMIT_BURST, store=store_from_url(RATE_LIMIT_URL), name="openlibrary")
+circuit_breakers = CircuitBreakers(BREAKER_FAILURES, BREAKER_RESET)
+retry_budget = RetryBudget(RETRY_BUDGET)
+
+#
+# HTTP session
+#
+
+_session = None
+_executor = None
+_work_executor = None
+_hedge_executor = None
+_session_lock = threading.Lock()
+
+
+def create_session():
+    """
+    Create a keep-alive session with its own connection pool for each
+    Open Library host
+    """
+
+    session = requests.Session()
+    session.headers.update({"User-Agent": "OLReader (+https://olreader.herokuapp.com/)"})
+    session.mount(BASE_URL, HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE))
+    session.mount(COVERS_URL, HTTPAdapter(pool_connections=1, pool_maxsize=COVERS_POOL_MAXSIZE))
+
+    return session
+
+
+def get_session():
+    """Return the worker's shared session, creating it on first use"""
+
+    global _session
+
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+
+    return _session
+
+
+def close_session():
+    """Close the shared session and its pooled connections"""
+
+    global _session
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def get_executor():
+    """Return the worker's bounded thread pool for concurrent lookups"""
+
+    global _executor
+
+    if _executor is None:
+        with _session_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="ol-fetch")
+
+    return _executor
+
+
+def get_work_executor():
+    """
+    Return the worker's pool for whole works, kept apart from the lookup
+    pool: each work waits on author and cover lookups queued there, so
+    running works on it as well would leave none of its threads free to
+    do the lookups
+    """
+
+    global _work_executor
+
+    if _work_executor is None:
+        with _session_lock:
+            if _work_executor is None:
+                _work_executor = ThreadPoolExecutor(max_workers=WORK_WORKERS, thread_name_prefix="ol-work")
+
+    return _work_executor
+
+
+def get_hedge_executor():
+    """
+    Return the worker's pool for hedged GETs, kept apart from the lookup
+    pool so requests made from lookup threads can't wait on each other
+    """
+
+    global _hedge_executor
+
+    if _hedge_executor is None:
+        with _session_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="ol-hedge")
+
+    return _hedge_executor
+
+
+def submit(executor, fn, *args):
+    """executor.submit that runs fn in the caller's context, so it keeps its rate limit priority"""
+
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def shutdown():
+    """Stop the lookup threads and close the shared session"""
+
+    global _executor, _work_executor, _hedge_executor
+
+    with _session_lock:
+        for executor in (_executor, _work_executor, _hedge_executor):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+        _work_executor = None
+        _hedge_executor = None
+
+    close_session()
+
+atexit.register(shutdown)
+
+
+def http_get(request_url, timeout=None, **kwargs):
+    """GET request_url through the shared session with the default timeouts"""
+
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+    return get_session().get(request_url, timeout=timeout, **kwargs)
+
+
+def get_json(request_url):
+    """
+    GET request_url and decode the JSON body, returns (data, ok, stale)
+
+    Concurrent callers asking for the same url wait on one request,
+    each gets its own copy of the data.
+    """
+
+    data, ok, stale = http_flight.do(request_url, fetch_json, request_url)
+    if stale and stale_urls.get() is not None:
+        stale_urls.get().append(request_url)
+
+    return copy.deepcopy(data), ok, stale
+
+
+@contextmanager
+def watch_stale():
+    """
+    Collect the urls answered from stale_cache in the block (and tasks it
+    submits with their context), so what is built from them isn't cached
+    """
+
+    urls = []
+    token = stale_urls.set(urls)
+    try:
+        yield urls
+    finally:
+        stale_urls.reset(token)
+
+
+class UpstreamError(requests.HTTPError):
+    """openlibrary.org kept answering 429/5xx, it didn't say the data is missing"""
+
+
+def fetch_json(request_url):
+    """
+    GET request_url and return (data, ok, stale) without collapsing
+
+    Answers with the last good response for the url when openlibrary.org
+    can't be reached or keeps failing, stale is True then. Stale answers
+    must not be cached again as fresh ones. With nothing saved, raises
+    the requests error, UpstreamError for 429/5xx responses once retries
+    run out. ok is False for the other error responses (404s).
+    """
+
+    try:
+        response = resilient_get(request_url)
+        data = response.json()
+        error = f"HTTP { response.status_code }" if is_failure(response) else None
+    except requests.RequestException as err:
+        response, data, error = None, None, err
+
+    if error is not None:
+        stale = stale_cache.get(request_url)
+        if stale is not None:
+            print(f"WARNING: { request_url } failed, answering with the copy saved earlier: { error }")
+            return stale, True, True
+        if response is None:
+            raise error
+        raise UpstreamError(f"{ request_url } failed: { error }", response=response)
+
+    if response.ok:
+        stale_cache.set(request_url, data, STALE_TTL)
+
+    return data, response.ok, False
+
+
+def endpoint_name(request_url):
+    """Host and first path segment, each gets its own circuit breaker"""
+
+    parts = urlsplit(request_url)
+    return f"{ parts.netloc }/{ parts.path.lstrip('/').split('/')[0] }"
+
+
+def is_failure(response):
+    """Whether a response means upstream is in trouble (not just a 404)"""
+
+    return not response.ok and response.status_code in RETRY_STATUSES
+
+
+def guarded_get(request_url, **kwargs):
+    """
+    One rate limited GET through request_url's circuit breaker, raises
+    CircuitOpenError without calling while the breaker is open
+    """
+
+    breaker = circuit_breakers.get(endpoint_name(request_url))
+    if not breaker.allow():
+        raise CircuitOpenError(f"{ breaker.name } keeps failing, not calling it for now")
+
+    try:
+        # a job's own cap first, so it doesn't sit on a token meant for everyone
+        for bucket in current_limits.get():
+            bucket.acquire()
+        ol_rate_limit.acquire()
+        response = http_get(request_url, **kwargs)
+    except requests.RequestException:
+        breaker.record_failure()
+        raise
+
+    if is_failure(response):
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+
+def resilient_get(request_url):
+    """
+    guarded_get with jittered retries while the retry budget allows, and a
+    hedged second request when HEDGE_AFTER is set
+
+    returns the last response, even a failed one, once out of retries
+    """
+
+    retry_budget.record_request()
+    attempt = 0
+    while True:
+        try:
+            if HEDGE_AFTER > 0:
+                response = hedged(lambda: guarded_get(request_url), HEDGE_AFTER, get_hedge_executor(), retry_budget.try_spend)
+            else:
+                response = guarded_get(request_url)
+            if not is_failure(response):
+                return response
+            error = None
+        except CircuitOpenError:
+            raise
+        except requests.RequestException as err:
+            error, response = err, None
+
+        attempt += 1
+        if attempt > MAX_RETRIES or not retry_budget.try_spend():
+            if error is not None:
+                raise error
+            return response
+        time.sleep(jittered_backoff(attempt, RETRY_BACKOFF, RETRY_MAX_BACKOFF))
+
+
+def upstream_stats():
+    """Circuit breaker states, retry budget use and rate limit queue waits"""
+
+    return {
+        "breakers": circuit_breakers.stats(),
+        "retry_budget": retry_budget.stats(),
+        "stale_cache": stale_cache.stats(),
+        "rate_limit": ol_rate_limit.stats(),
+    }
+
+
 #
 # Search
 #
@@ -23,11 +439,10 @@ def do_search(query, fields="*", limit=100, page=1):
     returns dict from response json
     """
     
-    request_url = f"{ BASE_URL }/search.json?{ query }&fields={ fields }&limit={ limit }&page={ page }"
+    request_url = search_url(query, fields, limit, page)
     print(request_url)
 
-    response = requests.get(request_url)
-    resp_data = response.json()
+    resp_data, ok, stale = get_json(request_url)
 
     return resp_data
 
@@ -35,15 +450,70 @@ def do_search(query, fields="*", limit=100, page=1):
 def keyword_search(keyword, fields=DEFAULT_SEARCH_FIELDS, limit=100, page=1):
     """Search for keyword"""
 
+    keyword = normalize_keyword(keyword)
+    cache_key = search_cache_key(keyword, fields, limit, page)
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # identical searches already in flight share one upstream call
+    results = search_flight.do(cache_key, fetch_search_results, keyword, fields, limit, page)
+
+    return copy.deepcopy(results)
+
+
+def fetch_search_results(keyword, fields, limit, page):
+    """Search upstream for keyword and cache the parsed results"""
+
     query=f"q={ keyword }"
-    search_data = do_search(query, fields, limit, page)
+    with watch_stale() as stale:
+        search_data = do_search(query, fields, limit, page)
+    results = parse_search_results(search_data)
+
+    # error responses have no docs
+    if "docs" in search_data and not stale:
+        search_cache.set(search_cache_key(keyword, fields, limit, page), results, SEARCH_CACHE_TTL)
+
+    return results
+
+
+def normalize_keyword(keyword):
+    """Lowercase and collapse whitespace so equivalent searches share results"""
+
+    return " ".join(str(keyword).lower().split())
+
+
+def search_cache_key(keyword, fields, limit, page):
+    """Cache key for a normalized keyword, fields, limit and page"""
+
+    fields = ",".join(sorted(fields.split(",")))
+    return f"search:{keyword}:{fields}:{int(limit)}:{int(page)}"
+
+
+def search_url(query, fields, limit, page, offset=None):
+    """Build the search.json url, offset (when given) is used instead of page"""
+
+    position = f"offset={ offset }" if offset is not None else f"page={ page }"
+    return f"{ BASE_URL }/search.json?{ query }&fields={ fields }&limit={ limit }&{ position }"
+
+
+def project_works(works, keys):
+    """Only keys of each parsed work, all of them when keys is None"""
+
+    if keys is None:
+        return works
+    return [{key: work.get(key) for key in keys} for work in works]
+
+
+def parse_search_results(search_data):
+    """Parse the search.json response into results for the client"""
 
     results = {
         'total': search_data.get('numFound', 0),
         'num_returned': 0,
         'works': [],
     }
-    for work in search_data.get('docs'):
+    for work in search_data.get('docs', []):
         work_data = parse_search_data(work)
         if work_data is not None:
             results.get('works').append(work_data)
@@ -52,6 +522,221 @@ def keyword_search(keyword, fields=DEFAULT_SEARCH_FIELDS, limit=100, page=1):
     return results
 
 
+#
+# Streaming search
+#
+
+class SearchStreamDecoder:
+    """
+    Incremental decoder for a search.json body
+
+    feed() takes the text received so far and returns the events it
+    completed: (name, value) for top level fields and ("doc", doc) for each
+    element of docs, so every doc is handed out as soon as it has arrived
+    instead of after the whole body is parsed.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.state = "start"
+        self.key = None
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, text):
+        """Add text, returns the list of completed events"""
+
+        buffer = self.buffer + text
+        pos = 0
+        events = []
+        while True:
+            pos = skip_whitespace(buffer, pos)
+            if pos >= len(buffer) or self.state == "end":
+                break
+
+            char = buffer[pos]
+            if self.state == "start":
+                if char != "{":
+                    raise ValueError("Search response is not an object")
+                pos += 1
+                self.state = "key"
+
+            elif self.state == "key":
+                if char == ",":
+                    pos += 1
+                    continue
+                if char == "}":
+                    pos += 1
+                    self.state = "end"
+                    continue
+
+                decoded = self._decode(buffer, pos)
+                if decoded is None:
+                    break
+                key, end = decoded
+                colon = skip_whitespace(buffer, end)
+                if colon >= len(buffer):
+                    break
+                if buffer[colon] != ":":
+                    raise ValueError(f"Expected ':' after {key}")
+                self.key = key
+                pos = colon + 1
+                self.state = "value"
+
+            elif self.state == "value":
+                if self.key == "docs" and char == "[":
+                    pos += 1
+                    self.state = "docs"
+                    continue
+
+                decoded = self._decode(buffer, pos)
+                if decoded is None:
+                    break
+                events.append((self.key, decoded[0]))
+                pos = decoded[1]
+                self.state = "key"
+
+            else:  # docs
+                if char == ",":
+                    pos += 1
+                    continue
+                if char == "]":
+                    pos += 1
+                    self.state = "key"
+                    continue
+
+                decoded = self._decode(buffer, pos)
+                if decoded is None:
+                    break
+                events.append(("doc", decoded[0]))
+                pos = decoded[1]
+
+        self.buffer = buffer[pos:]
+        return events
+
+    def close(self):
+        """Raises ValueError if the body ended early"""
+
+        if self.state != "end":
+            raise ValueError("Search response ended early")
+
+    def _decode(self, buffer, pos):
+        """(value, end) for the JSON value at pos, None until it is complete"""
+
+        try:
+            value, end = self._decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            return None
+
+        # a number at the end of the buffer may still have digits to come
+        if end >= len(buffer):
+            return None
+        return value, end
+
+
+def skip_whitespace(text, pos):
+    while pos < len(text) and text[pos] in " \t\n\r":
+        pos += 1
+    return pos
+
+
+def iter_search_events(response, chunk_size=SEARCH_STREAM_CHUNK):
+    """
+    Decode a streamed search.json response as it is read
+
+    yields a list of events (see SearchStreamDecoder) per chunk read
+    """
+
+    text = codecs.getincrementaldecoder("utf-8")()
+    decoder = SearchStreamDecoder()
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        events = decoder.feed(text.decode(chunk))
+        if events:
+            yield events
+
+    events = decoder.feed(text.decode(b"", final=True))
+    if events:
+        yield events
+    decoder.close()
+
+
+def fetch_search_docs(keyword, fields, limit, offset):
+    """The docs for limit results from offset, None if the request failed"""
+
+    search_data = get_json(search_url(f"q={ keyword }", fields, limit, None, offset))[0]
+    return search_data.get("docs")
+
+
+def stream_search(keyword, fields=DEFAULT_SEARCH_FIELDS, limit=100, page=1, first_limit=SEARCH_FIRST_LIMIT):
+    """
+    keyword_search that hands out results as they arrive
+
+    yields ("total", numFound) and ("works", [parsed works]) events, or a
+    single ("error", HTTP status) when openlibrary.org answers the first
+    request with an error. The first first_limit docs come from a small
+    request that is decoded while its body streams in, the rest of the
+    page is fetched at the same time and follows. The assembled page is
+    cached for keyword_search.
+    """
+
+    keyword = normalize_keyword(keyword)
+    cache_key = search_cache_key(keyword, fields, limit, page)
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        yield "total", cached["total"]
+        yield "works", cached["works"]
+        return
+
+    offset = (int(page) - 1) * limit
+    first_limit = min(first_limit, limit)
+    rest = None
+    if first_limit < limit:
+        rest = submit(get_executor(), fetch_search_docs, keyword, fields, limit - first_limit, offset + first_limit)
+
+    results = {"total": 0, "num_returned": 0, "works": []}
+    # no retries, the client is already reading what this sends
+    with guarded_get(search_url(f"q={ keyword }", fields, first_limit, None, offset), stream=True) as response:
+        # error bodies aren't search results, and no results isn't what happened
+        if not response.ok:
+            if rest is not None:
+                rest.cancel()
+            yield "error", response.status_code
+            return
+
+        complete = True
+        for events in iter_search_events(response):
+            works = []
+            for name, value in events:
+                if name == "numFound":
+                    results["total"] = value
+                    yield "total", value
+                elif name == "doc":
+                    work = parse_search_data(value)
+                    if work is not None:
+                        works.append(work)
+            if works:
+                results["works"].extend(works)
+                yield "works", works
+
+    if rest is not None:
+        try:
+            docs = rest.result()
+        except requests.RequestException as err:
+            print(f"WARNING: Search for { keyword } past { first_limit } failed: { err }")
+            docs = None
+
+        if docs is None:
+            complete = False
+        else:
+            works = [work for work in map(parse_search_data, docs) if work is not None]
+            results["works"].extend(works)
+            if works:
+                yield "works", works
+
+    results["num_returned"] = len(results["works"])
+    if complete:
+        search_cache.set(cache_key, results, SEARCH_CACHE_TTL)
+
+
 def isbn_search(isbn, fields=DEFAULT_SEARCH_FIELDS):
     """Search for books with ISBN10 or ISBN13"""
 
@@ -112,69 +797,291 @@ def parse_search_data(work):
 # Fetch data on work and books
 #
 
+def forget_book_data(olid):
+    """Drop the cached data for olid so the next fetch goes upstream"""
+
+    for data_type in ("book_data", "books", "works", "cover"):
+        ol_cache.delete(f"{data_type}:{olid}")
+
+
+def cached_book_data(olid):
+    """fetch_book_data's result if it is cached, None without fetching"""
+
+    return ol_cache.get(f"book_data:{olid}")
+
+
 def fetch_book_data(olid):
-    """Fetch data for a book with author data"""
+    """
+    Fetch data for a book with author data, {} when Open Library doesn't
+    know olid. Raises requests.RequestException (UpstreamError for 429/5xx)
+    when it can't tell.
+    """
 
     w_type = work_type(olid)
-    fetched_data = fetch_data(olid, w_type)
-    book_data = fetched_data.get(f"OLID:{olid}") if w_type == "books" else fetched_data
+    cache_key = f"book_data:{olid}"
+    cached = ol_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
-    if "authors" in book_data:
-        author_list = []
-        for author in book_data.get("authors"):
+    deadline = time.monotonic() + BOOK_DATA_DEADLINE
+    # the lookups submitted here share the list, so it holds theirs too
+    # once they are waited on
+    with watch_stale() as stale:
+        fetched_data = fetch_data(olid, w_type)
+        book_data = fetched_data.get(f"OLID:{olid}") if w_type == "books" else fetched_data
+        if not book_data or "error" in book_data:
+            # Open Library doesn't know olid
+            return {}
+
+        # look up the authors and the cover at the same time
+        executor = get_executor()
+        authors = []
+        for author in book_data.get("authors", []):
             # books and works nest author info differently
             if "name" in author:
-                 author_list.append(author.get("name"))
+                authors.append(author.get("name"))
             else:
                 to_split = author.get("author") if "author" in author else author
                 split_id = to_split["key"].split("/")
-                fetched_author = fetch_data(split_id[-1], "authors")
-                author_list.append(fetched_author["name"])
+                authors.append(submit(executor, fetch_data, split_id[-1], "authors"))
+
+        # books and works handle covers differently
+        covers = book_data.get("covers")
+        cover_future = None
+        if covers is None and w_type == "books":
+            cover_future = submit(executor, fetch_data, olid, "cover")
+
+    complete = True
+    if "authors" in book_data:
+        author_list = []
+        for author in authors:
+            if isinstance(author, Future):
+                fetched_author = lookup_by_deadline(author, deadline)
+                if fetched_author is None or "name" not in fetched_author:
+                    complete = False
+                    continue
+                author = fetched_author["name"]
+            author_list.append(author)
         book_data["authors"] = author_list
-    
-    # books and works handle covers differently
-    covers = book_data.get("covers")
-    if covers is None and w_type == "books":
-        cover_data = fetch_data(olid, "cover")
-        covers = cover_data.get("covers")
+
+    if cover_future is not None:
+        cover_data = lookup_by_deadline(cover_future, deadline)
+        if cover_data is None:
+            complete = False
+        else:
+            covers = cover_data.get("covers")
 
     if covers is not None and len(covers) > 0:
         book_data["cover_url"] = create_cover_url(olid, w_type)
     else:
         book_data["cover_url"] = None
 
+    # don't keep partial or stale data around
+    if complete and not stale:
+        ol_cache.set(cache_key, book_data, CACHE_TTLS.get(w_type, DAY))
+
     return book_data
 
 
+def lookup_by_deadline(future, deadline):
+    """result_by_deadline for an author or cover lookup, None when it failed too"""
+
+    try:
+        return result_by_deadline(future, deadline)
+    except requests.RequestException as err:
+        print(f"WARNING: Lookup failed: { err }")
+        return None
+
+
+def result_by_deadline(future, deadline):
+    """
+    Wait for future until deadline (time.monotonic), returns None if it
+    runs late. A deadline of None waits as long as it takes.
+    """
+
+    if deadline is None:
+        return future.result()
+
+    try:
+        return future.result(timeout=max(deadline - time.monotonic(), 0))
+    except FutureTimeoutError:
+        future.cancel()
+        return None
+
+
 def fetch_data(olid, data_type):
-    """Fetch data for olid and data_type"""
+    """Fetch data for olid and data_type, served from ol_cache when possible"""
 
-    if data_type == "books":
-        request_url = f"{BOOK_URL}?bibkeys=OLID:{olid}&format=json&jscmd=data"
-    elif data_type == "cover":
-        request_url = f"{BASE_URL}/books/{olid}.json"
-    else:
-        request_url = f"{BASE_URL}/{data_type}/{olid}.json"
-        
+    cache_key = f"{data_type}:{olid}"
+    cached = ol_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    request_url = data_url(olid, data_type)
     # print(request_url)
 
-    response = requests.get(request_url)
-    # print(response.status_code)
+    data, ok, stale = get_json(request_url)
+    if ok and not stale:
+        ol_cache.set(cache_key, data, CACHE_TTLS.get(data_type, DAY))
 
-    data = response.json()
     return data
 
 
+def data_url(olid, data_type):
+    """Build the url for olid and data_type"""
+
+    if data_type == "books":
+        return f"{BOOK_URL}?bibkeys=OLID:{olid}&format=json&jscmd=data"
+    if data_type == "cover":
+        return f"{BASE_URL}/books/{olid}.json"
+    return f"{BASE_URL}/{data_type}/{olid}.json"
+
+
+def fetch_books_bulk(ids, chunk_size=BULK_CHUNK_SIZE, id_type="OLID"):
+    """
+    Fetch Books API data for many edition olids (or ISBNs with id_type="ISBN")
+    with one request per chunk
+
+    returns dict of id -> book data for every id Open Library knows,
+    the same data fetch_data(olid, "books") has under "OLID:{olid}"
+    """
+
+    results = {}
+    missing = []
+    for book_id in dict.fromkeys(ids):
+        cached = ol_cache.get(bulk_cache_key(book_id, id_type))
+        if cached is not None:
+            if f"{id_type}:{book_id}" in cached:
+                results[book_id] = cached[f"{id_type}:{book_id}"]
+        else:
+            missing.append(book_id)
+
+    for start in range(0, len(missing), chunk_size):
+        chunk = missing[start:start + chunk_size]
+        bibkeys = ",".join(f"{id_type}:{book_id}" for book_id in chunk)
+        request_url = f"{BOOK_URL}?bibkeys={bibkeys}&format=json&jscmd=data"
+
+        try:
+            data, ok, stale = get_json(request_url)
+        except UpstreamError as err:
+            print(f"WARNING: Books API request for { len(chunk) } ids failed: { err }")
+            continue
+        if not ok:
+            continue
+
+        for book_id in chunk:
+            book_data = data.get(f"{id_type}:{book_id}")
+            if book_data is not None:
+                results[book_id] = book_data
+                if stale:
+                    continue
+                # same shape as a single fetch_data response
+                ol_cache.set(bulk_cache_key(book_id, id_type), {f"{id_type}:{book_id}": book_data}, CACHE_TTLS["books"])
+
+    return results
+
+
+def bulk_cache_key(book_id, id_type):
+    """olids share fetch_data's cache entries"""
+
+    return f"books:{book_id}" if id_type == "OLID" else f"{id_type.lower()}:{book_id}"
+
+
+def fetch_many_book_data(olids=(), isbns=(), timeout=BOOK_DATA_DEADLINE, executor=None):
+    """
+    Book data for many olids and ISBNs: editions and ISBNs through batched
+    Books API requests, works concurrently on the executor (the shared
+    work pool by default, never the lookup pool their authors and covers
+    are fetched on; timeout=None waits for every work)
+
+    returns (olid -> data, isbn -> data) with olid, title, authors and
+    cover_url, ids Open Library doesn't know (or that ran past the
+    deadline) are left out
+    """
+
+    editions = [olid for olid in olids if work_type(olid) == "books"]
+    works = [olid for olid in olids if work_type(olid) == "works"]
+
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    executor = executor or get_work_executor()
+    work_futures = {olid: submit(executor, fetch_book_data, olid) for olid in dict.fromkeys(works)}
+
+    by_olid = {}
+    for olid, book_data in fetch_books_bulk(editions).items():
+        if book_data.get("title"):
+            by_olid[olid] = parse_books_api_data(olid, book_data)
+
+    by_isbn = {}
+    for isbn, book_data in fetch_books_bulk(isbns, id_type="ISBN").items():
+        olid = book_data.get("key", "").split("/")[-1]
+        if olid and book_data.get("title"):
+            by_isbn[isbn] = parse_books_api_data(olid, book_data)
+
+    for olid, future in work_futures.items():
+        try:
+            book_data = result_by_deadline(future, deadline)
+        except Exception as err:
+            print(f"WARNING: Fetching { olid } failed: { err }")
+            continue
+
+        if book_data is not None and book_data.get("title"):
+            by_olid[olid] = {
+                "olid": olid,
+                "title": book_data["title"],
+                "authors": book_data.get("authors") or [],
+                "cover_url": book_data.get("cover_url"),
+            }
+
+    return by_olid, by_isbn
+
+
+def parse_books_api_data(olid, book_data):
+    """olid, title, authors and cover_url from Books API (jscmd=data) data"""
+
+    return {
+        "olid": olid,
+        "title": book_data.get("title"),
+        "authors": [author["name"] for author in book_data.get("authors", []) if "name" in author],
+        "cover_url": create_cover_url(olid, "books") if book_data.get("cover") else None,
+    }
+
+
+def configure_cache(backend):
+    """Swap the shared cache backend (MemoryBackend, SQLiteBackend, ...) or None"""
+
+    ol_cache.backend = backend
+    search_cache.backend = backend
+    stale_cache.backend = backend
+    if SHARED_FLIGHT:
+        http_flight.backend = backend
+    ol_cache.clear()
+    search_cache.clear()
+    stale_cache.clear()
+
+
 #
 # Availability
 #
 
 def fetch_availabilty_links(olid):
-    """Fetch availability data and links for olid"""
+    """Fetch availability data and links for olid, {} when they can't be fetched"""
 
     w_type = work_type(olid)
-    fetched_data = fetch_data(olid, w_type)
+    try:
+        fetched_data = fetch_data(olid, w_type)
+    except requests.RequestException as err:
+        print(f"WARNING: Availability for { olid } failed: { err }")
+        return {}
     book_data = fetched_data.get(f"OLID:{olid}") if w_type == "books" else fetched_data
+    if not book_data or "error" in book_data:
+        # Open Library doesn't know olid
+        return {}
+
+    return parse_availability(book_data)
+
+
+def parse_availability(book_data):
+    """Pull the availability links out of book or work data"""
 
     ebook_data = book_data.get("ebooks")[0] if "ebooks" in book_data else None
 
@@ -196,18 +1103,21 @@ def fetch_availabilty_links(olid):
 def fetch_trending_books(trending_type, min=4, limit=12):
     """Fetch trending books from the last 24 hours"""
 
-    # default to "recent"
-    request_url = f"https://openlibrary.org/trending/hours.json?hours=24&minimum={min}&limit={limit}&sort_by_count=false"
-    if trending_type == "monthly":
-        request_url = f"https://openlibrary.org/trending/monthly.json?minimum={min}&limit={limit}&sort_by_count=false"
-    elif trending_type == "popular":
-        request_url = f"https://openlibrary.org/trending/popular.json?minimum={min}&limit={limit}&sort_by_count=false"
-
-    response = requests.get(request_url)
-    data = response.json()
+    request_url = trending_url(trending_type, min, limit)
+    data, ok, stale = get_json(request_url)
     works = data.get("works")
     return works
 
+
+def trending_url(trending_type, min=4, limit=12):
+    """Build the trending url, defaults to "recent" """
+
+    if trending_type == "monthly":
+        return f"{BASE_URL}/trending/monthly.json?minimum={min}&limit={limit}&sort_by_count=false"
+    if trending_type == "popular":
+        return f"{BASE_URL}/trending/popular.json?minimum={min}&limit={limit}&sort_by_count=false"
+    return f"{BASE_URL}/trending/hours.json?hours=24&minimum={min}&limit={limit}&sort_by_count=false"
+
 #
 # Helper methods
 #
@@ -216,11 +1126,17 @@ def create_cover_url(olid, work_type=None):
     """Generate cover url based on olid and work_type"""
 
     img_type = "w" if work_type == "works" else "b"
-    cover = f"https://covers.openlibrary.org/{img_type}/olid/{olid}"
+    cover = f"{COVERS_URL}/{img_type}/olid/{olid}"
 
     return cover
 
 
+def is_book_olid(olid):
+    """Whether olid looks like an edition (OL...M) or work (OL...W) id"""
+
+    return bool(BOOK_OLID_RE.match(olid or ""))
+
+
 def work_type(olid):
     """Return work type: works, books, author"""
 
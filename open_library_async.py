@@ -0,0 +1,220 @@
+"""Async Open Library client
+
+Async siblings of the open_library calls for async Flask views
+(pip install "Flask[async]") and background jobs. Requests aren't made
+again here: each one runs open_library.get_json on the client's threads, so
+it takes the same rate limit token, goes through the same circuit breaker,
+retries and hedging, falls back to the same stale copy and shares
+in-flight requests with the sync client. Each event loop caps the calls it
+has in flight and every call has its own timeout.
+"""
+
+import asyncio
+import atexit
+import contextvars
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import open_library
+from open_library import (
+    BOOK_DATA_DEADLINE, CACHE_TTLS, DAY, DEFAULT_SEARCH_FIELDS, create_cover_url, data_url,
+    ol_cache, parse_availability, watch_stale, work_type,
+)
+
+# Upstream calls in flight at once and the timeout for each call in seconds
+MAX_CONCURRENCY = int(os.getenv("OL_ASYNC_MAX_CONCURRENCY", 20))
+CALL_TIMEOUT = float(os.getenv("OL_ASYNC_CALL_TIMEOUT", 15))
+
+_executor = None
+# loop -> semaphore, a semaphore belongs to the loop it is first used on
+_semaphores = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+#
+# Calls on the client threads
+#
+
+def get_executor():
+    """Return the threads the blocking calls run on, starting them on first use"""
+
+    global _executor
+
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix="ol-async")
+
+    return _executor
+
+
+def get_semaphore(loop):
+    """Return loop's cap on calls in flight"""
+
+    with _lock:
+        semaphore = _semaphores.get(loop)
+        if semaphore is None:
+            semaphore = _semaphores[loop] = asyncio.Semaphore(MAX_CONCURRENCY)
+
+    return semaphore
+
+
+async def run(fn, *args, timeout=CALL_TIMEOUT):
+    """
+    Run the blocking call fn(*args) on the client threads in the caller's
+    context (rate limit priority, stale watch), raises TimeoutError after
+    timeout seconds
+    """
+
+    loop = asyncio.get_running_loop()
+    async with asyncio.timeout(timeout):
+        async with get_semaphore(loop):
+            return await loop.run_in_executor(get_executor(), contextvars.copy_context().run, fn, *args)
+
+
+async def fetch_json(request_url, timeout=CALL_TIMEOUT):
+    """GET request_url like open_library.get_json, returns (data, ok, stale)"""
+
+    return await run(open_library.get_json, request_url, timeout=timeout)
+
+
+def close():
+    """Stop the client threads"""
+
+    global _executor
+
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+atexit.register(close)
+
+#
+# Search
+#
+
+async def keyword_search(keyword, fields=DEFAULT_SEARCH_FIELDS, limit=100, page=1):
+    """Search for keyword, cached and collapsed with the sync searches"""
+
+    return await run(open_library.keyword_search, keyword, fields, limit, page)
+
+#
+# Fetch data on work and books
+#
+
+async def fetch_book_data(olid):
+    """
+    Fetch data for a book with author data, {} when Open Library doesn't
+    know olid. Raises like open_library.fetch_book_data when it can't tell.
+    """
+
+    w_type = work_type(olid)
+    cache_key = f"book_data:{olid}"
+    cached = ol_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    with watch_stale() as stale:
+        fetched_data = await fetch_data(olid, w_type)
+        book_data = fetched_data.get(f"OLID:{olid}") if w_type == "books" else fetched_data
+        if not book_data or "error" in book_data:
+            # Open Library doesn't know olid
+            return {}
+
+        # look up the authors and the cover at the same time
+        lookups = []
+        for author in book_data.get("authors", []):
+            # books and works nest author info differently
+            if "name" not in author:
+                to_split = author.get("author") if "author" in author else author
+                lookups.append(fetch_data(to_split["key"].split("/")[-1], "authors"))
+
+        covers = book_data.get("covers")
+        cover_lookup = covers is None and w_type == "books"
+        if cover_lookup:
+            lookups.append(fetch_data(olid, "cover"))
+
+        try:
+            results = await asyncio.wait_for(
+                asyncio.gather(*lookups, return_exceptions=True), BOOK_DATA_DEADLINE)
+        except TimeoutError:
+            results = [None] * len(lookups)
+
+    complete = all(isinstance(result, dict) for result in results)
+    if cover_lookup:
+        cover_data = results.pop()
+        covers = cover_data.get("covers") if isinstance(cover_data, dict) else None
+
+    if "authors" in book_data:
+        author_list = []
+        fetched_authors = iter(results)
+        for author in book_data.get("authors"):
+            if "name" in author:
+                author_list.append(author.get("name"))
+                continue
+
+            fetched_author = next(fetched_authors)
+            if isinstance(fetched_author, dict) and "name" in fetched_author:
+                author_list.append(fetched_author["name"])
+            else:
+                complete = False
+        book_data["authors"] = author_list
+
+    if covers is not None and len(covers) > 0:
+        book_data["cover_url"] = create_cover_url(olid, w_type)
+    else:
+        book_data["cover_url"] = None
+
+    # don't keep partial or stale data around
+    if complete and not stale:
+        ol_cache.set(cache_key, book_data, CACHE_TTLS.get(w_type, DAY))
+
+    return book_data
+
+
+async def fetch_data(olid, data_type):
+    """Fetch data for olid and data_type, served from ol_cache when possible"""
+
+    cache_key = f"{data_type}:{olid}"
+    cached = ol_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    data, ok, stale = await fetch_json(data_url(olid, data_type))
+    if ok and not stale:
+        ol_cache.set(cache_key, data, CACHE_TTLS.get(data_type, DAY))
+
+    return data
+
+#
+# Availability
+#
+
+async def fetch_availabilty_links(olid):
+    """Fetch availability data and links for olid, {} when they can't be fetched"""
+
+    w_type = work_type(olid)
+    try:
+        fetched_data = await fetch_data(olid, w_type)
+    except requests.RequestException as err:
+        print(f"WARNING: Availability for { olid } failed: { err }")
+        return {}
+    book_data = fetched_data.get(f"OLID:{olid}") if w_type == "books" else fetched_data
+    if not book_data or "error" in book_data:
+        # Open Library doesn't know olid
+        return {}
+
+    return parse_availability(book_data)
+
+#
+# Trending books
+#
+
+async def fetch_trending_books(trending_type, min=4, limit=12):
+    """Fetch trending books"""
+
+    return await run(open_library.fetch_trending_books, trending_type, min, limit)
@@ -0,0 +1,89 @@
+"""Keyset pagination
+
+Pages are read with WHERE (keys) > (last row's keys) ORDER BY keys LIMIT n,
+so every page costs one index range scan no matter how deep it is. The
+cursor handed to clients is the last row's keys, base64 encoded JSON.
+"""
+
+import base64
+import binascii
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import DateTime, Integer, String, bindparam, tuple_
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+Page = namedtuple("Page", ["items", "next_cursor"])
+
+
+def encode_cursor(values):
+    """Opaque cursor for the key values of a row"""
+
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor, keys):
+    """Key values from a cursor, raises ValueError if it doesn't fit keys"""
+
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (binascii.Error, UnicodeError, json.JSONDecodeError) as err:
+        raise ValueError(f"Bad cursor: {cursor}") from err
+
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValueError(f"Bad cursor: {cursor}")
+
+    try:
+        return [decode_value(key, value) for key, value in zip(keys, values)]
+    except (TypeError, ValueError) as err:
+        # well formed, but a value that doesn't fit its key
+        raise ValueError(f"Bad cursor: {cursor}") from err
+
+
+def decode_value(key, value):
+    """value as key's column type, raises TypeError if it is another type"""
+
+    if isinstance(key.type, DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(key.type, Integer):
+        # bool is an int too
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise TypeError(f"{key} takes an integer, not {value!r}")
+    elif isinstance(key.type, String):
+        if not isinstance(value, str):
+            raise TypeError(f"{key} takes a string, not {value!r}")
+    return value
+
+
+def clamp_limit(limit):
+    """Page size between 1 and MAX_PAGE_SIZE"""
+
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+
+def keyset_page(query, keys, row_key, after=None, limit=PAGE_SIZE):
+    """
+    The rows of query after the cursor, ordered by keys
+
+    keys must be unique together and covered by an index, row_key(row)
+    returns the key values of a row for the next cursor.
+    """
+
+    limit = clamp_limit(limit)
+    if after:
+        values = decode_cursor(after, keys)
+        bound = [bindparam(None, value, type_=key.type) for key, value in zip(keys, values)]
+        query = query.filter(tuple_(*keys) > tuple_(*bound))
+
+    rows = query.order_by(*keys).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(row_key(rows[-1]))
+
+    return Page(rows, next_cursor)
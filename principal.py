@@ -0,0 +1,104 @@
+"""Who is logged in, without loading the user row on every request
+
+The session carries the user's id and version stamp. The version
+is checked against a small TTL cache (shared with the Open Library cache
+backend when one is configured) so a profile edit or delete elsewhere logs
+stale sessions out. The full User row is only loaded when a view touches
+g.user.
+"""
+
+import os
+from collections import namedtuple
+
+from flask.ctx import _AppCtxGlobals
+
+from cache import LRUCache, TieredCache
+from models import db, User
+from open_library import ol_cache
+
+CUR_USER_KEY = "cur_user"
+CUR_VERSION_KEY = "cur_user_version"
+
+# Seconds a deleted or edited user can keep using an old session
+PRINCIPAL_TTL = float(os.getenv("PRINCIPAL_TTL", 60))
+
+Principal = namedtuple("Principal", ["id", "username", "version"])
+
+principal_cache = TieredCache(LRUCache(max_entries=4096, max_bytes=1024 * 1024), backend=ol_cache.backend)
+
+
+def principal_key(user_id):
+    return f"principal:{user_id}"
+
+
+def current_version(user_id):
+    """[username, version] for user_id or None if the user is gone"""
+
+    cached = principal_cache.get(principal_key(user_id))
+    if cached is not None:
+        return cached or None
+
+    row = db.session.query(User.username, User.version).filter_by(id=user_id).first()
+    current = list(row) if row is not None else []
+    principal_cache.set(principal_key(user_id), current, PRINCIPAL_TTL)
+
+    return current or None
+
+
+def load_principal(session):
+    """
+    Principal for the session or None when logged out
+
+    Clears the session when the user was deleted or edited since login
+    """
+
+    user_id = session.get(CUR_USER_KEY)
+    if user_id is None:
+        return None
+
+    current = current_version(user_id)
+    if current is None or current[1] != session.get(CUR_VERSION_KEY):
+        clear_principal(session)
+        return None
+
+    return Principal(user_id, current[0], current[1])
+
+
+def store_principal(session, user):
+    """Remember user in the session and refresh the cached version"""
+
+    session[CUR_USER_KEY] = user.id
+    session[CUR_VERSION_KEY] = user.version
+    principal_cache.set(principal_key(user.id), [user.username, user.version], PRINCIPAL_TTL)
+
+
+def clear_principal(session):
+    """Forget the logged in user"""
+
+    for key in (CUR_USER_KEY, CUR_VERSION_KEY):
+        session.pop(key, None)
+
+
+def invalidate_principal(user_id):
+    """Drop the cached version after the user is edited or deleted"""
+
+    principal_cache.delete(principal_key(user_id))
+
+
+class LazyUserGlobals(_AppCtxGlobals):
+    """Flask g that loads g.user (minus the password hash) on first use"""
+
+    def __getattr__(self, name):
+        if name != "user":
+            return super().__getattr__(name)
+
+        principal = self.__dict__.get("principal")
+        user = None
+        if principal is not None:
+            user = (User.query
+                .options(db.defer(User.password))
+                .filter_by(id=principal.id)
+                .first())
+
+        self.user = user
+        return user
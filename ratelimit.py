@@ -0,0 +1,306 @@
+"""Rate limiting for upstream calls
+
+A token bucket lets `rate` calls a second through on average and bursts of
+up to `burst` calls after a quiet spell. Callers that find the bucket empty
+reserve their token and sleep until it is due, so waiting threads are let
+through in the order they arrived instead of racing each other.
+
+The bucket's tokens can be kept in a SQLite file (sqlite:///path/to/db)
+that every worker on the host opens, so together they stay under one rate.
+A worker starting up or changing its rate doesn't refill the shared tokens.
+
+Calls are interactive (someone is waiting on a page) unless made inside
+`with priority(BACKGROUND):` (resyncs, jobs, refreshing feeds). Background
+calls never reserve ahead: they wait until the bucket holds more than the
+share kept for interactive calls, so they only use what interactive
+traffic leaves and never hold up a page. `with limited(bucket):` makes the
+calls in a block wait on a bucket of their own as well, to cap one job
+without changing the rate everyone else gets.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+INTERACTIVE, BACKGROUND = "interactive", "background"
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+# Share of the burst background calls leave in the bucket
+BACKGROUND_RESERVE = float(os.getenv("RATE_LIMIT_BACKGROUND_RESERVE", 0.5))
+# Recent waits kept per priority for the percentiles
+WAIT_SAMPLES = 1000
+# Tokens short of enough that still count as enough, refills are floats and
+# a wait too small to move the clock would never make up the difference
+EPSILON = 1e-9
+
+current_priority = ContextVar("current_priority", default=INTERACTIVE)
+current_limits = ContextVar("current_limits", default=())
+
+
+@contextmanager
+def priority(name):
+    """Calls made in the block (and tasks it submits with their context) use priority name"""
+
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown priority: {name}")
+
+    token = current_priority.set(name)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+@contextmanager
+def limited(bucket):
+    """Calls made in the block (and tasks it submits with their context) also wait on bucket"""
+
+    token = current_limits.set(current_limits.get() + (bucket,))
+    try:
+        yield
+    finally:
+        current_limits.reset(token)
+
+
+def percentile(values, fraction):
+    """Value at fraction (0..1) of the sorted values, 0.0 when empty"""
+
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class MemoryStore:
+    """Bucket state for this process only"""
+
+    def __init__(self):
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def transact(self, name, update):
+        """
+        Run update(state) -> (new state, result) atomically, state is
+        (tokens, updated) or None for a new bucket. returns result.
+        """
+
+        with self._lock:
+            state, result = update(self._state.get(name))
+            self._state[name] = state
+            return result
+
+    def reset(self, name):
+        with self._lock:
+            self._state.pop(name, None)
+
+
+class SQLiteStore:
+    """
+    Bucket state in a SQLite file that every worker on the host can open,
+    the file isn't opened until a bucket first uses it
+    """
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        """Open the file on first use (lock held)"""
+
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5)
+            if self.path != ":memory:":
+                conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+            self._conn = conn
+        return self._conn
+
+    def transact(self, name, update):
+        with self._lock:
+            conn = self._connection()
+            # take the write lock up front so no other worker reads in between
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+                state, result = update(row)
+                conn.execute(
+                    "INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)", (name, *state))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return result
+
+    def reset(self, name):
+        with self._lock:
+            self._connection().execute("DELETE FROM buckets WHERE name = ?", (name,))
+
+
+def store_from_url(url):
+    """SQLiteStore for sqlite:///path/to/db (sqlite:// for memory), MemoryStore for None or memory://"""
+
+    if not url or url == "memory://":
+        return MemoryStore()
+    if not url.startswith("sqlite://"):
+        raise ValueError(f"Unsupported rate limit store: {url}")
+    return SQLiteStore(url[len("sqlite:///"):] or ":memory:")
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, a rate of 0 (or less) doesn't limit
+
+    The clock is wall time by default so workers sharing a store agree on it.
+    A bucket missing from the store starts out full, one already there keeps
+    its tokens.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.time, sleep=time.sleep, store=None, name="default",
+                 background_reserve=BACKGROUND_RESERVE):
+        self.clock = clock
+        self.sleep = sleep
+        self.store = store if store is not None else MemoryStore()
+        self.name = name
+        self.background_reserve = background_reserve
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+        self.configure(rate, burst)
+
+    def configure(self, rate, burst=None):
+        """
+        Change the rate (calls per second) and burst for this worker, the
+        tokens in the store are left as they are
+        """
+
+        self.rate = float(rate)
+        self.burst = float(burst) if burst else max(self.rate, 1.0)
+
+    def reset(self):
+        """Start over with a full bucket, for every worker sharing the store"""
+
+        self.store.reset(self.name)
+
+    def _refill(self, state, now):
+        """(tokens, updated) topped up to now"""
+
+        if state is None:
+            return self.burst, now
+        tokens, updated = state
+        return min(self.burst, tokens + max(now - updated, 0) * self.rate), max(now, updated)
+
+    def reserve(self, tokens=1):
+        """Take tokens now, returns the seconds to wait before they may be used"""
+
+        if self.rate <= 0:
+            return 0.0
+
+        def update(state):
+            available, updated = self._refill(state, self.clock())
+            # may go negative, later callers wait behind this reservation
+            available -= tokens
+            return (available, updated), (0.0 if available >= -EPSILON else -available / self.rate)
+
+        return self.store.transact(self.name, update)
+
+    def try_take(self, tokens=1):
+        """
+        Take tokens if more than the interactive share would be left, for
+        background calls. returns 0.0 if taken, else the seconds until
+        there might be enough.
+        """
+
+        if self.rate <= 0:
+            return 0.0
+
+        floor = max(min(self.background_reserve * self.burst, self.burst - tokens), 0)
+
+        def update(state):
+            available, updated = self._refill(state, self.clock())
+            if available - tokens >= floor - EPSILON:
+                return (available - tokens, updated), 0.0
+            return (available, updated), (floor + tokens - available) / self.rate
+
+        return self.store.transact(self.name, update)
+
+    def acquire(self, tokens=1, priority=None):
+        """
+        Block until tokens may be used, returns the seconds waited
+
+        priority defaults to the caller's current_priority.
+        """
+
+        priority = priority or current_priority.get()
+        if self.rate <= 0:
+            self._record(priority, 0.0)
+            return 0.0
+
+        if priority == INTERACTIVE:
+            waits = [self.reserve(tokens)]
+        else:
+            waits = [self.try_take(tokens)]
+
+        if waits[-1] > 0:
+            self._waiting(priority, 1)
+            try:
+                self.sleep(waits[-1])
+                while priority != INTERACTIVE:
+                    # interactive calls that came in meanwhile go first
+                    waits.append(self.try_take(tokens))
+                    if waits[-1] == 0:
+                        break
+                    self.sleep(waits[-1])
+            finally:
+                self._waiting(priority, -1)
+
+        waited = sum(waits)
+        self._record(priority, waited)
+        return waited
+
+    #
+    # Metrics
+    #
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats = {
+                name: {"calls": 0, "waited": 0, "waiting": 0, "wait_total": 0.0, "waits": deque(maxlen=WAIT_SAMPLES)}
+                for name in PRIORITIES
+            }
+
+    def _record(self, priority, waited):
+        with self._stats_lock:
+            stats = self._stats[priority]
+            stats["calls"] += 1
+            stats["wait_total"] += waited
+            stats["waits"].append(waited)
+            if waited > 0:
+                stats["waited"] += 1
+
+    def _waiting(self, priority, change):
+        with self._stats_lock:
+            self._stats[priority]["waiting"] += change
+
+    def stats(self):
+        """Rate, burst and per priority: calls, how many waited and recent queue wait times"""
+
+        with self._stats_lock:
+            report = {"rate": self.rate, "burst": self.burst}
+            for name, stats in self._stats.items():
+                waits = list(stats["waits"])
+                report[name] = {
+                    "calls": stats["calls"],
+                    "waited": stats["waited"],
+                    "waiting": stats["waiting"],
+                    "wait_avg_ms": round(stats["wait_total"] * 1000 / stats["calls"], 1) if stats["calls"] else 0.0,
+                    "wait_p50_ms": round(percentile(waits, 0.5) * 1000, 1),
+                    "wait_p95_ms": round(percentile(waits, 0.95) * 1000, 1),
+                    "wait_max_ms": round(max(waits, default=0.0) * 1000, 1),
+                }
+            return report
@@ -0,0 +1,192 @@
+"""Keep a slow or failing Open Library from taking the site down with it
+
+Building blocks open_library puts around every upstream GET:
+
+  CircuitBreaker   stops calling an endpoint that keeps failing and lets one
+                   probe through after a while to see if it is back
+  RetryBudget      retries (and hedges) only while they stay a small share
+                   of the traffic, so an outage isn't met with a retry storm
+  jittered_backoff spreads retries out
+  hedged           sends a second copy of a slow idempotent request and
+                   takes whichever answers first
+"""
+
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, TimeoutError as FutureTimeoutError, wait
+
+import requests
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of calling an endpoint whose breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold failures in a row. Once reset_timeout
+    seconds have passed one call goes through (half open), its outcome
+    closes the breaker or opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probe_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go out now"""
+
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+
+            now = self.clock()
+            if self.state == OPEN and now - self._opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+
+            # one probe at a time, another if the last one never reported back
+            if self.state == HALF_OPEN and (self._probe_at is None or now - self._probe_at >= self.reset_timeout):
+                self._probe_at = now
+                return True
+
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.opened += 1
+                self.state = OPEN
+                self._opened_at = self.clock()
+                self._probe_at = None
+
+    def stats(self):
+        return {"state": self.state, "failures": self.failures, "opened": self.opened, "rejected": self.rejected}
+
+
+class CircuitBreakers:
+    """A CircuitBreaker per endpoint name, made on first use"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(
+                    name, CircuitBreaker(name, self.failure_threshold, self.reset_timeout, self.clock))
+        return breaker
+
+    def stats(self):
+        return {name: breaker.stats() for name, breaker in sorted(self._breakers.items())}
+
+    def clear(self):
+        with self._lock:
+            self._breakers = {}
+
+
+class RetryBudget:
+    """
+    Allows retries up to ratio of the requests seen in the last window
+    seconds, plus min_per_second so quiet processes can still retry
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=1, window=10, clock=time.monotonic):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self.clock = clock
+        self.exhausted = 0
+        self._requests = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        for times in (self._requests, self._retries):
+            while times and times[0] <= now - self.window:
+                times.popleft()
+
+    def record_request(self):
+        with self._lock:
+            now = self.clock()
+            self._trim(now)
+            self._requests.append(now)
+
+    def try_spend(self):
+        """Take a retry from the budget, False if there is none left"""
+
+        with self._lock:
+            now = self.clock()
+            self._trim(now)
+            if len(self._retries) + 1 > self.min_per_second * self.window + self.ratio * len(self._requests):
+                self.exhausted += 1
+                return False
+            self._retries.append(now)
+            return True
+
+    def stats(self):
+        with self._lock:
+            self._trim(self.clock())
+            return {"requests": len(self._requests), "retries": len(self._retries), "exhausted": self.exhausted}
+
+
+def jittered_backoff(attempt, base, cap, rand=random.random):
+    """Seconds to wait before retry number attempt (from 1), full jitter"""
+
+    return rand() * min(cap, base * 2 ** (attempt - 1))
+
+
+def hedged(fn, hedge_after, executor, can_hedge=lambda: True):
+    """
+    Call fn on executor, and again if the first call hasn't finished after
+    hedge_after seconds (and can_hedge() agrees). Returns the first result,
+    raises only when every call failed. fn must be safe to run twice.
+    Both calls run in the caller's context.
+    """
+
+    primary = executor.submit(contextvars.copy_context().run, fn)
+    try:
+        return primary.result(timeout=hedge_after)
+    except FutureTimeoutError:
+        pass
+
+    if not can_hedge():
+        return primary.result()
+
+    pending = {primary, executor.submit(contextvars.copy_context().run, fn)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                # the slower call finishes in the background and is dropped
+                return future.result()
+            error = future.exception()
+    raise error
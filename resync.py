@@ -0,0 +1,177 @@
+"""Refresh saved books' metadata from Open Library
+
+Books are filled in once when they are first added, so covers and authors
+drift from Open Library over time. Run this periodically (cron, a
+scheduler dyno):
+
+    flask --app app resync-books --rate 5
+
+It walks the books table in olid order a chunk at a time, fetches each
+chunk with batched and concurrent Open Library calls, at most --rate a
+second, and bulk updates the rows whose title, author or cover changed.
+Its calls are background priority, so they only get what the global rate
+limit leaves after the pages people are waiting on. Progress is written to a
+checkpoint file after every chunk, so an interrupted run carries on where
+it stopped. Fields Open Library comes back without are left alone rather
+than blanked.
+"""
+
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask.cli import with_appcontext
+
+from models import db, Book
+from open_library import fetch_many_book_data, forget_book_data, ol_rate_limit
+from pagination import MAX_PAGE_SIZE, keyset_page
+from ratelimit import BACKGROUND, TokenBucket, limited, priority
+
+RESYNC_CHECKPOINT = os.getenv("RESYNC_CHECKPOINT", os.path.join(tempfile.gettempdir(), "olreader-resync.json"))
+# Open Library requests per second while resyncing
+RESYNC_RATE = float(os.getenv("RESYNC_RATE", 5))
+RESYNC_CHUNK_SIZE = int(os.getenv("RESYNC_CHUNK_SIZE", 50))
+# works fetched at once, each fetches its authors on the shared executor
+RESYNC_CONCURRENCY = int(os.getenv("RESYNC_CONCURRENCY", 4))
+
+
+def new_progress():
+    return {"after": None, "scanned": 0, "changed": 0, "not_found": 0, "elapsed": 0.0, "rows_per_sec": 0.0}
+
+
+def load_checkpoint(path):
+    """Progress saved at path, None if there is none"""
+
+    try:
+        with open(path) as checkpoint:
+            return json.load(checkpoint)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path, state):
+    """Write progress atomically, a crash mid-write keeps the last checkpoint"""
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as checkpoint:
+        json.dump(state, checkpoint)
+    os.replace(tmp_path, path)
+
+
+def changed_values(book, fetched):
+    """
+    The book's row updated with fetched data, None if nothing changes
+
+    Every changed row has the same columns, so a chunk's updates go out as
+    a single executemany.
+    """
+
+    values = {
+        "olid": book.olid,
+        "title": fetched.get("title") or book.title,
+        "author": (fetched.get("authors") or [book.author])[0],
+        "cover_url": fetched.get("cover_url") or book.cover_url,
+        "pending": False,
+    }
+
+    if all(values[column] == getattr(book, column) for column in values):
+        return None
+    return values
+
+
+def resync_chunk(books, executor):
+    """
+    Fetch fresh data for books and bulk update the changed ones
+
+    returns (changed, not_found) counts
+    """
+
+    olids = [book.olid for book in books]
+    for olid in olids:
+        forget_book_data(olid)
+
+    fetched, _ = fetch_many_book_data(olids, timeout=None, executor=executor)
+
+    updates = []
+    for book in books:
+        if book.olid in fetched:
+            values = changed_values(book, fetched[book.olid])
+            if values is not None:
+                updates.append(values)
+
+    if updates:
+        # UPDATE ... WHERE olid = ? executed once with every row
+        db.session.execute(db.update(Book), updates)
+    db.session.commit()
+
+    return len(updates), len(books) - len(fetched)
+
+
+def resync_books(checkpoint=RESYNC_CHECKPOINT, chunk_size=RESYNC_CHUNK_SIZE, rate=RESYNC_RATE,
+                 concurrency=RESYNC_CONCURRENCY, restart=False, max_chunks=None, report=print):
+    """
+    Resync every book, resuming from checkpoint unless restart
+
+    The checkpoint is removed once the walk finishes. max_chunks stops
+    early (leaving the checkpoint) for runs that should take a bounded
+    time. returns the final progress dict.
+    """
+
+    state = (not restart and load_checkpoint(checkpoint)) or new_progress()
+    if state["after"] is not None:
+        report(f"Resuming after {state['scanned']} books")
+
+    query = db.session.query(Book.olid, Book.title, Book.author, Book.cover_url, Book.pending)
+    # its own bucket caps the resync at rate, the shared one is left alone
+    resync_limit = TokenBucket(rate, store=ol_rate_limit.store, name="resync", background_reserve=0)
+    chunks = 0
+    # pages waiting on Open Library in other workers go first
+    with priority(BACKGROUND), limited(resync_limit), \
+            ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="resync") as executor:
+        while max_chunks is None or chunks < max_chunks:
+            start = time.perf_counter()
+            page = keyset_page(query, [Book.olid], lambda row: [row.olid], state["after"], chunk_size)
+            if not page.items:
+                break
+
+            changed, not_found = resync_chunk(page.items, executor)
+            chunks += 1
+
+            state["scanned"] += len(page.items)
+            state["changed"] += changed
+            state["not_found"] += not_found
+            state["elapsed"] += time.perf_counter() - start
+            state["after"] = page.next_cursor
+            state["rows_per_sec"] = round(state["scanned"] / state["elapsed"], 1) if state["elapsed"] else 0.0
+
+            report(f"{state['scanned']} books, {state['changed']} changed, "
+                f"{state['not_found']} not found, {state['rows_per_sec']} rows/sec")
+
+            if page.next_cursor is None:
+                state["after"] = None
+                break
+            save_checkpoint(checkpoint, state)
+
+    if state["after"] is None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    return state
+
+
+@click.command("resync-books")
+@click.option("--checkpoint", default=RESYNC_CHECKPOINT, show_default=True, help="Progress file to resume from.")
+@click.option("--chunk-size", default=RESYNC_CHUNK_SIZE, show_default=True, type=click.IntRange(1, MAX_PAGE_SIZE))
+@click.option("--rate", default=RESYNC_RATE, show_default=True, help="Open Library requests per second.")
+@click.option("--concurrency", default=RESYNC_CONCURRENCY, show_default=True, type=click.IntRange(1))
+@click.option("--restart", is_flag=True, help="Ignore the checkpoint and start from the first book.")
+@click.option("--max-chunks", type=click.IntRange(1), help="Stop after this many chunks.")
+@with_appcontext
+def resync_books_command(checkpoint, chunk_size, rate, concurrency, restart, max_chunks):
+    """Refresh book metadata from Open Library."""
+
+    state = resync_books(checkpoint, chunk_size, rate, concurrency, restart, max_chunks, report=click.echo)
+    status = "Done" if state["after"] is None else "Stopped, run again to resume"
+    click.echo(f"{status}: {state['scanned']} books, {state['changed']} changed, {state['rows_per_sec']} rows/sec")
@@ -1,16 +1,32 @@
 """Seed database"""
 
-from app import db
-from models import User, Book, BookNote, BookList
+import click
+from flask.cli import with_appcontext
+from flask_migrate import stamp, upgrade
 
+from models import db, User, Book, BookNote, BookList
 
-def seed_data(db):
-    """Load the seed data"""
+# the schema db.create_all() built before there were migrations
+BASELINE_REVISION = "0001"
 
-    db.drop_all()
-    db.create_all()
 
-    db.session.commit()
+def init_db(db, drop=False):
+    """Run the migrations, dropping everything first if drop"""
+
+    if drop:
+        db.drop_all()
+        db.session.execute(db.text("DROP TABLE IF EXISTS alembic_version"))
+        db.session.commit()
+
+    inspector = db.inspect(db.engine)
+    if inspector.has_table("users") and not inspector.has_table("alembic_version"):
+        stamp(revision=BASELINE_REVISION)
+
+    upgrade()
+
+
+def seed_data(db):
+    """Load the seed data"""
 
     test_user = User.signup("davidh", "me@email.com", "welcome1")
     test_user.is_admin = True
@@ -63,3 +79,25 @@ def seed_data(db):
 
     db.session.add_all([b1, b2, b3])
     db.session.commit()
+
+
+@click.command("db-init")
+@click.option("--drop", is_flag=True, help="Drop every table first (deletes all data).")
+@with_appcontext
+def init_db_command(drop):
+    """Create or upgrade the database tables."""
+
+    init_db(db, drop=drop)
+    click.echo("Database initialized.")
+
+
+@click.command("seed")
+@click.option("--reset", is_flag=True, help="Drop and recreate the tables first (deletes all data).")
+@with_appcontext
+def seed_command(reset):
+    """Load the sample users, lists and books."""
+
+    if reset:
+        init_db(db, drop=True)
+    seed_data(db)
+    click.echo("Sample data loaded.")
@@ -1,4 +1,5 @@
 const $bookListBooks = $('#booklist-books');
+const $userNotes = $('#user-notes');
 const $createListModal = $('#createListModal');
 
 let olidToAdd = null;
@@ -24,10 +25,14 @@ async function addBook(evt) {
 
 function addToBooklist(book) {
     if ($bookListBooks) {
+        // already on the page, e.g. added here then reached by scrolling
+        if ($bookListBooks.children(`.list-book[data-olid="${book.olid}"]`).length) {
+            return;
+        }
         $bookListBooks.children('.empty-list-msg').hide();
-        const $div = $('<div class="list-book"></div')
+        const $div = $(`<div class="list-book" data-olid="${book.olid}"></div`)
         const $cover = (book.cover_url != null && book.cover_url.length > 0) ?
-            $(`<img class="cover-image" src="${book.cover_url}-S.jpg" />`) :
+            $(`<img class="cover-image" src="${coverSrc(book.cover_url, 'S')}" />`) :
             $('<span class="cover-text fa-3x text-primary"><i class="fa-solid fa-book-bookmark"></i></span>');
         const $title = $(`<span class="book-title"><a href="/books/${book.olid}">${book.title}</a> by ${book.author} <a href="#" class="link-danger" data-id="${book.olid}" title="Remove"><i class="fa-regular fa-circle-xmark"></i></span>`);
         $div.append($cover);
@@ -99,8 +104,63 @@ async function createListFromModal(evt) {
     $createListModal.modal('hide');
 }
 
+function addToNotes(note) {
+    $userNotes.append($(`<li><a href="/notes/${note.id}">${note.book.title}</a></li>`));
+}
+
+// Infinite scroll: load the next page from data-source when the end of
+// $container scrolls into view, until the server says there is no next
+function setupInfiniteScroll($container, addItem) {
+    const $sentinel = $('<div class="scroll-sentinel"></div>');
+    $container.after($sentinel);
+    let loading = false;
+
+    const observer = new IntersectionObserver(async (entries) => {
+        if (!entries[0].isIntersecting || loading) {
+            return;
+        }
+
+        const next = $container.data('next');
+        if (!next) {
+            observer.disconnect();
+            return;
+        }
+
+        loading = true;
+        try {
+            const result = await axios.get($container.data('source'), {params: {after: next}});
+            if (result.data['err'] != null) {
+                const {err, type} = result.data;
+                displayErrMsg(err, type);
+                observer.disconnect();
+                return;
+            }
+
+            for (const item of result.data.items) {
+                addItem(item);
+            }
+            $container.data('next', result.data.next);
+        } finally {
+            loading = false;
+        }
+
+        // observe again so a sentinel that is still visible loads another page
+        observer.unobserve($sentinel[0]);
+        observer.observe($sentinel[0]);
+    }, {rootMargin: '400px'});
+
+    observer.observe($sentinel[0]);
+}
+
 if ($bookListBooks.length) {
     $bookListBooks.on('click', '.fa-circle-xmark', removeBook);
+    if ($bookListBooks.data('source')) {
+        setupInfiniteScroll($bookListBooks, addToBooklist);
+    }
+}
+
+if ($userNotes.length) {
+    setupInfiniteScroll($userNotes, addToNotes);
 }
 
 if ($('.add-list').length) {
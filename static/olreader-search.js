@@ -3,32 +3,115 @@ const $resultsDisplay = $('#search-results-display');
 
 let cur_page = 1;
 let num_results =  0;
+let shown_olids = new Set();
 
 async function performSearch(searchTerm, page = 1) {
     $('#search-loading').show();
 
-    searchResults = await axios.get(`/search/${searchTerm}?page=${page}`);
+    if (window.ReadableStream && window.TextDecoder) {
+        await streamSearch(searchTerm, page);
+        $('#search-loading').hide();
+        return;
+    }
+
+    if (page == 1) {
+        // saved books come back right away, openlibrary.org results follow
+        const localResults = await axios.get(`/search/${searchTerm}?source=local&profile=${searchProfile()}`);
+        populateSearchResults(searchTerm, localResults, false);
+    }
+
+    searchResults = await axios.get(`/search/${searchTerm}?page=${page}&source=remote&profile=${searchProfile()}`);
     $('#search-loading').hide();
 
     populateSearchResults(searchTerm, searchResults);
 }
 
-function populateSearchResults(searchTerm, searchResults) {
+function searchProfile() {
+    // pages have to be the same size as the ones already shown
+    return $resultsDisplay.data('profile') || 'compact';
+}
+
+async function streamSearch(searchTerm, page) {
+    // one JSON object per line, each is rendered as soon as it arrives
+    const response = await fetch(`/search/${searchTerm}/stream?page=${page}&profile=${searchProfile()}`);
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    const search = {term: searchTerm, userLists: [], total: 0, shown: 0};
+    let buffered = '';
+
+    while (true) {
+        const {done, value} = await reader.read();
+        buffered += decoder.decode(value || new Uint8Array(), {stream: !done});
+
+        const lines = buffered.split('\n');
+        buffered = lines.pop();
+        for (let line of lines) {
+            if (line.trim().length > 0) {
+                handleSearchLine(search, JSON.parse(line));
+            }
+        }
+
+        if (done) {
+            break;
+        }
+    }
+}
+
+function handleSearchLine(search, line) {
+    if (line['err'] != null) {
+        displayErrMsg(line['err'], line['type']);
+    }
+    if (line['user_lists'] != null) {
+        // saved books, not counted against the openlibrary.org total
+        search.userLists = line['user_lists'];
+        showWorks(search.term, line['works'], search.userLists);
+        return;
+    }
+    if (line['total'] != null) {
+        search.total = line['total'];
+    }
+    if (line['works'] != null) {
+        showWorks(search.term, line['works'], search.userLists);
+        search.shown += line['works'].length;
+        updateSearchCount(line['works'].length, search.total);
+    }
+    if (line['done']) {
+        // works that were already shown as saved books still count
+        updateSearchCount(line['num_returned'] - search.shown, search.total);
+    }
+}
+
+function populateSearchResults(searchTerm, searchResults, countResults = true) {
     const {data: {user_lists, results:{num_returned, total, works}}} = searchResults;
 
+    showWorks(searchTerm, works, user_lists);
+    if (countResults) {
+        updateSearchCount(num_returned, total);
+    }
+}
+
+function showWorks(searchTerm, works, userLists) {
     const $resultList = $resultsDisplay.children('#search-results');
     for(let work of works) {
-        $resultList.append(generateResultHTML(work, user_lists));
+        if (shown_olids.has(work['olid'])) {
+            continue;
+        }
+        shown_olids.add(work['olid']);
+        $resultList.append(generateResultHTML(work, userLists));
     }
 
     $resultsDisplay.find('#search-text').text(searchTerm);
-    num_results += num_returned;
+    $resultsDisplay.show();
+}
+
+function updateSearchCount(added, total) {
+    num_results += added;
     $resultsDisplay.find('#search-results-count').text(`Showing ${num_results} of ${total} results`);
     if (num_results >= total) {
         $('#search-load-more').hide();
+    } else {
+        $('#search-load-more').show();
     }
-
-    $resultsDisplay.show();
 }
 
 function generateResultHTML(workResult, userLists) {
@@ -36,7 +119,7 @@ function generateResultHTML(workResult, userLists) {
 
     const coverURL = workResult['cover_url'];
     const $cover = (coverURL != null && coverURL.length > 0) ?
-            $(`<img class="cover-image" src="${coverURL}-S.jpg" />`) :
+            $(`<img class="cover-image" src="${coverSrc(coverURL, 'S')}" />`) :
             $('<span class="cover-text fa-3x text-primary"><i class="fa-solid fa-book-bookmark"></i></span>');
     
     const $title = $(`<span class="search-title">${workResult['title']} by ${workResult['author_name']}</span>`);
@@ -46,7 +129,7 @@ function generateResultHTML(workResult, userLists) {
 
     const list_search = $bookSearch.data('listid') != null;
     if (list_search) {
-        const $addButton = $(`<a href="#" class="btn btn-outline-primary btn-sm mx-2" data-id="${workResult['olid']}" data-isbn="${workResult['isbn']}">Add to List</a>`);
+        const $addButton = $(`<a href="#" class="btn btn-outline-primary btn-sm mx-2" data-id="${workResult['olid']}" data-isbn="${workResult['isbn'] || ''}">Add to List</a>`);
         $addButton.click(addBook);
         $div.append($addButton);
     } else {
@@ -72,6 +155,7 @@ function resetSearchDisplay() {
     $resultsDisplay.hide();
     cur_page = 1;
     num_results =  0;
+    shown_olids = new Set();
 }
 
 function getSearchTerm(target) {
@@ -113,4 +197,37 @@ if ($('#search-results-count').length) {
     if (initialCount != null) {
         num_results = initialCount;
     }
-}
\ No newline at end of file
+    $('#search-results .search-result').each((idx, result) => {
+        shown_olids.add($(result).data('olid'));
+    });
+}
+
+const $bookSuggestions = $('#book-suggestions');
+const SUGGEST_DELAY_MS = 120;
+let suggestTimer = null;
+let suggestPrefix = '';
+
+$('input[data-suggest]').on('input', function() {
+    // wait for a pause in typing, answers come from the server's memory
+    const prefix = $(this).val().trim();
+    clearTimeout(suggestTimer);
+    if (prefix.length < 2) {
+        $bookSuggestions.empty();
+        return;
+    }
+    suggestTimer = setTimeout(() => showSuggestions(prefix), SUGGEST_DELAY_MS);
+});
+
+async function showSuggestions(prefix) {
+    suggestPrefix = prefix;
+    const response = await axios.get('/search/suggest', {params: {prefix: prefix}});
+    if (prefix != suggestPrefix) {
+        // typed on while this was in flight
+        return;
+    }
+
+    $bookSuggestions.empty();
+    for (let suggestion of response.data.suggestions) {
+        $bookSuggestions.append($('<option>').attr('value', suggestion.title).text(suggestion.author_name));
+    }
+}
@@ -7,7 +7,7 @@ function createBookHTML(book, userLists) {
 
     const $cardDiv = $(`<div class="card" data-olid=${lending_olid}></div>`);
     if (cover_key != null) {
-        $cardDiv.append($(`<img class="card-img-top" src="https://covers.openlibrary.org/b/olid/${cover_key}-M.jpg" alt="Book cover">`));
+        $cardDiv.append($(`<img class="card-img-top" src="/covers/olid/${cover_key}-M.jpg" alt="Book cover">`));
     } else {
         $cardDiv.append($('<img class="card-img-top" src="/static/images/blank_cover-M.webp" alt="Blank cover">'))
     }
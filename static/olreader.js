@@ -32,3 +32,13 @@ function createAddListDropdownHTML($container, olid, userLists, btnStyle='btn-pr
     }
     $container.append($dropdown);
 }
+
+
+// Serve covers.openlibrary.org images through the local cover cache
+function coverSrc(coverURL, size) {
+    const match = /^https:\/\/covers\.openlibrary\.org\/[bw]\/(id|olid|isbn)\/([^/]+)$/.exec(coverURL);
+    if (match == null) {
+        return `${coverURL}-${size}.jpg`;
+    }
+    return `/covers/${match[1]}/${match[2]}-${size}.jpg`;
+}
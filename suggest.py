@@ -0,0 +1,310 @@
+"""Search suggestions as the user types
+
+An in-memory prefix index over saved books' titles and authors plus the
+works recent openlibrary.org searches returned, so /search/suggest answers
+from memory instead of calling openlibrary.org on every keystroke.
+
+Keys are kept in one sorted list and looked up with bisect. Every title
+and author is indexed from each of its first few words, so "chest" and
+"zanzibar ch" both find "The Zanzibar Chest". Saved books are loaded once,
+then only the rows whose updated_at moved are read back, all in the
+background so a suggestion never waits on the database. Every so often the
+saved olids are read back as well to drop the books deleted since.
+"""
+
+import os
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from itertools import islice
+from datetime import timedelta
+
+from models import db, Book
+
+# Suggestions returned by default and at most
+SUGGEST_LIMIT = int(os.getenv("SUGGEST_LIMIT", 8))
+MAX_SUGGEST_LIMIT = 20
+# Keys looked at per lookup, bounds the time short prefixes take
+SUGGEST_SCAN = int(os.getenv("SUGGEST_SCAN", 200))
+# Works from openlibrary.org searches remembered, the oldest seen go first
+SUGGEST_REMOTE_MAX = int(os.getenv("SUGGEST_REMOTE_MAX", 5000))
+# Seconds between reads of the books changed since the last one
+SUGGEST_REFRESH_INTERVAL = float(os.getenv("SUGGEST_REFRESH_INTERVAL", 30))
+# Changes are read back from this many seconds before the newest one seen,
+# so rows committed late by slow transactions aren't missed
+SUGGEST_REFRESH_OVERLAP = timedelta(seconds=float(os.getenv("SUGGEST_REFRESH_OVERLAP", 60)))
+# Seconds between reads of every saved olid, to forget deleted books
+SUGGEST_PRUNE_INTERVAL = float(os.getenv("SUGGEST_PRUNE_INTERVAL", 10 * 60))
+
+# words of a title or author that start a key, and how long a key gets
+MAX_KEY_WORDS = 6
+MAX_KEY_LENGTH = 40
+# batches with more keys than this are merged or removed in one pass over
+# the list instead of one insort or del each
+BULK_KEYS = 64
+
+# key kinds, also their rank
+TITLE, TITLE_WORD, AUTHOR = 0, 1, 2
+LOCAL, REMOTE = 0, 1
+
+
+def normalize(text):
+    """Lowercase words without accents or punctuation"""
+
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(char for char in text if not unicodedata.combining(char)).casefold()
+    return " ".join("".join(char if char.isalnum() else " " for char in text).split())
+
+
+def text_keys(text, first_kind, word_kind):
+    """(key, kind) for text read from each of its first words"""
+
+    words = normalize(text).split()
+    return [(" ".join(words[num:])[:MAX_KEY_LENGTH], first_kind if num == 0 else word_kind)
+            for num in range(min(len(words), MAX_KEY_WORDS))]
+
+
+class SuggestIndex:
+    """Sorted (key, kind, olid) list with the title and author for each olid"""
+
+    def __init__(self, remote_max=SUGGEST_REMOTE_MAX, refresh_interval=SUGGEST_REFRESH_INTERVAL,
+                 prune_interval=SUGGEST_PRUNE_INTERVAL):
+        self.remote_max = remote_max
+        self.refresh_interval = refresh_interval
+        self.prune_interval = prune_interval
+        self._keys = []
+        # olid -> (title, author_name, source, keys)
+        self._entries = {}
+        self._remote = OrderedDict()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._claim_lock = threading.Lock()
+        self._refresh_thread = None
+        self._loaded = False
+        # None until the first refresh is started
+        self._refreshed_at = None
+        self._pruned_at = 0.0
+        self._newest = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def loaded(self):
+        """Whether the saved books have been loaded"""
+
+        return self._loaded
+
+    def _add(self, books):
+        """
+        Index {olid: (title, author_name, source)}, replacing what was
+        indexed for those olids (lock held)
+        """
+
+        new_keys = []
+        for olid, (title, author_name, source) in books.items():
+            old = self._entries.get(olid)
+            if old is not None:
+                if old[2] == LOCAL and source == REMOTE:
+                    continue
+                if old[:3] == (title, author_name, source):
+                    continue
+                self._remove([olid])
+
+            keys = tuple(dict.fromkeys((key, kind, olid) for key, kind in
+                text_keys(title, TITLE, TITLE_WORD) + text_keys(author_name, AUTHOR, AUTHOR)))
+            self._entries[olid] = (title, author_name, source, keys)
+            new_keys.extend(keys)
+
+        if len(new_keys) <= BULK_KEYS:
+            for key in new_keys:
+                insort(self._keys, key)
+            return
+
+        # each insort shifts the rest of the list and sorting it all again
+        # compares every key, copying the runs in between is far cheaper
+        merged = []
+        start = 0
+        for key in sorted(new_keys):
+            pos = bisect_left(self._keys, key, start)
+            merged += self._keys[start:pos]
+            merged.append(key)
+            start = pos
+        merged += self._keys[start:]
+        self._keys = merged
+
+    def _remove(self, olids):
+        """Drop everything indexed for olids (lock held)"""
+
+        keys = []
+        for olid in olids:
+            keys.extend(self._entries.pop(olid)[3])
+            self._remote.pop(olid, None)
+
+        if len(keys) <= BULK_KEYS:
+            for key in keys:
+                pos = bisect_left(self._keys, key)
+                if pos < len(self._keys) and self._keys[pos] == key:
+                    del self._keys[pos]
+            return
+
+        # like merging in _add, copy the runs between the removed keys
+        kept = []
+        start = 0
+        for key in sorted(keys):
+            pos = bisect_left(self._keys, key, start)
+            kept += self._keys[start:pos]
+            start = pos + 1 if pos < len(self._keys) and self._keys[pos] == key else pos
+        kept += self._keys[start:]
+        self._keys = kept
+
+    def add_books(self, rows):
+        """Index saved books, rows have olid, title and author"""
+
+        books = {row.olid: (row.title, row.author, LOCAL) for row in rows}
+        with self._lock:
+            self._add(books)
+
+    def add_works(self, works):
+        """Remember works an openlibrary.org search returned"""
+
+        books = {work["olid"]: (work["title"], work.get("author_name") or "", REMOTE)
+                 for work in works if work.get("olid") and work.get("title")}
+        with self._lock:
+            self._add(books)
+            for olid in books:
+                if self._entries[olid][2] == REMOTE:
+                    self._remote[olid] = None
+                    self._remote.move_to_end(olid)
+
+            evicted = list(islice(self._remote, max(len(self._remote) - self.remote_max, 0)))
+            self._remove(evicted)
+
+    def suggest(self, prefix, limit=SUGGEST_LIMIT):
+        """
+        Up to limit {olid, title, author_name} starting with prefix
+
+        Whole title matches come before matches further into a title and
+        those before author matches, saved books before remote works.
+        """
+
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        with self._lock:
+            pos = bisect_left(self._keys, (prefix,))
+            end = min(pos + SUGGEST_SCAN, len(self._keys))
+            candidates = {}
+            for key, kind, olid in self._keys[pos:end]:
+                if not key.startswith(prefix):
+                    break
+                if kind < candidates.get(olid, (AUTHOR + 1,))[0]:
+                    title, author_name, source, _ = self._entries[olid]
+                    candidates[olid] = (kind, source, len(title), title, author_name)
+
+        suggestions = []
+        seen = set()
+        for olid, (kind, source, _, title, author_name) in sorted(candidates.items(), key=lambda item: item[1]):
+            # the work and its edition are often both indexed
+            book = (normalize(title), normalize(author_name))
+            if book in seen:
+                continue
+            seen.add(book)
+            suggestions.append({"olid": olid, "title": title, "author_name": author_name})
+            if len(suggestions) == limit:
+                break
+
+        return suggestions
+
+    def refresh(self):
+        """
+        Read the saved books changed since the last refresh, all of them
+        the first time. Needs an app context.
+        """
+
+        with self._refresh_lock:
+            query = db.session.query(Book.olid, Book.title, Book.author, Book.updated_at)
+            if self._newest is not None:
+                query = query.filter(Book.updated_at >= self._newest - SUGGEST_REFRESH_OVERLAP)
+
+            rows = query.all()
+            db.session.commit()
+            self.add_books(rows)
+
+            newest = max((row.updated_at for row in rows), default=None)
+            if newest is not None and (self._newest is None or newest > self._newest):
+                self._newest = newest
+
+            if not self._loaded:
+                self._loaded = True
+                self._pruned_at = time.monotonic()
+            elif time.monotonic() - self._pruned_at >= self.prune_interval:
+                self.prune()
+
+            self._refreshed_at = time.monotonic()
+            return len(rows)
+
+    def prune(self):
+        """
+        Forget the saved books no longer in the database, returns how
+        many. Needs an app context.
+        """
+
+        olids = {olid for olid, in db.session.query(Book.olid)}
+        db.session.commit()
+        self._pruned_at = time.monotonic()
+
+        with self._lock:
+            gone = [olid for olid, entry in self._entries.items() if entry[2] == LOCAL and olid not in olids]
+            self._remove(gone)
+        return len(gone)
+
+    def ensure_fresh(self, app):
+        """
+        Load the saved books in a background thread the first time, after
+        that refresh them there once refresh_interval has passed. Also
+        tried again after refresh_interval when a load fails.
+
+        returns whether the saved books are loaded
+        """
+
+        # claim the refresh so concurrent requests don't start one each
+        with self._claim_lock:
+            if self._refresh_lock.locked() or (
+                    self._refreshed_at is not None and time.monotonic() - self._refreshed_at < self.refresh_interval):
+                return self._loaded
+            self._refreshed_at = time.monotonic()
+
+        self._refresh_thread = threading.Thread(target=self._refresh_in, args=(app,), name="suggest-refresh", daemon=True)
+        self._refresh_thread.start()
+        return self._loaded
+
+    def wait(self, timeout=None):
+        """Wait for the refresh running in the background, if any"""
+
+        if self._refresh_thread is not None:
+            self._refresh_thread.join(timeout)
+
+    def _refresh_in(self, app):
+        with app.app_context():
+            try:
+                self.refresh()
+            except Exception as err:
+                db.session.rollback()
+                print(f"WARNING: Refreshing search suggestions failed: { err }")
+
+    def clear(self):
+        with self._lock:
+            self._keys = []
+            self._entries = {}
+            self._remote = OrderedDict()
+            self._loaded = False
+            self._refreshed_at = None
+            self._pruned_at = 0.0
+            self._newest = None
+
+
+suggest_index = SuggestIndex()
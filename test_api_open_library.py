@@ -5,10 +5,16 @@
 #    python -m unittest test_models_book.py
 
 
+import json
+import threading
+import time
 from unittest import TestCase
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 
-from open_library import fetch_book_data, work_type, create_cover_url, parse_search_data
+import open_library
+from open_library import SEARCH_PROFILES, SearchStreamDecoder, project_works, iter_search_events, stream_search, fetch_book_data, fetch_data, fetch_books_bulk, fetch_many_book_data, keyword_search, work_type, create_cover_url, parse_search_data
+from ratelimit import limited
+from resilience import CircuitBreakers
 
 
 class OpenLibraryAPITestCase(TestCase):
@@ -17,6 +23,8 @@ class OpenLibraryAPITestCase(TestCase):
     def setUp(self):
         """Create test client, add sample data."""
         
+        open_library.ol_cache.clear()
+        open_library.search_cache.clear()
         # self.client = app.test_client()
         self.mock_data = {"OLID:OL26992991M": {"url": "https://openlibrary.org/books/OL26992991M/A_Court_of_Mist_and_Fury", "key": "/books/OL26992991M", "title": "A Court of Mist and Fury", "authors": [{"url": "https://openlibrary.org/authors/OL7115219A/Sarah_J._Maas", "name": "Sarah J. Maas"}], "number_of_pages": 640, "identifiers": {"isbn_10": ["1619634465"], "isbn_13": ["9781619634466"], "openlibrary": ["OL26992991M"]}, "classifications": {"lc_classifications": ["PZ7.M111575Com 2016"]}, "publishers": [{"name": "Bloomsbury"}], "publish_date": "2016-05", "subjects": [{"name": "Fantasy", "url": "https://openlibrary.org/subjects/fantasy"}, {"name": "Fiction", "url": "https://openlibrary.org/subjects/fiction"}, {"name": "Fairies", "url": "https://openlibrary.org/subjects/fairies"}, {"name": "Blessing and cursing", "url": "https://openlibrary.org/subjects/blessing_and_cursing"}, {"name": "Fantasy fiction", "url": "https://openlibrary.org/subjects/fantasy_fiction"}, {"name": "Fairies, fiction", "url": "https://openlibrary.org/subjects/fairies,_fiction"}, {"name": "nyt:young-adult-hardcover=2016-05-22", "url": "https://openlibrary.org/subjects/nyt:young-adult-hardcover=2016-05-22"}, {"name": "New York Times bestseller", "url": "https://openlibrary.org/subjects/new_york_times_bestseller"}, {"name": "nyt:young-adult-e-book=2016-05-22", "url": "https://openlibrary.org/subjects/nyt:young-adult-e-book=2016-05-22"}, {"name": "collectionID:TexChallenge2021", "url": "https://openlibrary.org/subjects/collectionid:texchallenge2021"}, {"name": "collectionID:KellerChallenge", "url": "https://openlibrary.org/subjects/collectionid:kellerchallenge"}, {"name": "collectionID:EanesChallenge", "url": "https://openlibrary.org/subjects/collectionid:eaneschallenge"}, {"name": "collectionID:AlpineChallenge", "url": "https://openlibrary.org/subjects/collectionid:alpinechallenge"}, {"name": "Adaptations", "url": "https://openlibrary.org/subjects/adaptations"}, {"name": "Magic", "url": "https://openlibrary.org/subjects/magic"}, {"name": "Courts and courtiers", "url": "https://openlibrary.org/subjects/courts_and_courtiers"}, {"name": "F\u00e9es", "url": "https://openlibrary.org/subjects/f\u00e9es"}, {"name": "Romans, nouvelles, etc. pour la jeunesse", "url": "https://openlibrary.org/subjects/romans,_nouvelles,_etc._pour_la_jeunesse"}, {"name": "Cours et courtisans", "url": "https://openlibrary.org/subjects/cours_et_courtisans"}, {"name": "Fantasy & Magic", "url": "https://openlibrary.org/subjects/fantasy_&_magic"}, {"name": "Love & Romance", "url": "https://openlibrary.org/subjects/love_&_romance"}, {"name": "Action & Adventure", "url": "https://openlibrary.org/subjects/action_&_adventure"}, {"name": "General", "url": "https://openlibrary.org/subjects/general"}, {"name": "series:A_Court_of_Thorns_and_Roses", "url": "https://openlibrary.org/subjects/series:a_court_of_thorns_and_roses"}], "subject_people": [{"name": "Tam Lin (Legendary character)", "url": "https://openlibrary.org/subjects/person:tam_lin_(legendary_character)"}], "ebooks": [{"preview_url": "https://archive.org/details/courtofmistfury0000maas", "availability": "restricted", "formats": {}}], "covers": {"small": "https://covers.openlibrary.org/b/id/14315081-S.jpg", "medium": "https://covers.openlibrary.org/b/id/14315081-M.jpg", "large": "https://covers.openlibrary.org/b/id/14315081-L.jpg"}}}
         self.search_data  = {"numFound": 327, "start": 0, "numFoundExact": True,  "docs":[
@@ -113,6 +121,33 @@ class OpenLibraryAPITestCase(TestCase):
         # with app.app_context():
         #     db.session.rollback()
 
+    #
+    # HTTP session
+    #
+
+    def test_session_pools_per_host(self):
+        """Each Open Library host gets its own keep-alive pool"""
+
+        open_library.close_session()
+        session = open_library.get_session()
+
+        self.assertIs(open_library.get_session(), session)
+        self.assertIsNot(session.get_adapter("https://openlibrary.org/search.json"),
+                         session.get_adapter("https://covers.openlibrary.org/b/id/1-S.jpg"))
+
+        open_library.close_session()
+        self.assertIsNot(open_library.get_session(), session)
+        open_library.close_session()
+
+    def test_http_get_timeout(self):
+        """Requests use the configured connect and read timeouts"""
+
+        with patch("open_library.get_session") as mock_session:
+            open_library.http_get("https://openlibrary.org/works/OL1W.json")
+            mock_session.return_value.get.assert_called_once_with(
+                "https://openlibrary.org/works/OL1W.json",
+                timeout=(open_library.CONNECT_TIMEOUT, open_library.READ_TIMEOUT))
+
     #
     # Helper methods
     #
@@ -144,6 +179,42 @@ class OpenLibraryAPITestCase(TestCase):
         self.assertEqual(data["title"], "Watchmen")
         self.assertEqual(data["author_name"], "Alan Moore")
 
+    def test_keyword_search_cached(self):
+        """Equivalent searches are served from the search cache"""
+
+        with patch("open_library.do_search", return_value=self.search_data) as mock_search:
+            first = keyword_search("Watchmen", page="1")
+            second = keyword_search("  watchmen ", page=1)
+            keyword_search("watchmen", page=2)
+
+            self.assertEqual(mock_search.call_count, 2)
+            mock_search.assert_any_call("q=watchmen", open_library.DEFAULT_SEARCH_FIELDS, 100, "1")
+            self.assertEqual(first, second)
+            self.assertEqual(first["works"][0]["title"], "Watchmen")
+            self.assertEqual(open_library.search_cache.stats()["hit_ratio"], 1 / 3)
+
+    def test_keyword_search_collapsed(self):
+        """Concurrent identical misses make one upstream call"""
+
+        def slow_search(*args):
+            time.sleep(0.2)
+            return self.search_data
+
+        with patch("open_library.do_search", side_effect=slow_search) as mock_search:
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(keyword_search("watchmen")))
+                       for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            mock_search.assert_called_once()
+            self.assertEqual(len(results), 4)
+            # everyone gets their own copy
+            results[0]["works"].clear()
+            self.assertEqual(len(results[1]["works"]), 1)
+
     def test_fetch_book_data(self):
         """test fetch book from olid w/ mock data"""
 
@@ -154,3 +225,293 @@ class OpenLibraryAPITestCase(TestCase):
             
             self.assertEqual(new_book["title"], "A Court of Mist and Fury")
             self.assertEqual(new_book["authors"], ["Sarah J. Maas"])
+
+    def fake_work_fetch(self, olid, data_type):
+        """Slow fake fetch_data for a work with three authors"""
+
+        if data_type == "works":
+            return {"title": "Good Omens", "authors": [
+                {"author": {"key": "/authors/OL1A"}},
+                {"author": {"key": "/authors/OL2A"}},
+                {"author": {"key": "/authors/OL3A"}},
+            ]}
+
+        delay = {"OL1A": 0.3, "OL2A": 0.1, "OL3A": 0.2}[olid]
+        time.sleep(delay)
+        return {"name": f"Author {olid}"}
+
+    def test_fetch_book_data_concurrent_authors(self):
+        """Authors are fetched concurrently and keep their order"""
+
+        with patch("open_library.fetch_data", side_effect=self.fake_work_fetch):
+            start = time.monotonic()
+            new_book = fetch_book_data("OL450063W")
+            elapsed = time.monotonic() - start
+
+        self.assertEqual(new_book["authors"], ["Author OL1A", "Author OL2A", "Author OL3A"])
+        self.assertLess(elapsed, 0.55)
+
+    def test_fetch_book_data_deadline(self):
+        """Authors that miss the deadline are left out and the result isn't cached"""
+
+        with patch("open_library.fetch_data", side_effect=self.fake_work_fetch), \
+                patch("open_library.BOOK_DATA_DEADLINE", 0.25):
+            new_book = fetch_book_data("OL450063W")
+
+        self.assertEqual(new_book["authors"], ["Author OL2A", "Author OL3A"])
+        self.assertIsNone(open_library.ol_cache.get("book_data:OL450063W"))
+
+    def test_fetch_data_cached(self):
+        """fetch_data only goes upstream on a cache miss"""
+
+        with patch("open_library.http_get") as mock_get:
+            mock_get.return_value.ok = True
+            mock_get.return_value.json.return_value = self.mock_data
+
+            first = fetch_data("OL26992991M", "books")
+            second = fetch_data("OL26992991M", "books")
+            mock_get.assert_called_once()
+
+            self.assertEqual(first, second)
+            self.assertEqual(open_library.ol_cache.stats()["local_hits"], 1)
+
+    def test_fetch_data_collapsed(self):
+        """Concurrent fetches of the same url make one request"""
+
+        def slow_get(request_url):
+            time.sleep(0.2)
+            return MagicMock(ok=True, json=MagicMock(return_value={"title": "Ulysses"}))
+
+        with patch("open_library.http_get", side_effect=slow_get) as mock_get:
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(fetch_data("OL86318W", "works")))
+                       for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            mock_get.assert_called_once()
+            self.assertEqual(results, [{"title": "Ulysses"}] * 4)
+            self.assertIsNot(results[0], results[1])
+
+    def test_fetch_books_bulk(self):
+        """Many olids are fetched in chunks and fanned back out"""
+
+        def fake_get(request_url):
+            bibkeys = request_url.split("bibkeys=")[1].split("&")[0].split(",")
+            response = MagicMock(ok=True)
+            response.json.return_value = {key: {"title": key} for key in bibkeys if key != "OLID:OL4M"}
+            return response
+
+        with patch("open_library.http_get", side_effect=fake_get) as mock_get:
+            olids = ["OL1M", "OL2M", "OL3M", "OL4M", "OL5M", "OL1M"]
+            results = fetch_books_bulk(olids, chunk_size=2)
+
+            self.assertEqual(mock_get.call_count, 3)
+            self.assertEqual(sorted(results), ["OL1M", "OL2M", "OL3M", "OL5M"])
+            self.assertEqual(results["OL3M"], {"title": "OLID:OL3M"})
+
+            # now served from the cache, single fetches included
+            self.assertEqual(fetch_data("OL2M", "books"), {"OLID:OL2M": {"title": "OLID:OL2M"}})
+            fetch_books_bulk(["OL1M", "OL2M"])
+            self.assertEqual(mock_get.call_count, 3)
+
+    def test_fetch_many_book_data(self):
+        """Editions and ISBNs are batched, works fetched one by one"""
+
+        def fake_get(request_url):
+            response = MagicMock(ok=True)
+            if "bibkeys=" in request_url:
+                bibkeys = request_url.split("bibkeys=")[1].split("&")[0].split(",")
+                response.json.return_value = {
+                    key: {"key": "/books/OL9M", "title": key, "authors": [{"name": "Author"}]}
+                    for key in bibkeys if key != "OLID:OL2M"}
+            else:
+                response.json.return_value = {"title": "Work", "authors": []}
+            return response
+
+        with patch("open_library.http_get", side_effect=fake_get):
+            by_olid, by_isbn = fetch_many_book_data(["OL1M", "OL2M", "OL3W"], ["9781401248192"])
+
+        self.assertEqual(sorted(by_olid), ["OL1M", "OL3W"])
+        self.assertEqual(by_olid["OL1M"]["authors"], ["Author"])
+        self.assertEqual(by_olid["OL3W"]["title"], "Work")
+        self.assertEqual(by_isbn["9781401248192"]["olid"], "OL9M")
+
+    def test_fetch_many_book_data_works(self):
+        """More works than lookup threads don't wait on each other's author lookups"""
+
+        def fake_get(request_url):
+            time.sleep(0.01)
+            response = MagicMock(ok=True)
+            if "/authors/" in request_url:
+                response.json.return_value = {"name": "Author"}
+            else:
+                response.json.return_value = {"title": "Work", "authors": [{"author": {"key": "/authors/OL1A"}}]}
+            return response
+
+        olids = [f"OL{num}W" for num in range(open_library.FETCH_WORKERS + 2)]
+        with patch("open_library.http_get", side_effect=fake_get):
+            start = time.monotonic()
+            by_olid, _ = fetch_many_book_data(olids, timeout=5)
+
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(sorted(by_olid), sorted(olids))
+        self.assertEqual(by_olid["OL0W"]["authors"], ["Author"])
+
+    def test_rate_limited(self):
+        """Every upstream request takes a token, cache hits don't"""
+
+        with patch("open_library.http_get") as mock_get, patch("open_library.ol_rate_limit.acquire") as mock_acquire:
+            mock_get.return_value.ok = True
+            mock_get.return_value.json.return_value = {"title": "Ulysses"}
+
+            fetch_data("OL1W", "works")
+            fetch_data("OL1W", "works")
+            fetch_data("OL2W", "works")
+            self.assertEqual(mock_acquire.call_count, 2)
+
+            # a job's own bucket is waited on as well
+            job_limit = MagicMock()
+            with limited(job_limit):
+                fetch_data("OL3W", "works")
+            self.assertEqual(mock_acquire.call_count, 3)
+            job_limit.acquire.assert_called_once()
+
+    def stream_response(self, data, chunk_size=7, read=None):
+        """Fake streamed response handing out the JSON body chunk_size bytes at a time"""
+
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+        def iter_content(chunk_size=None, size=chunk_size):
+            for start in range(0, len(body), size):
+                if read is not None:
+                    read.append(start)
+                yield body[start:start + size]
+
+        response = MagicMock(ok=True)
+        response.__enter__.return_value = response
+        response.iter_content.side_effect = iter_content
+        return response
+
+    def test_search_profiles(self):
+        """Profiles ask only for fields parse_search_data reads and return only their keys"""
+
+        parsed = parse_search_data(self.search_data["docs"][0])
+        for name, profile in SEARCH_PROFILES.items():
+            fields = profile.fields.split(",")
+            self.assertIn("key", fields)
+            doc = {field: value for field, value in self.search_data["docs"][0].items() if field in fields}
+
+            works = project_works([parse_search_data(doc)], profile.keys)
+            # the lending edition when the profile asks for it, otherwise the work
+            self.assertIn(works[0]["olid"], (parsed["olid"], parsed["workid"]))
+            self.assertEqual(works[0]["title"], parsed["title"])
+            if profile.keys is not None:
+                self.assertEqual(tuple(works[0]), profile.keys)
+
+        self.assertNotIn("availability", SEARCH_PROFILES["compact"].fields.split(","))
+
+    def test_default_profile_isbn(self):
+        """Results of the default profile, which list-add searches use, still carry the isbn"""
+
+        profile = SEARCH_PROFILES["compact"]
+        doc = {field: value for field, value in self.search_data["docs"][0].items() if field in profile.fields.split(",")}
+        works = project_works([parse_search_data(doc)], profile.keys)
+
+        self.assertEqual(works[0]["isbn"], self.search_data["docs"][0]["isbn"][0])
+
+    def test_search_stream_decoder(self):
+        """Docs are decoded one at a time from any split of the body"""
+
+        data = dict(self.search_data, q="café 😀", numFoundExact=True, offset=None)
+        for chunk_size in (1, 7, 64, 100000):
+            events = [event for events in iter_search_events(self.stream_response(data, chunk_size)) for event in events]
+
+            self.assertIn(("numFound", 327), events)
+            self.assertIn(("q", "café 😀"), events)
+            self.assertIn(("offset", None), events)
+            self.assertEqual([value for name, value in events if name == "doc"], data["docs"])
+
+    def test_search_stream_decoder_truncated(self):
+        """A body that stops early is an error, not a short result"""
+
+        decoder = SearchStreamDecoder()
+        events = decoder.feed('{"numFound": 12, "docs": [{"key": "/works/OL1W"}, {"key": "/wo')
+        self.assertEqual(events, [("numFound", 12), ("doc", {"key": "/works/OL1W"})])
+        with self.assertRaises(ValueError):
+            decoder.close()
+
+    def test_stream_search(self):
+        """The small first request streams, the rest of the page follows and all of it is cached"""
+
+        read = []
+        docs = [dict(self.search_data["docs"][0], key=f"/works/OL{num}W") for num in range(5)]
+        first = dict(self.search_data, docs=docs[:1])
+        rest = dict(self.search_data, docs=docs[1:])
+
+        def fake_get(request_url, stream=False, **kwargs):
+            if stream:
+                self.assertIn("limit=1&offset=0", request_url)
+                return self.stream_response(first, read=read)
+            self.assertIn("limit=4&offset=1", request_url)
+            response = MagicMock(ok=True)
+            response.json.return_value = rest
+            return response
+
+        with patch("open_library.http_get", side_effect=fake_get) as mock_get:
+            events = stream_search("Watchmen", limit=5, first_limit=1)
+            self.assertEqual(next(events), ("total", 327))
+            name, works = next(events)
+            self.assertEqual((name, works[0]["title"]), ("works", "Watchmen"))
+            # handed out before the body was read to the end
+            self.assertLess(read[-1], len(json.dumps(first).encode("utf-8")) - 7)
+
+            remaining = list(events)
+            self.assertEqual(sum(len(works) for name, works in remaining if name == "works"), 4)
+
+            results = keyword_search("watchmen", limit=5)
+            self.assertEqual(mock_get.call_count, 2)
+            self.assertEqual([work["workid"] for work in results["works"]], [f"OL{num}W" for num in range(5)])
+
+    def test_stream_search_error(self):
+        """An error response is reported, not streamed as no results, and not cached"""
+
+        def fake_get(request_url, stream=False, **kwargs):
+            response = MagicMock(ok=False, status_code=503)
+            response.__enter__.return_value = response
+            return response
+
+        with patch("open_library.http_get", side_effect=fake_get), patch("open_library.circuit_breakers", CircuitBreakers()):
+            self.assertEqual(list(stream_search("outage", limit=1, first_limit=1)), [("error", 503)])
+            self.assertIsNone(open_library.search_cache.get(open_library.search_cache_key("outage", open_library.DEFAULT_SEARCH_FIELDS, 1, 1)))
+
+    def test_fetch_book_data_upstream_error(self):
+        """A 503 with a JSON body is an error, not a book Open Library doesn't know"""
+
+        with patch("open_library.http_get") as mock_get, patch("open_library.circuit_breakers", CircuitBreakers()), \
+                patch("open_library.MAX_RETRIES", 0):
+            mock_get.return_value.ok = False
+            mock_get.return_value.status_code = 503
+            mock_get.return_value.json.return_value = {"error": "Service Unavailable"}
+
+            for olid in ("OL1W", "OL1M"):
+                with self.assertRaises(open_library.UpstreamError):
+                    fetch_book_data(olid)
+
+            # a 404 is an answer
+            mock_get.return_value.status_code = 404
+            mock_get.return_value.json.return_value = {"error": "notfound"}
+            self.assertEqual(fetch_book_data("OL1W"), {})
+
+    def test_fetch_data_error_not_cached(self):
+        """Failed responses are not cached"""
+
+        with patch("open_library.http_get") as mock_get:
+            mock_get.return_value.ok = False
+            mock_get.return_value.json.return_value = {"error": "notfound"}
+
+            fetch_data("OL1W", "works")
+            fetch_data("OL1W", "works")
+            self.assertEqual(mock_get.call_count, 2)
@@ -0,0 +1,137 @@
+"""Async OpenLibrary API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_api_open_library_async.py
+
+
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+import open_library
+import open_library_async
+from resilience import CircuitBreakers, CircuitOpenError
+
+
+class FakeOpenLibrary(BaseHTTPRequestHandler):
+    """Serves canned JSON, /slow takes a while to answer and /down fails"""
+
+    def do_GET(self):
+        if self.path.startswith("/slow"):
+            time.sleep(0.5)
+
+        status = 503 if self.path.startswith("/down") else 200
+        body = json.dumps({"path": self.path}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except BrokenPipeError:
+            # the client gave up (timeout test)
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AsyncOpenLibraryAPITestCase(IsolatedAsyncioTestCase):
+    """Test the async open library client"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOpenLibrary)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        open_library_async.close()
+
+    def setUp(self):
+        open_library.ol_cache.clear()
+        open_library.search_cache.clear()
+        open_library.stale_cache.clear()
+
+    async def test_fetch_json(self):
+        """Calls run on the client threads"""
+
+        data, ok, stale = await open_library_async.fetch_json(f"{self.base_url}/works/OL1W.json")
+
+        self.assertTrue(ok)
+        self.assertFalse(stale)
+        self.assertEqual(data, {"path": "/works/OL1W.json"})
+
+    async def test_fetch_json_concurrent(self):
+        """Many calls stay in flight at once"""
+
+        start = time.monotonic()
+        results = await asyncio.gather(*[
+            open_library_async.fetch_json(f"{self.base_url}/slow/{num}") for num in range(5)
+        ])
+
+        self.assertEqual(len(results), 5)
+        self.assertLess(time.monotonic() - start, 2)
+
+    async def test_fetch_json_timeout(self):
+        """Each call has its own timeout"""
+
+        with self.assertRaises(TimeoutError):
+            await open_library_async.fetch_json(f"{self.base_url}/slow/timeout", timeout=0.1)
+
+    async def test_guarded(self):
+        """Calls take a rate limit token and go through the circuit breakers"""
+
+        with patch("open_library.ol_rate_limit.acquire") as mock_acquire, \
+                patch("open_library.circuit_breakers", CircuitBreakers(failure_threshold=1, reset_timeout=60)), \
+                patch("open_library.MAX_RETRIES", 0):
+            await open_library_async.fetch_json(f"{self.base_url}/works/OL2W.json")
+            self.assertEqual(mock_acquire.call_count, 1)
+
+            with self.assertRaises(open_library.UpstreamError):
+                await open_library_async.fetch_json(f"{self.base_url}/down/1")
+            with self.assertRaises(CircuitOpenError):
+                await open_library_async.fetch_json(f"{self.base_url}/down/2")
+            self.assertEqual(mock_acquire.call_count, 2)
+
+    async def test_fetch_book_data(self):
+        """Authors are resolved concurrently and kept in order"""
+
+        async def fake_fetch_json(request_url, timeout=None):
+            if request_url.endswith("/works/OL450063W.json"):
+                return {"title": "Good Omens", "authors": [
+                    {"author": {"key": "/authors/OL1A"}},
+                    {"author": {"key": "/authors/OL2A"}},
+                ]}, True, False
+
+            await asyncio.sleep(0.2)
+            return {"name": request_url.split("/")[-1].replace(".json", "")}, True, False
+
+        with patch("open_library_async.fetch_json", side_effect=fake_fetch_json):
+            start = time.monotonic()
+            book_data = await open_library_async.fetch_book_data("OL450063W")
+
+        self.assertEqual(book_data["authors"], ["OL1A", "OL2A"])
+        self.assertLess(time.monotonic() - start, 0.35)
+        self.assertIsNone(book_data["cover_url"])
+        self.assertIsNotNone(open_library.ol_cache.get("book_data:OL450063W"))
+
+    async def test_keyword_search(self):
+        """Searches share the sync client's cache"""
+
+        search_data = {"numFound": 1, "docs": [{"key": "/works/OL1W", "title": "Watchmen"}]}
+        with patch("open_library.get_json", return_value=(search_data, True, False)) as mock_get:
+            results = await open_library_async.keyword_search("watchmen")
+            self.assertEqual(results["total"], 1)
+            self.assertEqual(results["works"][0]["olid"], "OL1W")
+
+            self.assertEqual(open_library.keyword_search("Watchmen"), results)
+            mock_get.assert_called_once()
@@ -0,0 +1,192 @@
+"""Cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_cache.py
+
+
+import threading
+import time
+from unittest import TestCase
+
+from cache import LRUCache, MemoryBackend, SQLiteBackend, SingleFlight, TieredCache, backend_from_url
+
+
+class LRUCacheTestCase(TestCase):
+    """Test the in-process LRU tier"""
+
+    def test_entry_limit(self):
+        """Oldest entries are evicted first"""
+
+        lru = LRUCache(max_entries=2)
+        lru.set("a", "1", 60)
+        lru.set("b", "2", 60)
+        lru.get("a")
+        lru.set("c", "3", 60)
+
+        self.assertEqual(lru.get("a"), "1")
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual(lru.get("c"), "3")
+
+    def test_byte_limit(self):
+        """Total stored bytes stay under max_bytes"""
+
+        lru = LRUCache(max_bytes=10)
+        lru.set("a", "12345", 60)
+        lru.set("b", "12345", 60)
+        lru.set("c", "12345", 60)
+
+        self.assertIsNone(lru.get("a"))
+        self.assertEqual(lru.num_bytes, 10)
+
+        # too big to ever fit
+        lru.set("d", "x" * 11, 60)
+        self.assertIsNone(lru.get("d"))
+
+    def test_ttl(self):
+        """Expired entries are not returned"""
+
+        lru = LRUCache()
+        lru.set("a", "1", -1)
+        self.assertIsNone(lru.get("a"))
+        self.assertEqual(lru.num_bytes, 0)
+
+
+class TieredCacheTestCase(TestCase):
+    """Test the two tiers together"""
+
+    def check_backend(self, backend):
+        """Values written by one worker are visible to another"""
+
+        worker1 = TieredCache(LRUCache(), backend)
+        worker2 = TieredCache(LRUCache(), backend)
+
+        worker1.set("works:OL1W", {"title": "Watchmen"}, 60)
+        self.assertEqual(worker2.get("works:OL1W"), {"title": "Watchmen"})
+        self.assertEqual(worker2.get("works:OL1W"), {"title": "Watchmen"})
+        self.assertIsNone(worker2.get("works:OL2W"))
+
+        stats = worker2.stats()
+        self.assertEqual(stats["backend_hits"], 1)
+        self.assertEqual(stats["local_hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+
+        worker1.delete("works:OL1W")
+        self.assertIsNone(backend.get("works:OL1W"))
+
+    def test_memory_backend(self):
+        """Shared memory backend"""
+
+        self.check_backend(MemoryBackend())
+
+    def test_sqlite_backend(self):
+        """Shared SQLite backend"""
+
+        self.check_backend(SQLiteBackend())
+
+    def test_returns_copies(self):
+        """Changing a returned value doesn't change the cache"""
+
+        cache = TieredCache()
+        cache.set("key", {"authors": [{"key": "/authors/OL1A"}]}, 60)
+        cache.get("key")["authors"] = ["Someone"]
+
+        self.assertEqual(cache.get("key"), {"authors": [{"key": "/authors/OL1A"}]})
+
+    def test_sqlite_expiry(self):
+        """Expired rows are not returned and can be purged"""
+
+        backend = SQLiteBackend()
+        backend.set("old", "1", -1)
+        backend.set("new", "2", 60)
+
+        self.assertEqual(backend.purge_expired(), 1)
+        self.assertIsNone(backend.get("old"))
+        self.assertEqual(backend.get("new"), "2")
+
+    def test_backend_from_url(self):
+        """Backends are picked by url scheme"""
+
+        self.assertIsNone(backend_from_url(None))
+        self.assertIsInstance(backend_from_url("memory://"), MemoryBackend)
+        self.assertIsInstance(backend_from_url("sqlite:///:memory:"), SQLiteBackend)
+        with self.assertRaises(ValueError):
+            backend_from_url("ftp://nope")
+
+
+class SingleFlightTestCase(TestCase):
+    """Test collapsing concurrent calls"""
+
+    def test_collapse(self):
+        """Concurrent callers for one key share a single call"""
+
+        flight = SingleFlight()
+        calls = []
+        release = threading.Event()
+
+        def slow_call(value):
+            calls.append(value)
+            release.wait(1)
+            return value * 2
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do("key", slow_call, 21)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        while flight.collapsed < 4:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(calls, [21])
+        self.assertEqual(results, [42] * 5)
+
+    def test_errors_shared(self):
+        """The leader's exception is raised and the key is freed"""
+
+        flight = SingleFlight()
+
+        def failing_call():
+            raise ConnectionError("down")
+
+        with self.assertRaises(ConnectionError):
+            flight.do("key", failing_call)
+        self.assertEqual(flight.do("key", lambda: "ok"), "ok")
+
+    def test_backend_add(self):
+        """add only sets missing or expired keys"""
+
+        for backend in (MemoryBackend(), SQLiteBackend()):
+            self.assertTrue(backend.add("lock", "1", 60))
+            self.assertFalse(backend.add("lock", "2", 60))
+            self.assertEqual(backend.get("lock"), "1")
+
+            backend.set("expired", "1", -1)
+            self.assertTrue(backend.add("expired", "2", 60))
+
+    def test_collapse_across_workers(self):
+        """Two workers sharing a backend make one call"""
+
+        backend = MemoryBackend()
+        worker1 = SingleFlight(backend=backend)
+        worker2 = SingleFlight(backend=backend)
+        calls = []
+
+        def slow_call():
+            calls.append(1)
+            time.sleep(0.2)
+            return {"numFound": 1}
+
+        results = []
+        threads = [threading.Thread(target=lambda flight=flight: results.append(flight.do("url", slow_call)))
+                   for flight in (worker1, worker2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"numFound": 1}] * 2)
+        self.assertIsNone(backend.get("flight-lock:url"))
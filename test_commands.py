@@ -0,0 +1,43 @@
+"""CLI command tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_commands.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Book
+
+os.environ['DATABASE_URL'] = "postgresql:///olreader-test"
+os.environ['JOBS_URL'] = "sqlite://"
+
+from app import app
+
+
+class CommandsTestCase(TestCase):
+    """flask db-init and flask seed"""
+
+    def setUp(self):
+        self.runner = app.test_cli_runner()
+
+    def test_seed_reset(self):
+        """seed --reset rebuilds the tables and loads the sample data"""
+
+        result = self.runner.invoke(args=["seed", "--reset"])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        with app.app_context():
+            self.assertEqual(User.query.count(), 2)
+            self.assertIsNotNone(db.session.get(Book, "OL86318W"))
+
+    def test_db_init_keeps_data(self):
+        """db-init without --drop leaves existing rows alone"""
+
+        self.runner.invoke(args=["seed", "--reset"])
+        result = self.runner.invoke(args=["db-init"])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        with app.app_context():
+            self.assertEqual(User.query.count(), 2)
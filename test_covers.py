@@ -0,0 +1,102 @@
+"""Cover proxy tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_covers.py
+
+
+import io
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+import requests
+
+from PIL import Image
+
+from covers import CoverCache, proxy_cover_url, upstream_cover_url
+
+
+def jpeg_response():
+    """Fake covers.openlibrary.org response with a small JPEG"""
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 6), "blue").save(buffer, format="JPEG")
+    return MagicMock(status_code=200, content=buffer.getvalue())
+
+
+class CoverCacheTestCase(TestCase):
+    """Test the cover disk cache"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cover_cache = CoverCache(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_proxy_cover_url(self):
+        """Open Library cover urls map onto /covers/"""
+
+        self.assertEqual(proxy_cover_url("https://covers.openlibrary.org/b/id/6459694", "S"),
+                         "/covers/id/6459694-S.jpg")
+        self.assertEqual(proxy_cover_url("https://covers.openlibrary.org/w/olid/OL86318W", "M"),
+                         "/covers/olid/OL86318W-M.jpg")
+        self.assertEqual(proxy_cover_url("https://example.com/cover", "L"),
+                         "https://example.com/cover-L.jpg")
+
+    def test_upstream_cover_url(self):
+        """Works covers use /w/, everything else /b/"""
+
+        self.assertEqual(upstream_cover_url("olid", "OL86318W", "M"),
+                         "https://covers.openlibrary.org/w/olid/OL86318W-M.jpg?default=false")
+        self.assertEqual(upstream_cover_url("id", "6459694", "S"),
+                         "https://covers.openlibrary.org/b/id/6459694-S.jpg?default=false")
+
+    def test_fetch_once(self):
+        """Each cover is fetched once and stored by content hash"""
+
+        with patch("covers.resilient_get", return_value=jpeg_response()) as mock_get:
+            path, digest = self.cover_cache.get("id", "6459694", "S")
+            self.assertEqual(self.cover_cache.get("id", "6459694", "S"), (path, digest))
+            mock_get.assert_called_once()
+
+            # same bytes under another key share the blob
+            other_path, other_digest = self.cover_cache.get("olid", "OL15479330M", "S")
+            self.assertEqual(other_path, path)
+
+    def test_webp_variant(self):
+        """WebP variants are made from the cached JPEG"""
+
+        with patch("covers.resilient_get", return_value=jpeg_response()) as mock_get:
+            jpeg_path, jpeg_digest = self.cover_cache.get("id", "6459694", "M")
+            webp_path, webp_digest = self.cover_cache.get("id", "6459694", "M", "webp")
+            mock_get.assert_called_once()
+
+        self.assertNotEqual(jpeg_digest, webp_digest)
+        with Image.open(webp_path) as image:
+            self.assertEqual(image.format, "WEBP")
+
+    def test_missing(self):
+        """Missing covers are remembered"""
+
+        with patch("covers.resilient_get", return_value=MagicMock(status_code=404)) as mock_get:
+            self.assertIsNone(self.cover_cache.get("isbn", "0000000000", "L"))
+            self.assertIsNone(self.cover_cache.get("isbn", "0000000000", "L", "webp"))
+            mock_get.assert_called_once()
+
+    def test_upstream_error(self):
+        """Upstream errors reach the caller and aren't remembered as missing"""
+
+        with patch("covers.resilient_get", side_effect=requests.ConnectionError("down")):
+            with self.assertRaises(requests.ConnectionError):
+                self.cover_cache.get("id", "6459694", "S")
+
+        with patch("covers.resilient_get", return_value=MagicMock(status_code=503, raise_for_status=MagicMock(side_effect=requests.HTTPError("503")))):
+            with self.assertRaises(requests.HTTPError):
+                self.cover_cache.get("id", "6459694", "S")
+
+        with patch("covers.resilient_get", return_value=jpeg_response()) as mock_get:
+            self.assertIsNotNone(self.cover_cache.get("id", "6459694", "S"))
+            mock_get.assert_called_once()
@@ -0,0 +1,134 @@
+"""Connection pool settings and stats tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_db_pool.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from models import db, User
+from db_pool import TimedQueuePool, engine_options, pool_settings, statement_timeout
+
+os.environ['DATABASE_URL'] = "postgresql:///olreader-test"
+os.environ['JOBS_URL'] = "sqlite://"
+
+from app import app
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PoolSettingsTestCase(TestCase):
+    """Presets and environment overrides"""
+
+    def test_defaults(self):
+        """development preset when nothing is set"""
+
+        settings = pool_settings({})
+        self.assertEqual(settings["pool_size"], 5)
+        self.assertTrue(settings["pool_pre_ping"])
+
+    def test_overrides(self):
+        """DB_* variables win over the preset"""
+
+        settings = pool_settings({
+            "DB_POOL_PRESET": "production",
+            "DB_POOL_SIZE": "20",
+            "DB_POOL_PRE_PING": "false",
+            "DB_STATEMENT_TIMEOUT": "2500",
+        })
+        self.assertEqual(settings["pool_size"], 20)
+        self.assertEqual(settings["max_overflow"], 5)
+        self.assertFalse(settings["pool_pre_ping"])
+
+        options = engine_options(settings)
+        self.assertIs(options["poolclass"], TimedQueuePool)
+        self.assertEqual(options["connect_args"], {"options": "-c statement_timeout=2500"})
+        self.assertNotIn("statement_timeout", options)
+
+    def test_unknown_preset(self):
+        with self.assertRaises(ValueError):
+            pool_settings({"DB_POOL_PRESET": "huge"})
+
+
+class StatementTimeoutTestCase(TestCase):
+    """Decorated views run with their own statement_timeout"""
+
+    def test_statement_timeout(self):
+        @statement_timeout(1234)
+        def view():
+            return db.session.execute(db.text("SHOW statement_timeout")).scalar()
+
+        with app.test_request_context():
+            self.assertEqual(view(), "1234ms")
+            db.session.rollback()
+
+            # started before the view ran
+            db.session.execute(db.text("SELECT 1"))
+            self.assertEqual(view(), "1234ms")
+            db.session.rollback()
+
+
+class TimedQueuePoolTestCase(TestCase):
+    """Checkout waits and timeouts are counted"""
+
+    def test_stats(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine = create_engine(f"sqlite:///{tmp_dir}/pool.db", poolclass=TimedQueuePool,
+                                   pool_size=1, max_overflow=0, pool_timeout=0.1)
+
+            conn = engine.connect()
+            self.assertEqual(engine.pool.stats()["checked_out"], 1)
+            with self.assertRaises(PoolTimeoutError):
+                engine.connect()
+            conn.close()
+
+            stats = engine.pool.stats()
+            engine.dispose()
+
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertGreaterEqual(stats["wait_max_ms"], 100)
+
+
+class PoolEndpointTestCase(TestCase):
+    """/internal/db-pool is for admins"""
+
+    def setUp(self):
+        with app.app_context():
+            User.query.filter(User.username.in_(["pooladmin", "pooluser"])).delete()
+            admin = User.signup("pooladmin", "pooladmin@email.com", "welcome1")
+            admin.is_admin = True
+            User.signup("pooluser", "pooluser@email.com", "welcome1")
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        with app.app_context():
+            User.query.filter(User.username.in_(["pooladmin", "pooluser"])).delete()
+            db.session.commit()
+
+    def test_admin(self):
+        self.client.post('/login', data={'username': 'pooladmin', 'password': 'welcome1'})
+        response = self.client.get('/internal/db-pool')
+
+        self.assertEqual(response.status_code, 200)
+        stats = response.get_json()["default"]
+        self.assertGreaterEqual(stats["checked_out"], 1)
+        self.assertIn("wait_avg_ms", stats)
+
+    def test_not_admin(self):
+        response = self.client.get('/internal/db-pool')
+        self.assertEqual(response.status_code, 404)
+
+        self.client.post('/login', data={'username': 'pooluser', 'password': 'welcome1'})
+        response = self.client.get('/internal/db-pool')
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,170 @@
+"""Query plan tests, hot pages must use indexes on a large dataset."""
+
+# run these tests like:
+#
+#    python -m unittest test_explain.py
+
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import event
+
+from models import db, User, BookList, BookNote
+from seed import init_db, seed_data
+
+os.environ['DATABASE_URL'] = "postgresql:///olreader-test"
+os.environ['JOBS_URL'] = "sqlite://"
+
+from app import app
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+NUM_USERS = 2000
+NUM_BOOKS = 50000
+LISTS_PER_USER = 5
+BOOKS_PER_LIST = 10
+NOTES_PER_USER = 10
+
+HOT_TABLES = {"users", "books", "booknotes", "booklists", "booklist_books"}
+
+
+def seq_scans(plan):
+    """Tables the plan reads with a sequential scan"""
+
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in HOT_TABLES:
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+class StatementRecorder:
+    """Keep the SELECT statements run inside a with block"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self.record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self.record)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            self.statements.append((statement, parameters))
+
+
+class ExplainTestCase(TestCase):
+    """Hot lookups must not fall back to sequential scans"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Fill the tables with generated rows and analyze them"""
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            user = User.signup("explain", "explain@email.com", "welcome1")
+            db.session.commit()
+            cls.user_id = user.id
+
+            db.session.execute(db.text(
+                "INSERT INTO users (email, username, password, version) "
+                "SELECT 'user' || n || '@email.com', 'user' || n, 'x', 1 "
+                "FROM generate_series(1, :num) AS n"), {"num": NUM_USERS})
+            db.session.execute(db.text(
+                "INSERT INTO books (olid, title, author) "
+                "SELECT 'OL' || n || 'W', 'Book ' || n, 'Author ' || (n % 997) "
+                "FROM generate_series(1, :num) AS n"), {"num": NUM_BOOKS})
+            db.session.execute(db.text(
+                "INSERT INTO booklists (user_id, title) "
+                "SELECT u.id, 'List ' || n FROM users u, generate_series(1, :num) AS n"),
+                {"num": LISTS_PER_USER})
+            db.session.execute(db.text(
+                "INSERT INTO booklist_books (booklist, book_olid) "
+                "SELECT l.id, 'OL' || (1 + (l.id * 7919 + n) % :books) || 'W' "
+                "FROM booklists l, generate_series(1, :num) AS n"),
+                {"num": BOOKS_PER_LIST, "books": NUM_BOOKS})
+            db.session.execute(db.text(
+                "INSERT INTO booknotes (user_id, book_olid, read, note) "
+                "SELECT u.id, 'OL' || (1 + (u.id * 104729 + n) % :books) || 'W', n % 2 = 0, 'note' "
+                "FROM users u, generate_series(1, :num) AS n"),
+                {"num": NOTES_PER_USER, "books": NUM_BOOKS})
+            db.session.commit()
+
+            for table in sorted(HOT_TABLES):
+                db.session.execute(db.text(f"ANALYZE {table}"))
+            db.session.commit()
+
+            note = BookNote.query.filter_by(user_id=cls.user_id).first()
+            cls.book_olid = note.book_olid
+            cls.list_id = BookList.query.filter_by(user_id=cls.user_id).first().id
+
+        cls.client = app.test_client()
+        cls.client.post('/login', data={'username': 'explain', 'password': 'welcome1'})
+
+    @classmethod
+    def tearDownClass(cls):
+        """Put the sample data back for the other test modules"""
+
+        with app.app_context():
+            init_db(db, drop=True)
+            seed_data(db)
+
+    def assertNoSeqScans(self, url):
+        """GET url, then EXPLAIN every SELECT it ran"""
+
+        with app.app_context():
+            with StatementRecorder(db.engine) as recorder:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertGreater(len(recorder.statements), 0)
+
+            with db.engine.connect() as conn:
+                for statement, parameters in recorder.statements:
+                    plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()
+                    self.assertEqual(seq_scans(plan[0]["Plan"]), [], statement)
+
+    def test_book(self):
+        """Book page: note for the book, lists with the book, add to list menu"""
+
+        with patch("app.fetch_availabilty_links", return_value={}):
+            self.assertNoSeqScans(f'/books/{self.book_olid}')
+
+    def test_search_json(self):
+        """Search json: the user's list titles"""
+
+        with patch("app.keyword_search", return_value={"total": 0, "num_returned": 0, "works": []}):
+            self.assertNoSeqScans('/search/watchmen?source=remote')
+
+    def test_profile(self):
+        """Profile: the user's lists and notes"""
+
+        self.assertNoSeqScans('/profile')
+
+    def test_read_books(self):
+        """Read books: the user's read notes joined to books"""
+
+        self.assertNoSeqScans('/lists/read')
+
+    def test_booklist(self):
+        """List page: the list and its books"""
+
+        self.assertNoSeqScans(f'/lists/{self.list_id}')
+
+    def test_pages(self):
+        """Later pages of list books, notes and read books"""
+
+        for url in (f'/lists/{self.list_id}/books', '/profile/notes', '/lists/read/books'):
+            after = self.client.get(url, query_string={"limit": 2}).get_json()["next"]
+            self.assertIsNotNone(after)
+            self.assertNoSeqScans(f'{url}?limit=2&after={after}')
@@ -1,5 +1,21 @@
+import copy
+import os
 from unittest import TestCase
+from unittest.mock import patch
+
+import requests
+
+from models import db, Book
+
+# Use test database, app.py no longer creates the tables on import
+os.environ['DATABASE_URL'] = "postgresql:///olreader-test"
+os.environ['JOBS_URL'] = "sqlite://"
+
 from app import app
+from flask import json
+
+with app.app_context():
+    db.create_all()
 
 class AnonFormTest(TestCase):
     """These are mostly smoke tests to confirm the anon links are working"""
@@ -47,6 +63,119 @@ class AnonFormTest(TestCase):
             self.assertIn('<div id="trending-popular"', html)
             self.assertIn('<div id="trending-monthly"', html)
 
+    def test_trending_fetch(self):
+        """Trending feeds are served from the refresher snapshot"""
+
+        with self.client, patch("app.trending_feeds") as mock_feeds:
+            mock_feeds.get.return_value = ([{"title": "Watchmen"}], 90.5)
+            response = self.client.get('/trending/fetch?type=popular')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers["Age"], "90")
+            self.assertEqual(response.json["trending_books"], [{"title": "Watchmen"}])
+            mock_feeds.get.assert_called_once_with("popular")
+
+    def test_cover_fallback(self):
+        """Missing covers fall back to the blank cover"""
+
+        with self.client, patch("app.cover_cache") as mock_covers:
+            mock_covers.get.return_value = None
+            response = self.client.get('/covers/id/1-M.jpg')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, "image/webp")
+
+            response = self.client.get('/covers/id/1-XL.jpg')
+            self.assertEqual(response.status_code, 404)
+
+    def test_cover_upstream_error(self):
+        """Covers that can't be fetched get the blank cover, not cached by the browser"""
+
+        with self.client, patch("app.cover_cache") as mock_covers:
+            mock_covers.get.side_effect = requests.Timeout("slow")
+            response = self.client.get('/covers/id/1-M.jpg')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, "image/webp")
+            self.assertTrue(response.cache_control.no_store)
+
+    def test_search_local(self):
+        """Local search returns saved books without going upstream"""
+
+        with self.client, patch("app.keyword_search") as mock_search:
+            response = self.client.get('/search/watchmen?source=local')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("works", response.json["results"])
+            self.assertEqual(response.json["user_lists"], [])
+            mock_search.assert_not_called()
+
+    def test_search_profiles(self):
+        """Each profile asks upstream for its own fields and page size and returns its keys"""
+
+        remote = {"total": 1, "num_returned": 1, "works": [{
+            "workid": "OL1W", "olid": "OL1M", "isbn": "9781401248192", "title": "Remote", "author_name": "Author",
+            "cover_url": None, "book_url": "https://openlibrary.org/works/OL1W"}]}
+
+        # keyword_search hands out a copy each call
+        with self.client, patch("app.keyword_search", side_effect=lambda *args: copy.deepcopy(remote)) as mock_search:
+            response = self.client.get('/search/watchmen?source=remote&profile=typeahead')
+            mock_search.assert_called_once_with("watchmen", "key,title,author_name", 10, 1)
+            self.assertEqual(response.json["results"]["works"], [{"olid": "OL1M", "title": "Remote", "author_name": "Author"}])
+
+            mock_search.reset_mock()
+            response = self.client.get('/search/watchmen?source=remote')
+            self.assertEqual(mock_search.call_args.args[2], 50)
+            self.assertIn("isbn", mock_search.call_args.args[1].split(","))
+            # list-add searches use the default and save the isbn
+            self.assertEqual(set(response.json["results"]["works"][0]), {"olid", "isbn", "title", "author_name", "cover_url"})
+            self.assertEqual(response.json["results"]["works"][0]["isbn"], "9781401248192")
+
+            response = self.client.get('/search/watchmen?profile=everything')
+            self.assertEqual(response.status_code, 400)
+
+    def test_search_stream(self):
+        """Streamed search sends saved books, then each batch of remote works"""
+
+        def fake_stream(term, *args):
+            yield "total", 3
+            yield "works", [{"olid": "OL1W", "title": "Saved"}, {"olid": "OL2W", "title": "Remote"}]
+            yield "works", [{"olid": "OL3W", "title": "Later"}]
+
+        saved = [Book(olid="OL1W", title="Saved", author="Author")]
+        with self.client, patch("app.stream_search", side_effect=fake_stream), patch("app.Book.search_local", return_value=saved):
+            response = self.client.get('/search/watchmen/stream')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, "application/x-ndjson")
+
+            lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+            self.assertEqual(lines[0]["user_lists"], [])
+            self.assertEqual([work["olid"] for work in lines[0]["works"]], ["OL1W"])
+            self.assertEqual(lines[1], {"total": 3})
+            # the saved book isn't sent twice
+            self.assertEqual([work["olid"] for work in lines[2]["works"]], ["OL2W"])
+            self.assertEqual([work["olid"] for work in lines[3]["works"]], ["OL3W"])
+            self.assertEqual(lines[4], {"done": True, "num_returned": 3})
+
+    def test_search_stream_error(self):
+        """An upstream failure mid stream is reported on its own line"""
+
+        def failing_stream(term, *args):
+            yield "total", 3
+            raise ValueError("Search response ended early")
+
+        with self.client, patch("app.stream_search", side_effect=failing_stream):
+            response = self.client.get('/search/watchmen/stream?page=2')
+            lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+            self.assertEqual(lines[-2]["type"], "danger")
+            self.assertEqual(lines[-1], {"done": True, "num_returned": 0})
+
+            response = self.client.get('/search/watchmen/stream?page=x')
+            self.assertEqual(response.status_code, 400)
+
+        # openlibrary.org answered with an error, not with no results
+        with self.client, patch("app.stream_search", return_value=iter([("error", 503)])):
+            response = self.client.get('/search/watchmen/stream')
+            lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+            self.assertEqual(lines[-2], {"err": "Search failed, please try again.", "type": "danger", "status": 503})
+            self.assertEqual(lines[-1], {"done": True, "num_returned": 0})
+
     def test_search(self):
         """Test the search page"""
 
@@ -1,17 +1,20 @@
 
 import os
 from unittest import TestCase
+from unittest.mock import patch
 from sqlalchemy import exc
 from app import app
 from flask import session, json
 
 from models import db, User, Book, BookNote, BookList
 from seed import seed_data
+from covers import proxy_cover_url
 
 # Use test database and don't clutter tests with SQL
 os.environ['DATABASE_URL'] = "postgresql:///olreader-test"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
+app.config['JOBS_URL'] = "sqlite://"
 
 # Make Flask errors be real errors, rather than HTML pages with error info
 app.config['TESTING'] = True
@@ -230,6 +233,42 @@ class ListTest(LoggedInFormTest):
             self.assertEqual(len(bl.books), prev_len)
             self.assertEqual(bl.books[0].olid, book.olid)
     
+    def test_list_add_many(self):
+        """Test list add many books"""
+
+        fetched = {"OL77M": {"olid": "OL77M", "title": "Fetched", "authors": ["Author"], "cover_url": None}}
+
+        with self.client:
+            self.login_for_test()
+            bl = BookList(user_id=self.user_id, title="Bulk List")
+            db.session.add(bl)
+            db.session.commit()
+
+            with patch("models.fetch_many_book_data", return_value=(fetched, {})) as mock_fetch:
+                response = self.client.post(f'/lists/{bl.id}/add-many', json={'olids': ['12345', 'OL77M', 'OL88M', 'OL1M/../x']})
+                mock_fetch.assert_called_once_with(['OL77M', 'OL88M'], [])
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.get_data(as_text=True))
+            self.assertEqual(data['added'], 2)
+            self.assertEqual([result['status'] for result in data['results']], ['added', 'added', 'not_found', 'not_found'])
+            # check DB
+            bl = BookList.query.filter_by(id=bl.id).one()
+            self.assertEqual(sorted(book.olid for book in bl.books), ['12345', 'OL77M'])
+
+    def test_list_add_many_too_many(self):
+        """Test list add many over the limit"""
+
+        with self.client:
+            self.login_for_test()
+            bl = BookList(user_id=self.user_id, title="Bulk List")
+            db.session.add(bl)
+            db.session.commit()
+
+            with patch("app.MAX_BULK_ADD", 2):
+                response = self.client.post(f'/lists/{bl.id}/add-many', json={'olids': ['1', '2', '3']})
+            data = json.loads(response.get_data(as_text=True))
+            self.assertEqual(data['err'], "Add at most 2 books at a time")
+
     def test_list_remove(self):
         """Test remove book"""
 
@@ -290,6 +329,21 @@ class ListTest(LoggedInFormTest):
             book = Book.query.filter_by(olid=fetch_olid).one()
             self.assertIsNotNone(book)
 
+    def test_list_add_bad_olid(self):
+        """Ids that aren't book olids aren't saved"""
+
+        with self.client:
+            self.login_for_test()
+            bl = BookList.query.filter_by(user_id=self.user_id).first()
+            prev_len = len(bl.books)
+            response = self.client.post(f'/lists/{bl.id}/add', json={'workId': 'not-an-olid', 'isbn': ''})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json['err'], "Failed to find not-an-olid")
+            # check DB
+            bl = BookList.query.filter_by(id=bl.id).one()
+            self.assertEqual(len(bl.books), prev_len)
+            self.assertIsNone(Book.query.filter_by(olid='not-an-olid').one_or_none())
+
 
 
 class BookTest(LoggedInFormTest):
@@ -310,5 +364,5 @@ class BookTest(LoggedInFormTest):
             self.assertIn(book.author, html)
             self.assertIn(f'<a href="/books/{book.olid}"', html)
             self.assertIn(book.title, html)
-            self.assertIn(f'src="{book.cover_url}-M.jpg" alt="cover"', html)
+            self.assertIn(f'src="{proxy_cover_url(book.cover_url, "M")}" alt="cover"', html)
             self.assertIn(f'<a href="https://openlibrary.org/works/{book.olid}"', html)
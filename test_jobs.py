@@ -0,0 +1,146 @@
+"""Background job queue tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+
+import os
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+os.environ['DATABASE_URL'] = "postgresql:///olreader-test"
+os.environ['JOBS_URL'] = "sqlite://"
+
+from app import app
+
+import jobs
+from jobs import JobQueue, PermanentJobError, job, run_pending
+
+
+class JobQueueTestCase(TestCase):
+    """Test the SQLite job queue"""
+
+    def setUp(self):
+        self.queue = JobQueue(":memory:", max_attempts=3, backoff=10, lease=30)
+        self.calls = []
+
+    def tearDown(self):
+        for kind in ("test_ok", "test_flaky", "test_permanent"):
+            jobs.HANDLERS.pop(kind, None)
+
+    def test_enqueue_idempotent(self):
+        """A key that is queued or running isn't queued twice"""
+
+        self.assertTrue(self.queue.enqueue("test_ok", {"olid": "OL1M"}, key="ok:OL1M"))
+        self.assertFalse(self.queue.enqueue("test_ok", {"olid": "OL1M"}, key="ok:OL1M"))
+
+        claimed = self.queue.claim()
+        self.assertEqual(claimed.payload, {"olid": "OL1M"})
+        self.assertFalse(self.queue.enqueue("test_ok", {"olid": "OL1M"}, key="ok:OL1M"))
+        self.assertIsNone(self.queue.claim())
+
+        # once finished it can be queued again
+        self.queue.complete(claimed)
+        self.assertTrue(self.queue.enqueue("test_ok", {"olid": "OL1M"}, key="ok:OL1M"))
+
+    def test_run_pending(self):
+        """Handlers run with their payload and the job is marked done"""
+
+        job("test_ok")(lambda olid: self.calls.append(olid))
+        self.queue.enqueue("test_ok", {"olid": "OL1M"})
+        self.queue.enqueue("test_ok", {"olid": "OL2M"})
+
+        self.assertEqual(run_pending(app, self.queue), 2)
+        self.assertEqual(self.calls, ["OL1M", "OL2M"])
+        stats = self.queue.stats()
+        self.assertEqual(stats["done"], 2)
+        self.assertEqual(stats["queued"], 0)
+        self.assertEqual(stats["finished_in_window"], 2)
+
+    def test_retry_backoff(self):
+        """Failures are retried after a growing delay, then given up on"""
+
+        def flaky(olid):
+            self.calls.append(olid)
+            raise ConnectionError("Open Library is down")
+        job("test_flaky")(flaky)
+
+        self.queue.enqueue("test_flaky", {"olid": "OL1M"})
+        self.assertEqual(run_pending(app, self.queue), 1)
+        # not due again until the backoff passes
+        self.assertEqual(run_pending(app, self.queue), 0)
+        self.assertEqual(self.queue.stats()["retrying"], 1)
+
+        now = time.time()
+        with patch("jobs.time.time", return_value=now + 10):
+            self.assertEqual(run_pending(app, self.queue), 1)
+        with patch("jobs.time.time", return_value=now + 40):
+            self.assertEqual(run_pending(app, self.queue), 1)
+        with patch("jobs.time.time", return_value=now + 1000):
+            self.assertEqual(run_pending(app, self.queue), 0)
+
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(self.queue.stats()["failed"], 1)
+
+    def test_retry_delay(self):
+        """Backoff doubles with jitter and stops at the max"""
+
+        self.queue.max_backoff = 30
+        for attempts, low, high in [(1, 5, 10), (2, 10, 20), (3, 15, 30), (8, 15, 30)]:
+            delay = self.queue.retry_delay(attempts)
+            self.assertGreaterEqual(delay, low)
+            self.assertLessEqual(delay, high)
+
+    def test_permanent_failure(self):
+        """PermanentJobError isn't retried"""
+
+        def permanent(olid):
+            raise PermanentJobError("no such book")
+        job("test_permanent")(permanent)
+
+        self.queue.enqueue("test_permanent", {"olid": "OL1M"})
+        run_pending(app, self.queue)
+
+        stats = self.queue.stats()
+        self.assertEqual(stats["failed"], 1)
+        self.assertEqual(stats["retrying"], 0)
+
+    def test_lease_expired(self):
+        """A job whose worker died is taken over, the old worker can't finish it"""
+
+        self.queue.enqueue("test_ok", {"olid": "OL1M"})
+        first = self.queue.claim()
+        self.assertIsNone(self.queue.claim())
+
+        with patch("jobs.time.time", return_value=time.time() + 31):
+            second = self.queue.claim()
+        self.assertEqual(second.id, first.id)
+        self.assertEqual(second.attempts, 2)
+
+        self.queue.complete(first)
+        self.assertEqual(self.queue.stats()["running"], 1)
+        self.queue.complete(second)
+        self.assertEqual(self.queue.stats()["done"], 1)
+
+    def test_stats_depth(self):
+        """Depth and the age of the oldest due job"""
+
+        self.queue.enqueue("test_ok", {"olid": "OL1M"})
+        self.queue.enqueue("test_ok", {"olid": "OL2M"}, delay=60)
+
+        with patch("jobs.time.time", return_value=time.time() + 5):
+            stats = self.queue.stats()
+        self.assertEqual(stats["queued"], 2)
+        self.assertGreaterEqual(stats["oldest_due_age_ms"], 5000)
+
+    def test_purge(self):
+        """Finished jobs are dropped after a while"""
+
+        self.queue.enqueue("test_ok", {"olid": "OL1M"})
+        self.queue.complete(self.queue.claim())
+
+        self.assertEqual(self.queue.purge(older_than=60), 0)
+        self.assertEqual(self.queue.purge(older_than=0), 1)
+        self.assertEqual(self.queue.stats()["done"], 0)
@@ -0,0 +1,174 @@
+"""Migration tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_migrations.py
+
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy import event
+from flask_migrate import downgrade, upgrade
+
+from models import db, Book, User
+from seed import init_db, seed_data
+
+os.environ['DATABASE_URL'] = "postgresql:///olreader-test"
+os.environ['JOBS_URL'] = "sqlite://"
+
+from app import app
+
+import migration_helpers
+
+
+class MigrationsTestCase(TestCase):
+    """The migrations build the same schema as the models"""
+
+    def tearDown(self):
+        """Put the sample data back for the other test modules"""
+
+        with app.app_context():
+            init_db(db, drop=True)
+            seed_data(db)
+
+    def test_upgrade_matches_models(self):
+        """upgrade from nothing, nothing left for autogenerate to find"""
+
+        with app.app_context():
+            init_db(db, drop=True)
+
+            with db.engine.connect() as conn:
+                diff = compare_metadata(MigrationContext.configure(conn), db.metadata)
+            self.assertEqual(diff, [])
+
+    def test_downgrade(self):
+        """downgrade to base removes every table"""
+
+        with app.app_context():
+            init_db(db, drop=True)
+            downgrade(revision="base")
+
+            tables = set(db.inspect(db.engine).get_table_names())
+            self.assertEqual(tables, {"alembic_version"})
+            upgrade()
+
+    def test_create_all_database(self):
+        """Databases built by create_all before migrations are stamped and upgraded"""
+
+        with app.app_context():
+            init_db(db, drop=True)
+            # 0001 is the schema the old create_all built
+            downgrade(revision="0001")
+            self.assertNotIn("version", {column["name"] for column in db.inspect(db.engine).get_columns("users")})
+            db.session.execute(db.text("DROP TABLE alembic_version"))
+            db.session.execute(db.text(
+                "INSERT INTO users (email, username, password, is_admin) VALUES ('kept@email.com', 'kept', 'x', false)"))
+            db.session.commit()
+
+            init_db(db)
+
+            version = db.session.execute(db.text("SELECT version_num FROM alembic_version")).scalar()
+            self.assertEqual(version, "0006")
+            self.assertEqual(User.query.filter_by(username="kept").one().version, 1)
+            indexes = {index["name"] for index in db.inspect(db.engine).get_indexes("books")}
+            self.assertLessEqual({"ix_books_search", "ix_books_search_trgm"}, indexes)
+            self.assertEqual(Book.search_local("anything"), [])
+
+            with db.engine.connect() as conn:
+                diff = compare_metadata(MigrationContext.configure(conn), db.metadata)
+            self.assertEqual(diff, [])
+
+    def test_statement_timeout(self):
+        """Migrations run under their own statement_timeout, the pool gets its own back"""
+
+        seen = []
+
+        def show_timeout(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith("CREATE INDEX"):
+                seen.append(conn.exec_driver_sql("SHOW statement_timeout").scalar())
+
+        with app.app_context(), patch.dict(os.environ, {"MIGRATION_STATEMENT_TIMEOUT": "1h"}):
+            with db.engine.connect() as conn:
+                before = conn.exec_driver_sql("SHOW statement_timeout").scalar()
+
+            db.drop_all()
+            db.session.execute(db.text("DROP TABLE IF EXISTS alembic_version"))
+            db.session.commit()
+            event.listen(db.engine, "after_cursor_execute", show_timeout)
+            try:
+                upgrade()
+            finally:
+                event.remove(db.engine, "after_cursor_execute", show_timeout)
+
+            self.assertTrue(seen)
+            self.assertEqual(set(seen), {"1h"})
+            for _ in range(db.engine.pool.size() + 1):
+                with db.engine.connect() as conn:
+                    self.assertEqual(conn.exec_driver_sql("SHOW statement_timeout").scalar(), before)
+
+
+class HelpersTestCase(TestCase):
+    """Online-safe helpers on a scratch table"""
+
+    def setUp(self):
+        with app.app_context():
+            db.session.execute(db.text("DROP TABLE IF EXISTS migration_scratch"))
+            db.session.execute(db.text(
+                "CREATE TABLE migration_scratch (id serial PRIMARY KEY, name text, name_length integer)"))
+            db.session.execute(db.text(
+                "INSERT INTO migration_scratch (name) SELECT 'name ' || n FROM generate_series(1, 250) AS n"))
+            db.session.commit()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.execute(db.text("DROP TABLE IF EXISTS migration_scratch"))
+            db.session.commit()
+
+    def run_ops(self, fn, *args, **kwargs):
+        """Call a helper the way a migration would"""
+
+        with app.app_context():
+            with db.engine.connect() as conn:
+                with Operations.context(MigrationContext.configure(conn)):
+                    result = fn(*args, **kwargs)
+                conn.commit()
+        return result
+
+    def test_backfill(self):
+        """Every matching row is updated, in batches"""
+
+        updated = self.run_ops(
+            migration_helpers.backfill, "migration_scratch",
+            "name_length = length(name)", "name_length IS NULL", batch_size=100)
+        self.assertEqual(updated, 250)
+
+        with app.app_context():
+            missing = db.session.execute(db.text(
+                "SELECT count(*) FROM migration_scratch WHERE name_length IS NULL")).scalar()
+            self.assertEqual(missing, 0)
+
+    def test_set_not_null(self):
+        """Column ends up NOT NULL with no check constraint left over"""
+
+        self.run_ops(migration_helpers.backfill, "migration_scratch", "name_length = 0", "name_length IS NULL")
+        self.run_ops(migration_helpers.set_not_null, "migration_scratch", "name_length")
+
+        with app.app_context():
+            columns = {col["name"]: col for col in db.inspect(db.engine).get_columns("migration_scratch")}
+            self.assertFalse(columns["name_length"]["nullable"])
+            self.assertEqual(db.inspect(db.engine).get_check_constraints("migration_scratch"), [])
+
+    def test_create_index_concurrently(self):
+        """Index is built once, calling again does nothing"""
+
+        self.run_ops(migration_helpers.create_index_concurrently, "ix_scratch_name", "migration_scratch", ["name"])
+        self.run_ops(migration_helpers.create_index_concurrently, "ix_scratch_name", "migration_scratch", ["name"])
+
+        with app.app_context():
+            indexes = [index["name"] for index in db.inspect(db.engine).get_indexes("migration_scratch")]
+            self.assertEqual(indexes, ["ix_scratch_name"])
@@ -10,7 +10,9 @@ from unittest import TestCase
 from unittest.mock import patch
 from sqlalchemy import exc
 
-from models import db, Book
+from models import db, Book, BookNote, User
+from jobs import get_job_queue, run_pending
+from open_library import UpstreamError
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -18,12 +20,16 @@ from models import db, Book
 # connected to the database
 
 os.environ['DATABASE_URL'] = "postgresql:///olreader-test"
+os.environ['JOBS_URL'] = "sqlite://"
 
 
 # Now we can import app
 
 from app import app
 
+# jobs are run by the tests with run_pending, not worker threads
+app.config['TESTING'] = True
+
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
 # and create fresh new clean test data
@@ -129,20 +135,143 @@ class BookModelTestCase(TestCase):
             # Book data should match
             self.assertDictEqual(b1.to_dict(), book_dict)
 
-    def test_create_book(self):
-        """test creation of book from olid and isbn"""
+    def test_create_placeholder(self):
+        """Unknown books are saved right away and filled in by a job"""
 
         with app.app_context():
+            Book.query.filter_by(olid="OL99000001M").delete()
+            db.session.commit()
+            get_job_queue(app).clear()
+            with patch("models.cached_book_data", return_value=None):
+                book = Book.create_placeholder("OL99000001M", "")
+                # again for the same olid doesn't add a row or a job
+                Book.create_placeholder("OL99000001M")
+
+            self.assertTrue(book.pending)
+            self.assertIsNone(book.isbn)
+            self.assertEqual(get_job_queue(app).stats()["queued"], 1)
+
             with patch("models.fetch_book_data") as mock_fetch:
-                # importing this makes it models.fetch_book_data instead of open_library.fetch_book_data
                 mock_fetch.return_value = {
                     "title": "Sample Book to Add",
                     "authors": ["Sample Author"],
-                    "cover_url": "https://covers.openlibrary.org/b/olid/OL26992991M",
+                    "cover_url": "https://covers.openlibrary.org/b/olid/OL99000001M",
                 }
-                
-                new_book = Book.create_book("OL26892991M", "1234567890123")
-                mock_fetch.assert_called_once()
-                
-                book = Book.query.filter_by(olid="OL26892991M").one()
-                self.assertEqual(new_book.olid, book.olid)
+                self.assertEqual(run_pending(app), 1)
+                mock_fetch.assert_called_once_with("OL99000001M")
+
+            db.session.expire_all()
+            book = db.session.get(Book, "OL99000001M")
+            self.assertFalse(book.pending)
+            self.assertEqual(book.title, "Sample Book to Add")
+            self.assertEqual(book.author, "Sample Author")
+
+    def test_create_placeholder_invalid(self):
+        """Ids that aren't edition or work olids aren't saved"""
+
+        with app.app_context():
+            for olid in ("", "OL1A", "nonsense", "OL12M/../OL1W"):
+                with self.assertRaises(ValueError):
+                    Book.create_placeholder(olid)
+            self.assertIsNone(db.session.get(Book, "nonsense"))
+
+    def test_enrich_not_found(self):
+        """A placeholder for a book Open Library doesn't know is removed"""
+
+        with app.app_context():
+            Book.query.filter_by(olid="OL99000003M").delete()
+            db.session.commit()
+            get_job_queue(app).clear()
+            with patch("models.cached_book_data", return_value=None):
+                Book.create_placeholder("OL99000003M")
+
+            with patch("models.fetch_book_data", return_value={}):
+                self.assertEqual(run_pending(app), 1)
+
+            db.session.expire_all()
+            self.assertIsNone(db.session.get(Book, "OL99000003M"))
+            self.assertEqual(get_job_queue(app).stats()["failed"], 1)
+
+    def test_enrich_note_kept(self):
+        """A note on a book Open Library doesn't know isn't deleted with it"""
+
+        with app.app_context():
+            Book.query.filter_by(olid="OL99000004M").delete()
+            User.query.filter_by(username="enrich-note").delete()
+            db.session.commit()
+            get_job_queue(app).clear()
+            with patch("models.cached_book_data", return_value=None):
+                Book.create_placeholder("OL99000004M")
+            user = User.signup("enrich-note", "enrich-note@test.com", "password")
+            db.session.commit()
+            db.session.add(BookNote(user_id=user.id, book_olid="OL99000004M", note="My own words"))
+            db.session.commit()
+
+            with patch("models.fetch_book_data", return_value={}):
+                self.assertEqual(run_pending(app), 1)
+
+            db.session.expire_all()
+            self.assertIsNotNone(db.session.get(Book, "OL99000004M"))
+            self.assertEqual(BookNote.query.filter_by(book_olid="OL99000004M").one().note, "My own words")
+
+            User.query.filter_by(id=user.id).delete()
+            db.session.commit()
+
+    def test_enrich_upstream_error(self):
+        """Open Library failing is retried, not taken for an unknown book"""
+
+        with app.app_context():
+            Book.query.filter_by(olid="OL99000005M").delete()
+            db.session.commit()
+            get_job_queue(app).clear()
+            with patch("models.cached_book_data", return_value=None):
+                Book.create_placeholder("OL99000005M")
+
+            with patch("models.fetch_book_data", side_effect=UpstreamError("HTTP 503")):
+                self.assertEqual(run_pending(app), 1)
+
+            db.session.expire_all()
+            self.assertTrue(db.session.get(Book, "OL99000005M").pending)
+            stats = get_job_queue(app).stats()
+            self.assertEqual(stats["retrying"], 1)
+            self.assertEqual(stats["failed"], 0)
+
+    def test_create_placeholder_cached(self):
+        """Books with cached details are saved complete, no job"""
+
+        with app.app_context():
+            Book.query.filter_by(olid="OL99000002M").delete()
+            db.session.commit()
+            get_job_queue(app).clear()
+            cached = {"title": "Cached Book", "authors": [], "cover_url": None}
+            with patch("models.cached_book_data", return_value=cached):
+                book = Book.create_placeholder("OL99000002M")
+
+            self.assertFalse(book.pending)
+            self.assertEqual(book.title, "Cached Book")
+            self.assertEqual(book.author, "Unknown")
+            self.assertEqual(get_job_queue(app).stats()["queued"], 0)
+
+    def test_search_local(self):
+        """Saved books are found by title and author, typos included"""
+
+        with app.app_context():
+            db.session.add_all([
+                Book(olid="OL5735363W", title="The Zanzibar Chest", author="Aidan Hartley"),
+                Book(olid="OL1855779W", title="The Periodic Table", author="Primo Levi"),
+            ])
+            db.session.commit()
+
+            books = Book.search_local("zanzibar")
+            self.assertEqual([book.olid for book in books], ["OL5735363W"])
+
+            books = Book.search_local("primo levi")
+            self.assertEqual([book.olid for book in books], ["OL1855779W"])
+
+            # no full text match, trigram fallback
+            books = Book.search_local("Periodc")
+            self.assertEqual([book.olid for book in books], ["OL1855779W"])
+
+            result = books[0].to_search_result()
+            self.assertEqual(result["author_name"], "Primo Levi")
+            self.assertEqual(result["book_url"], "https://openlibrary.org/works/OL1855779W")
@@ -18,6 +18,7 @@ from models import db, User, Book, BookList
 # connected to the database
 
 os.environ['DATABASE_URL'] = "postgresql:///olreader-test"
+os.environ['JOBS_URL'] = "sqlite://"
 
 
 # Now we can import app
@@ -186,8 +187,49 @@ class BookListModelTestCase(TestCase):
             self.assertEqual(len(l1.books), 0)
 
             # add test book
-            with patch("models.Book.create_book") as mock_create:
+            with patch("models.Book.create_placeholder") as mock_create:
                 mock_create.return_value = self.test_book2
                 l1.add_olid("AAAAAAAAA")
                 mock_create.assert_called_once()
                 self.assertEqual(len(l1.books), 1)
+
+    def test_add_books(self):
+        """Test adding many books, saved and fetched, in one go"""
+
+        l1 = BookList(
+            user_id=self.user_id,
+            title="test list",
+            blurb="test blurb"
+        )
+
+        fetched_olids = {
+            "OL1M": {"olid": "OL1M", "title": "Dune", "authors": ["Frank Herbert"], "cover_url": None},
+        }
+        fetched_isbns = {
+            "9780441013593": {"olid": "OL2M", "title": "Dune Messiah", "authors": [], "cover_url": None},
+        }
+
+        with app.app_context():
+            db.session.add(l1)
+            l1.books.append(db.session.get(Book, "11111"))
+            db.session.commit()
+
+            with patch("models.fetch_many_book_data", return_value=(fetched_olids, fetched_isbns)) as mock_fetch:
+                results = l1.add_books(["12345", "11111", "OL1M", "OL9M", "../OL3M", "OL4M&x"], ["9780441013593"])
+                mock_fetch.assert_called_once_with(["OL1M", "OL9M"], ["9780441013593"])
+
+            statuses = {result.get("olid", result.get("isbn")): result["status"] for result in results}
+            self.assertEqual(statuses, {
+                "12345": "added",
+                "11111": "in_list",
+                "OL1M": "added",
+                "OL9M": "not_found",
+                "../OL3M": "not_found",
+                "OL4M&x": "not_found",
+                "9780441013593": "added",
+            })
+
+            db.session.refresh(l1)
+            self.assertEqual(len(l1.books), 4)
+            self.assertEqual(db.session.get(Book, "OL2M").isbn, "9780441013593")
+            self.assertEqual(db.session.get(Book, "OL2M").author, "Unknown")
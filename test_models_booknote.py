@@ -17,6 +17,7 @@ from models import db, User, Book, BookNote
 # connected to the database
 
 os.environ['DATABASE_URL'] = "postgresql:///olreader-test"
+os.environ['JOBS_URL'] = "sqlite://"
 
 
 # Now we can import app
@@ -18,6 +18,7 @@ from models import db, User, Book, BookNote, BookList
 # connected to the database
 
 os.environ['DATABASE_URL'] = "postgresql:///olreader-test"
+os.environ['JOBS_URL'] = "sqlite://"
 
 # Now we can import app
 from app import app
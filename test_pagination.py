@@ -0,0 +1,175 @@
+"""Keyset pagination tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pagination.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, User, Book, BookNote, BookList, BookListBooks
+from pagination import decode_cursor, encode_cursor
+
+os.environ['DATABASE_URL'] = "postgresql:///olreader-test"
+os.environ['JOBS_URL'] = "sqlite://"
+
+from app import app
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+NUM_BOOKS = 120
+
+
+class PaginationTestCase(TestCase):
+    """List books, notes and read books come back a page at a time"""
+
+    def setUp(self):
+        """A user with a big list and a note on every book"""
+
+        with app.app_context():
+            BookNote.query.delete()
+            BookList.query.delete()
+            Book.query.delete()
+            User.query.filter_by(username="pager").delete()
+
+            user = User.signup("pager", "pager@email.com", "welcome1")
+            db.session.commit()
+
+            books = [Book(olid=f"OL{num}P", title=f"Book {num}", author="Author") for num in range(NUM_BOOKS)]
+            db.session.add_all(books)
+            booklist = BookList(user_id=user.id, title="Big List")
+            booklist.books.extend(books)
+            db.session.add(booklist)
+            db.session.add_all([
+                BookNote(user_id=user.id, book_olid=book.olid, read=num % 2 == 0, note="note")
+                for num, book in enumerate(books)
+            ])
+            db.session.commit()
+            self.list_id = booklist.id
+
+        self.client = app.test_client()
+        self.client.post('/login', data={'username': 'pager', 'password': 'welcome1'})
+
+    def tearDown(self):
+        with app.app_context():
+            BookNote.query.delete()
+            BookList.query.delete()
+            Book.query.delete()
+            User.query.filter_by(username="pager").delete()
+            db.session.commit()
+
+    def walk(self, url, limit):
+        """Follow next cursors to the end, returns every item and the page count"""
+
+        items = []
+        pages = 0
+        after = None
+        while True:
+            params = {"limit": limit}
+            if after is not None:
+                params["after"] = after
+            response = self.client.get(url, query_string=params)
+            self.assertEqual(response.status_code, 200)
+
+            data = response.get_json()
+            items.extend(data["items"])
+            pages += 1
+            after = data["next"]
+            if after is None:
+                return items, pages
+
+    def test_list_books(self):
+        books, pages = self.walk(f'/lists/{self.list_id}/books', 50)
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(len({book["olid"] for book in books}), NUM_BOOKS)
+
+    def test_notes(self):
+        notes, pages = self.walk('/profile/notes', 50)
+
+        self.assertEqual(pages, 3)
+        ids = [note["id"] for note in notes]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), NUM_BOOKS)
+        self.assertEqual(notes[0]["book"]["title"], "Book 0")
+
+    def test_read_books(self):
+        books, pages = self.walk('/lists/read/books', 25)
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(len(books), NUM_BOOKS // 2)
+        self.assertEqual(books[1]["olid"], "OL2P")
+
+    def test_first_page_rendered(self):
+        """HTML pages render the first page and the cursor for the rest"""
+
+        response = self.client.get(f'/lists/{self.list_id}')
+        html = response.get_data(as_text=True)
+
+        self.assertEqual(html.count('class="list-book"'), 50)
+        self.assertIn('data-source="/lists/', html)
+        self.assertNotIn('data-next=""', html)
+
+    def test_bad_cursor(self):
+        response = self.client.get(f'/lists/{self.list_id}/books?after=nonsense')
+        self.assertEqual(response.status_code, 400)
+
+        # well formed, wrong type of timestamp
+        response = self.client.get(f'/lists/{self.list_id}/books?after={encode_cursor([1760779815, "OL1W"])}')
+        self.assertEqual(response.status_code, 400)
+
+        # well formed, wrong type of olid
+        response = self.client.get(f'/lists/{self.list_id}/books?after={encode_cursor(["2026-10-18T09:30:15", 1])}')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(f'/lists/{self.list_id}/books?limit=lots')
+        self.assertEqual(response.status_code, 400)
+
+    def test_bad_cursor_type(self):
+        """Cursors whose values don't fit the keys are a 400 on every paged endpoint"""
+
+        for url in ('/profile/notes', '/lists/read/books'):
+            for values in (["x"], [1.5], [True], [None]):
+                response = self.client.get(url, query_string={"after": encode_cursor(values)})
+                self.assertEqual(response.status_code, 400, (url, values))
+
+    def test_logged_out(self):
+        self.client.get('/logout')
+        response = self.client.get('/profile/notes')
+
+        self.assertIn("err", response.get_json())
+
+
+class CursorTestCase(TestCase):
+    """Cursors round trip the key values"""
+
+    def test_round_trip(self):
+        added_at = datetime(2026, 10, 18, 9, 30, 15, 123456)
+        cursor = encode_cursor([added_at, "OL1W"])
+        keys = [BookListBooks.added_at, BookListBooks.book_olid]
+
+        self.assertEqual(decode_cursor(cursor, keys), [added_at, "OL1W"])
+        with self.assertRaises(ValueError):
+            decode_cursor(encode_cursor([1]), keys)
+        with self.assertRaises(ValueError):
+            decode_cursor(encode_cursor([1760779815, "OL1W"]), keys)
+        with self.assertRaises(ValueError):
+            decode_cursor(encode_cursor(["yesterday", "OL1W"]), keys)
+        with self.assertRaises(ValueError):
+            decode_cursor(encode_cursor([added_at, 1]), keys)
+
+    def test_key_types(self):
+        """Integer keys take integers, text keys strings"""
+
+        self.assertEqual(decode_cursor(encode_cursor([12]), [BookNote.id]), [12])
+        for values in (["x"], ["12"], [1.5], [True], [None], [[1]]):
+            with self.assertRaises(ValueError):
+                decode_cursor(encode_cursor(values), [BookNote.id])
+
+        self.assertEqual(decode_cursor(encode_cursor(["OL1W"]), [Book.olid]), ["OL1W"])
+        with self.assertRaises(ValueError):
+            decode_cursor(encode_cursor([1]), [Book.olid])
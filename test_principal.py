@@ -0,0 +1,100 @@
+"""Session principal tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_principal.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///olreader-test"
+os.environ['JOBS_URL'] = "sqlite://"
+
+from app import app
+from principal import CUR_USER_KEY, principal_cache, load_principal
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+with app.app_context():
+    db.create_all()
+
+
+class PrincipalTestCase(TestCase):
+    """Logged in user comes from the session, not the users table"""
+
+    def setUp(self):
+        """Create a user and log them in from two clients"""
+
+        principal_cache.clear()
+
+        with app.app_context():
+            User.query.filter_by(username="principal").delete()
+            user = User.signup("principal", "principal@email.com", "welcome1")
+            db.session.commit()
+            self.user_id = user.id
+            self.version = user.version
+
+        self.client = app.test_client()
+        self.client.post('/login', data={'username': 'principal', 'password': 'welcome1'})
+        self.other_client = app.test_client()
+        self.other_client.post('/login', data={'username': 'principal', 'password': 'welcome1'})
+
+    def tearDown(self):
+        """Clean up"""
+
+        with app.app_context():
+            User.query.filter_by(username="principal").delete()
+            db.session.commit()
+
+    def test_load_principal(self):
+        """Principal carries id, username and version"""
+
+        with app.app_context():
+            principal = load_principal({CUR_USER_KEY: self.user_id, "cur_user_version": self.version})
+
+            self.assertEqual(principal.id, self.user_id)
+            self.assertEqual(principal.username, "principal")
+            self.assertEqual(principal.version, self.version)
+            self.assertIsNone(load_principal({}))
+
+    def test_stale_version(self):
+        """Sessions from before an edit are logged out"""
+
+        session = {CUR_USER_KEY: self.user_id, "cur_user_version": self.version - 1}
+        with app.app_context():
+            self.assertIsNone(load_principal(session))
+        self.assertNotIn(CUR_USER_KEY, session)
+
+    def test_edit_profile(self):
+        """Editing keeps this session and logs the other one out"""
+
+        data = {
+            'username': 'principal',
+            'email': 'principal@email.com',
+            'password': 'welcome1',
+            'bio': 'New bio',
+        }
+        response = self.client.post('/profile/edit', data=data, follow_redirects=True)
+        html = response.get_data(as_text=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('New bio', html)
+
+        response = self.client.get('/profile')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.other_client.get('/profile')
+        self.assertEqual(response.status_code, 302)
+
+    def test_delete_profile(self):
+        """Deleting logs out every session"""
+
+        response = self.client.post('/profile/delete')
+        self.assertEqual(response.status_code, 302)
+
+        response = self.other_client.get('/profile')
+        self.assertEqual(response.status_code, 302)
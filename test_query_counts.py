@@ -0,0 +1,124 @@
+"""Query count tests, every page runs a fixed number of SQL statements."""
+
+# run these tests like:
+#
+#    python -m unittest test_query_counts.py
+
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import event
+
+from models import db, User, Book, BookNote, BookList
+
+os.environ['DATABASE_URL'] = "postgresql:///olreader-test"
+os.environ['JOBS_URL'] = "sqlite://"
+
+from app import app
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+NUM_ITEMS = 15
+
+
+class QueryCounter:
+    """Count the SQL statements run inside a with block"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self.count)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self.count)
+
+    def count(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+class QueryCountTestCase(TestCase):
+    """Pages must not load related rows one at a time"""
+
+    def setUp(self):
+        """Create a user with many lists, books and notes"""
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            user = User.signup("counter", "counter@email.com", "welcome1")
+            db.session.commit()
+            self.user_id = user.id
+
+            books = [Book(olid=f"OL{num}M", title=f"Book {num}", author="Author") for num in range(NUM_ITEMS)]
+            db.session.add_all(books)
+            for num in range(NUM_ITEMS):
+                booklist = BookList(user_id=user.id, title=f"List {num}")
+                booklist.books.extend(books)
+                db.session.add(booklist)
+                db.session.add(BookNote(user_id=user.id, book_olid=books[num].olid, read=True, note="note"))
+            db.session.commit()
+
+            self.list_id = BookList.query.first().id
+            self.note_id = BookNote.query.first().id
+
+        self.client = app.test_client()
+        self.client.post('/login', data={'username': 'counter', 'password': 'welcome1'})
+
+    def assertQueryCount(self, url, max_queries):
+        """GET url and check how many statements it ran"""
+
+        with app.app_context():
+            with QueryCounter(db.engine) as counter:
+                response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(counter.statements), max_queries, "\n".join(counter.statements))
+
+    def test_profile(self):
+        """Profile: user, lists, notes with their books"""
+
+        self.assertQueryCount('/profile', 3)
+
+    def test_booklist(self):
+        """List page: list, books"""
+
+        self.assertQueryCount(f'/lists/{self.list_id}', 2)
+
+    def test_read_books(self):
+        """Read books: books joined with notes"""
+
+        self.assertQueryCount('/lists/read', 1)
+
+    def test_book(self):
+        """Book page: book, note, lists with the book, add to list menu"""
+
+        with patch("app.fetch_availabilty_links", return_value={}):
+            self.assertQueryCount('/books/OL1M', 4)
+
+    def test_note(self):
+        """Note page: note with book, lists with the book, add to list menu"""
+
+        self.assertQueryCount(f'/notes/{self.note_id}', 3)
+
+    def test_search_json(self):
+        """Search json: statement timeout, list titles"""
+
+        with patch("app.keyword_search", return_value={"total": 0, "num_returned": 0, "works": []}):
+            self.assertQueryCount('/search/watchmen?source=remote', 2)
+
+    def test_anonymous(self):
+        """Logged out api calls never touch the db"""
+
+        self.client.get('/logout')
+        with patch("app.keyword_search", return_value={"total": 0, "num_returned": 0, "works": []}):
+            self.assertQueryCount('/search/watchmen?source=remote', 0)
+        with patch("app.trending_feeds.get", return_value=([], None)):
+            self.assertQueryCount('/trending/fetch?type=recent', 0)
@@ -0,0 +1,201 @@
+"""Rate limiter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_ratelimit.py
+
+
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+import open_library
+from ratelimit import BACKGROUND, INTERACTIVE, SQLiteStore, TokenBucket, current_priority, priority, store_from_url
+
+
+class FakeClock:
+    """Clock that only moves when something sleeps"""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TokenBucketTestCase(TestCase):
+    """Test the token bucket"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_burst_then_rate(self):
+        """A full bucket lets a burst through, then calls are spaced by the rate"""
+
+        bucket = TokenBucket(4, burst=2, clock=self.clock, sleep=self.clock.sleep)
+
+        waits = [bucket.acquire() for _ in range(6)]
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertAlmostEqual(self.clock.now - 100.0, 1.0)
+        for wait in waits[2:]:
+            self.assertAlmostEqual(wait, 0.25)
+
+    def test_refill(self):
+        """Tokens build back up while idle, but no more than the burst"""
+
+        bucket = TokenBucket(10, burst=5, clock=self.clock, sleep=self.clock.sleep)
+        for _ in range(5):
+            bucket.acquire()
+
+        self.clock.now += 60
+        waits = [bucket.reserve() for _ in range(6)]
+        self.assertEqual(waits[:5], [0.0] * 5)
+        self.assertAlmostEqual(waits[5], 0.1)
+
+    def test_reservations_queue(self):
+        """Callers that find the bucket empty wait in turn"""
+
+        bucket = TokenBucket(2, burst=1, clock=self.clock, sleep=self.clock.sleep)
+        bucket.reserve()
+
+        self.assertAlmostEqual(bucket.reserve(), 0.5)
+        self.assertAlmostEqual(bucket.reserve(), 1.0)
+        self.assertAlmostEqual(bucket.reserve(), 1.5)
+
+    def test_unlimited(self):
+        """A rate of 0 never waits"""
+
+        bucket = TokenBucket(0, clock=self.clock, sleep=self.clock.sleep)
+        self.assertEqual(sum(bucket.acquire() for _ in range(1000)), 0.0)
+
+    def test_configure(self):
+        """Changing the rate keeps the tokens, reset starts over with a full bucket"""
+
+        bucket = TokenBucket(1, clock=self.clock, sleep=self.clock.sleep)
+        bucket.acquire()
+        self.assertGreater(bucket.reserve(), 0)
+
+        bucket.configure(100, burst=10)
+        self.assertGreater(bucket.reserve(), 0)
+
+        bucket.reset()
+        self.assertEqual([bucket.reserve() for _ in range(10)], [0.0] * 10)
+
+    def test_background_leaves_reserve(self):
+        """Background calls stop at the share kept for interactive ones"""
+
+        bucket = TokenBucket(10, burst=4, clock=self.clock, sleep=self.clock.sleep)
+
+        self.assertEqual([bucket.acquire(priority=BACKGROUND) for _ in range(2)], [0.0, 0.0])
+        self.assertAlmostEqual(bucket.acquire(priority=BACKGROUND), 0.1)
+        # the two kept back are still there for pages
+        self.assertEqual([bucket.reserve() for _ in range(2)], [0.0, 0.0])
+
+    def test_background_behind_interactive(self):
+        """Background calls wait until queued interactive calls have gone"""
+
+        bucket = TokenBucket(10, burst=1, clock=self.clock, sleep=self.clock.sleep)
+        for _ in range(5):
+            bucket.reserve()
+
+        # four reservations queued behind the burst, 0.4s to repay them
+        self.assertAlmostEqual(bucket.acquire(priority=BACKGROUND), 0.5)
+        self.assertAlmostEqual(bucket.acquire(priority=INTERACTIVE), 0.1)
+
+    def test_priority_context(self):
+        """Calls take the priority of the block they run in, tasks submitted from it too"""
+
+        bucket = TokenBucket(0, clock=self.clock, sleep=self.clock.sleep)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with priority(BACKGROUND):
+                bucket.acquire()
+                self.assertEqual(open_library.submit(executor, current_priority.get).result(), BACKGROUND)
+            bucket.acquire()
+            self.assertEqual(open_library.submit(executor, current_priority.get).result(), INTERACTIVE)
+
+        stats = bucket.stats()
+        self.assertEqual(stats[BACKGROUND]["calls"], 1)
+        self.assertEqual(stats[INTERACTIVE]["calls"], 1)
+
+        with self.assertRaises(ValueError):
+            with priority("urgent"):
+                pass
+
+    def test_wait_stats(self):
+        """Queue waits are reported per priority"""
+
+        bucket = TokenBucket(2, burst=1, clock=self.clock, sleep=self.clock.sleep)
+        for _ in range(3):
+            bucket.acquire()
+
+        stats = bucket.stats()[INTERACTIVE]
+        self.assertEqual(stats["calls"], 3)
+        self.assertEqual(stats["waited"], 2)
+        self.assertEqual(stats["waiting"], 0)
+        self.assertEqual(stats["wait_max_ms"], 500.0)
+        self.assertAlmostEqual(stats["wait_avg_ms"], 333.3)
+
+
+class SharedStoreTestCase(TestCase):
+    """Test buckets in different workers sharing a SQLite store"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+
+    def tearDown(self):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def worker_bucket(self):
+        """A bucket as another worker process would open it"""
+
+        return TokenBucket(2, burst=2, clock=self.clock, sleep=self.clock.sleep,
+                           store=SQLiteStore(self.path), name="openlibrary")
+
+    def test_shared_tokens(self):
+        """Workers draw from the same tokens"""
+
+        first = self.worker_bucket()
+        second = self.worker_bucket()
+
+        self.assertEqual(first.reserve(), 0.0)
+        self.assertEqual(second.reserve(), 0.0)
+        self.assertAlmostEqual(first.reserve(), 0.5)
+        self.assertAlmostEqual(second.reserve(), 1.0)
+
+        self.clock.now += 10
+        self.assertEqual(second.reserve(), 0.0)
+
+    def test_worker_start_keeps_tokens(self):
+        """A worker starting up doesn't refill the tokens the others used"""
+
+        first = self.worker_bucket()
+        first.reserve()
+        first.reserve()
+
+        self.assertAlmostEqual(self.worker_bucket().reserve(), 0.5)
+
+    def test_opened_on_use(self):
+        """The file isn't opened until a limiting bucket uses it"""
+
+        os.remove(self.path)
+        bucket = TokenBucket(0, clock=self.clock, sleep=self.clock.sleep, store=SQLiteStore(self.path))
+        bucket.acquire()
+        self.assertFalse(os.path.exists(self.path))
+
+        bucket.configure(2)
+        bucket.acquire()
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_store_from_url(self):
+        self.assertIsInstance(store_from_url(f"sqlite:///{self.path}"), SQLiteStore)
+        self.assertEqual(store_from_url("sqlite://").path, ":memory:")
+        with self.assertRaises(ValueError):
+            store_from_url("redis://localhost")
@@ -0,0 +1,332 @@
+"""Open Library resilience tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_resilience.py
+
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+from unittest.mock import patch
+
+import requests
+
+import open_library
+from open_library import UpstreamError, fetch_json
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitBreakers, CircuitOpenError, RetryBudget, hedged, jittered_backoff
+from test_ratelimit import FakeClock
+
+
+class CircuitBreakerTestCase(TestCase):
+    """Test the circuit breaker on a fake clock"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker("works", failure_threshold=3, reset_timeout=30, clock=self.clock)
+
+    def test_opens(self):
+        """Failures in a row open it, a success in between starts the count over"""
+
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.stats()["rejected"], 1)
+
+    def test_half_open(self):
+        """After the reset timeout one probe goes through and decides"""
+
+        for _ in range(3):
+            self.breaker.record_failure()
+
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_lost_probe(self):
+        """A probe that never reports back doesn't keep it half open for good"""
+
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+
+
+class RetryBudgetTestCase(TestCase):
+    """Test the retry budget on a fake clock"""
+
+    def test_ratio(self):
+        """Retries are capped at a share of recent requests plus the floor"""
+
+        clock = FakeClock()
+        budget = RetryBudget(ratio=0.1, min_per_second=0.5, window=10, clock=clock)
+        for _ in range(100):
+            budget.record_request()
+
+        # 0.5 * 10 + 0.1 * 100
+        self.assertEqual(sum(budget.try_spend() for _ in range(20)), 15)
+        self.assertEqual(budget.stats()["exhausted"], 5)
+
+        clock.now += 10
+        self.assertTrue(budget.try_spend())
+        self.assertEqual(budget.stats()["requests"], 0)
+
+    def test_backoff(self):
+        """Full jitter up to the capped exponential delay"""
+
+        self.assertEqual([jittered_backoff(attempt, 0.5, 3, rand=lambda: 1) for attempt in (1, 2, 3, 4)], [0.5, 1, 2, 3])
+        self.assertEqual(jittered_backoff(4, 0.5, 3, rand=lambda: 0), 0)
+
+
+class HedgedTestCase(TestCase):
+    """Test hedged calls"""
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+    def tearDown(self):
+        self.executor.shutdown(wait=False)
+
+    def test_fast_call_not_hedged(self):
+        calls = []
+        self.assertEqual(hedged(lambda: calls.append(1) or "ok", 1, self.executor), "ok")
+        self.assertEqual(len(calls), 1)
+
+    def test_slow_call_hedged(self):
+        """The second call answers while the first is still stuck"""
+
+        delays = iter([1, 0])
+
+        def call():
+            time.sleep(next(delays))
+            return time.monotonic()
+
+        start = time.monotonic()
+        hedged(call, 0.05, self.executor)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_no_budget(self):
+        """Without budget it waits on the one call"""
+
+        calls = []
+
+        def call():
+            calls.append(1)
+            time.sleep(0.1)
+            return "ok"
+
+        self.assertEqual(hedged(call, 0.01, self.executor, can_hedge=lambda: False), "ok")
+        self.assertEqual(len(calls), 1)
+
+    def test_failed_call(self):
+        """A failure only counts once every call has failed"""
+
+        outcomes = iter([requests.ConnectionError("down"), "ok"])
+
+        def call():
+            outcome = next(outcomes)
+            time.sleep(0.1)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        self.assertEqual(hedged(call, 0.01, self.executor), "ok")
+        with self.assertRaises(requests.ConnectionError):
+            hedged(lambda: (_ for _ in ()).throw(requests.ConnectionError("down")), 0.01, self.executor)
+
+
+class FakeOpenLibrary:
+    """
+    Local HTTP server answering from a script of (delay seconds, status)
+    per path, the last step repeats. Counts the requests it gets.
+    """
+
+    def __init__(self):
+        self.scripts = {}
+        self.hits = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{ self.server.server_address[1] }{ path }"
+
+    def next_step(self, path):
+        with self._lock:
+            self.hits[path] = self.hits.get(path, 0) + 1
+            script = self.scripts.get(path, [(0, 200)])
+            return script[min(self.hits[path], len(script)) - 1]
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                delay, status = fake.next_step(self.path)
+                time.sleep(delay)
+                body = json.dumps({"path": self.path, "hit": fake.hits[self.path], "status": status}).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    # the client gave up waiting
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ResilientFetchTestCase(TestCase):
+    """Test fetch_json against a local server that is slow or failing"""
+
+    def setUp(self):
+        self.upstream = FakeOpenLibrary()
+        open_library.stale_cache.clear()
+        self.patches = [
+            patch("open_library.circuit_breakers", CircuitBreakers(failure_threshold=3, reset_timeout=60)),
+            patch("open_library.retry_budget", RetryBudget(ratio=0.5, min_per_second=1)),
+            patch("open_library.RETRY_BACKOFF", 0.001),
+            patch("open_library.READ_TIMEOUT", 0.3),
+        ]
+        for patcher in self.patches:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+        open_library.stale_cache.clear()
+        self.upstream.close()
+
+    def test_retries(self):
+        """Server errors and timeouts are retried"""
+
+        self.upstream.scripts["/works/OL1W.json"] = [(0, 503), (1, 200), (0, 200)]
+        data, ok, stale = fetch_json(self.upstream.url("/works/OL1W.json"))
+
+        self.assertTrue(ok)
+        self.assertEqual(data["hit"], 3)
+
+    def test_not_found_not_retried(self):
+        """A 404 is an answer, not an outage"""
+
+        self.upstream.scripts["/works/OL404W.json"] = [(0, 404)]
+        for _ in range(4):
+            data, ok, stale = fetch_json(self.upstream.url("/works/OL404W.json"))
+            self.assertFalse(ok)
+
+        self.assertEqual(self.upstream.hits["/works/OL404W.json"], 4)
+        self.assertEqual(open_library.circuit_breakers.stats()[f"127.0.0.1:{ self.upstream.server.server_address[1] }/works"]["state"], CLOSED)
+
+    def test_out_of_retries(self):
+        """Failing responses raise once retries run out, they don't say the data is missing"""
+
+        self.upstream.scripts["/works/OL2W.json"] = [(0, 502)]
+        with patch("open_library.MAX_RETRIES", 1), self.assertRaises(UpstreamError) as raised:
+            fetch_json(self.upstream.url("/works/OL2W.json"))
+
+        self.assertEqual(raised.exception.response.status_code, 502)
+        self.assertEqual(self.upstream.hits["/works/OL2W.json"], 2)
+
+    def test_retry_budget(self):
+        """No retries once the budget is spent"""
+
+        self.upstream.scripts["/works/OL3W.json"] = [(0, 503)]
+        with patch("open_library.retry_budget", RetryBudget(ratio=0, min_per_second=0)), \
+                self.assertRaises(UpstreamError):
+            fetch_json(self.upstream.url("/works/OL3W.json"))
+
+        self.assertEqual(self.upstream.hits["/works/OL3W.json"], 1)
+
+    def test_breaker(self):
+        """A failing endpoint stops being called, other endpoints still are"""
+
+        self.upstream.scripts["/search.json?q=down"] = [(0, 500)]
+        with patch("open_library.MAX_RETRIES", 0):
+            for _ in range(3):
+                with self.assertRaises(UpstreamError):
+                    fetch_json(self.upstream.url("/search.json?q=down"))
+
+            start = time.monotonic()
+            with self.assertRaises(CircuitOpenError):
+                fetch_json(self.upstream.url("/search.json?q=down"))
+            self.assertLess(time.monotonic() - start, 0.05)
+
+        self.assertEqual(self.upstream.hits["/search.json?q=down"], 3)
+        self.assertTrue(fetch_json(self.upstream.url("/works/OL4W.json"))[1])
+
+    def test_stale_fallback(self):
+        """Once upstream is down the last good response is served"""
+
+        url = self.upstream.url("/works/OL5W.json")
+        self.upstream.scripts["/works/OL5W.json"] = [(0, 200), (1, 200)]
+        first, ok, stale = fetch_json(url)
+        self.assertFalse(stale)
+
+        start = time.monotonic()
+        with patch("open_library.MAX_RETRIES", 0):
+            data, ok, stale = fetch_json(url)
+            self.assertTrue(ok)
+            self.assertTrue(stale)
+            self.assertEqual(data, first)
+
+            # breaker open now, answered without waiting on the timeout
+            for _ in range(3):
+                self.assertEqual(fetch_json(url)[0], first)
+        self.assertLess(time.monotonic() - start, 1.5)
+
+        # the stale answer is served but not cached again as a fresh one
+        with patch("open_library.BASE_URL", self.upstream.url("")):
+            self.assertEqual(open_library.fetch_data("OL5W", "works"), first)
+            self.assertEqual(open_library.fetch_book_data("OL5W")["hit"], first["hit"])
+        self.assertIsNone(open_library.ol_cache.get("works:OL5W"))
+        self.assertIsNone(open_library.ol_cache.get("book_data:OL5W"))
+
+        # nothing saved to fall back on
+        self.upstream.scripts["/authors/OL1A.json"] = [(1, 200)]
+        with self.assertRaises(requests.Timeout), patch("open_library.MAX_RETRIES", 0):
+            fetch_json(self.upstream.url("/authors/OL1A.json"))
+
+    def test_hedged(self):
+        """A slow request is sent again and the faster answer wins"""
+
+        self.upstream.scripts["/works/OL6W.json"] = [(0.25, 200), (0, 200)]
+        with patch("open_library.HEDGE_AFTER", 0.05):
+            start = time.monotonic()
+            data, ok, stale = fetch_json(self.upstream.url("/works/OL6W.json"))
+
+        self.assertLess(time.monotonic() - start, 0.2)
+        self.assertEqual(data["hit"], 2)
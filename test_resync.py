@@ -0,0 +1,127 @@
+"""Book metadata resync tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_resync.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, Book
+
+os.environ['DATABASE_URL'] = "postgresql:///olreader-test"
+os.environ['JOBS_URL'] = "sqlite://"
+
+from app import app
+
+from open_library import ol_rate_limit
+from ratelimit import current_limits
+from resync import resync_books, load_checkpoint
+from test_query_counts import QueryCounter
+
+app.config['TESTING'] = True
+
+
+def fake_fetch(olids, isbns=(), timeout=None, executor=None):
+    """Open Library has new covers for even books and doesn't know OL9M"""
+
+    fetched = {}
+    for olid in olids:
+        num = int(olid[2:-1])
+        if num == 9:
+            continue
+        fetched[olid] = {
+            "olid": olid,
+            "title": f"Book {num}",
+            "authors": ["Author"],
+            "cover_url": f"https://covers.openlibrary.org/b/olid/{olid}" if num % 2 == 0 else None,
+        }
+    return fetched, {}
+
+
+class ResyncTestCase(TestCase):
+    """Test resyncing books from Open Library"""
+
+    def setUp(self):
+        """Ten books, one of them still a placeholder"""
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            db.session.add_all([Book(olid=f"OL{num}M", title=f"Book {num}", author="Author") for num in range(10)])
+            db.session.add(Book(olid="OL10M", title="OL10M", author="Unknown", pending=True))
+            db.session.commit()
+
+        handle, self.checkpoint = tempfile.mkstemp(suffix=".json")
+        os.close(handle)
+        os.remove(self.checkpoint)
+
+    def tearDown(self):
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+    def test_resync(self):
+        """Only changed rows are written, placeholders are filled in"""
+
+        reports = []
+        with app.app_context():
+            with patch("resync.fetch_many_book_data", side_effect=fake_fetch):
+                with QueryCounter(db.engine) as counter:
+                    state = resync_books(self.checkpoint, chunk_size=4, report=reports.append)
+
+            updates = [statement for statement in counter.statements if statement.startswith("UPDATE")]
+            # one executemany per chunk with changes, not one per book
+            self.assertEqual(len(updates), 3)
+
+            self.assertEqual(state["scanned"], 11)
+            # OL0M, OL2M, ... OL8M got covers and OL10M was filled in
+            self.assertEqual(state["changed"], 6)
+            self.assertEqual(state["not_found"], 1)
+            self.assertIsNone(state["after"])
+            self.assertEqual(len(reports), 3)
+            self.assertIn("rows/sec", reports[-1])
+            self.assertFalse(os.path.exists(self.checkpoint))
+
+            self.assertEqual(db.session.get(Book, "OL2M").cover_url, "https://covers.openlibrary.org/b/olid/OL2M")
+            self.assertIsNone(db.session.get(Book, "OL3M").cover_url)
+            placeholder = db.session.get(Book, "OL10M")
+            self.assertEqual(placeholder.title, "Book 10")
+            self.assertFalse(placeholder.pending)
+
+    def test_resume(self):
+        """An interrupted run carries on from the checkpoint"""
+
+        with app.app_context():
+            with patch("resync.fetch_many_book_data", side_effect=fake_fetch) as mock_fetch:
+                state = resync_books(self.checkpoint, chunk_size=4, max_chunks=1, report=lambda line: None)
+                self.assertEqual(state["scanned"], 4)
+                self.assertEqual(load_checkpoint(self.checkpoint)["scanned"], 4)
+
+                state = resync_books(self.checkpoint, chunk_size=4, report=lambda line: None)
+
+            self.assertEqual(state["scanned"], 11)
+            fetched = [olid for call in mock_fetch.call_args_list for olid in call.args[0]]
+            self.assertEqual(sorted(fetched), sorted(f"OL{num}M" for num in range(11)))
+
+    def test_own_rate(self):
+        """The resync rate caps its own calls, the shared limiter is left alone"""
+
+        limits = []
+
+        def fetch_limited(olids, *args, **kwargs):
+            limits.append(current_limits.get())
+            return fake_fetch(olids, *args, **kwargs)
+
+        rate = ol_rate_limit.rate
+        with app.app_context():
+            with patch("resync.fetch_many_book_data", side_effect=fetch_limited), \
+                    patch.object(ol_rate_limit, "configure") as mock_configure:
+                resync_books(self.checkpoint, rate=1000, report=lambda line: None)
+                mock_configure.assert_not_called()
+
+        self.assertEqual(ol_rate_limit.rate, rate)
+        self.assertEqual([(bucket.name, bucket.rate) for bucket in limits[0]], [("resync", 1000)])
+        self.assertEqual(current_limits.get(), ())
@@ -0,0 +1,254 @@
+"""Search suggestion tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_suggest.py
+
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, Book
+
+os.environ['DATABASE_URL'] = "postgresql:///olreader-test"
+os.environ['JOBS_URL'] = "sqlite://"
+
+from app import app
+
+from suggest import SuggestIndex, normalize, suggest_index
+
+app.config['TESTING'] = True
+
+
+def work(olid, title, author_name="Author"):
+    return {"olid": olid, "title": title, "author_name": author_name}
+
+
+class SuggestIndexTestCase(TestCase):
+    """Test the prefix index without the database"""
+
+    def setUp(self):
+        self.index = SuggestIndex(remote_max=3)
+
+    def titles(self, prefix, limit=8):
+        return [suggestion["title"] for suggestion in self.index.suggest(prefix, limit)]
+
+    def test_normalize(self):
+        """Case, accents and punctuation don't matter"""
+
+        self.assertEqual(normalize("  Les Misérables: Tome 1 "), "les miserables tome 1")
+        self.assertEqual(normalize("Ender's  Game"), "ender s game")
+
+    def test_prefixes(self):
+        """Titles match from their start, from any word and by author"""
+
+        self.index.add_works([
+            work("OL1M", "The Zanzibar Chest", "Aidan Hartley"),
+            work("OL2M", "Chest of Drawers", "Someone"),
+            work("OL3M", "Watchmen", "Alan Moore"),
+        ])
+
+        self.assertEqual(self.titles("chest"), ["Chest of Drawers", "The Zanzibar Chest"])
+        self.assertEqual(self.titles("ZANZIBAR ch"), ["The Zanzibar Chest"])
+        self.assertEqual(self.titles("hartl"), ["The Zanzibar Chest"])
+        self.assertEqual(self.titles("watchmen"), ["Watchmen"])
+        self.assertEqual(self.titles("xyz"), [])
+        self.assertEqual(self.titles("  "), [])
+        self.assertEqual(self.titles("c", limit=1), ["Chest of Drawers"])
+
+    def test_local_first(self):
+        """Saved books rank ahead of remote works and replace them"""
+
+        self.index.add_works([work("OL1M", "Dune Messiah"), work("OL2M", "Dune")])
+        self.index.add_books([Book(olid="OL1M", title="Dune Messiah", author="Frank Herbert")])
+        self.index.add_works([work("OL1M", "Dune Messiah (remote)")])
+
+        self.assertEqual(self.titles("dune"), ["Dune Messiah", "Dune"])
+        self.assertEqual(self.index.suggest("frank")[0]["olid"], "OL1M")
+
+    def test_duplicates(self):
+        """A work and its edition are suggested once"""
+
+        self.index.add_works([work("OL1W", "Watchmen", "Alan Moore"), work("OL1M", "Watchmen", "Alan Moore")])
+        self.assertEqual(len(self.index.suggest("watch")), 1)
+
+    def test_changed_title(self):
+        """Reindexing a book drops its old keys"""
+
+        self.index.add_books([Book(olid="OL1M", title="OL1M", author="Unknown")])
+        self.index.add_books([Book(olid="OL1M", title="Dune", author="Frank Herbert")])
+
+        self.assertEqual(self.titles("ol1m"), [])
+        self.assertEqual(self.titles("unknown"), [])
+        self.assertEqual(self.titles("dune"), ["Dune"])
+
+    def test_remote_bounded(self):
+        """Only the most recently seen remote works are kept"""
+
+        self.index.add_works([work(f"OL{num}M", f"Book {num}") for num in range(3)])
+        # seen again, so it outlasts OL1M
+        self.index.add_works([work("OL0M", "Book 0")])
+        self.index.add_works([work("OL3M", "Book 3")])
+
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(sorted(self.titles("book")), ["Book 0", "Book 2", "Book 3"])
+
+        # a search that pushes out more than a batch at once
+        self.index.remote_max = 100
+        self.index.add_works([work(f"OL{num}W", f"Other {num}") for num in range(200)])
+        self.assertEqual(len(self.index), 100)
+        self.assertEqual(self.titles("book"), [])
+        # "other n", "n" and "author" for each
+        self.assertEqual(len(self.index._keys), 300)
+        self.assertEqual(self.index._keys, sorted(self.index._keys))
+
+    def test_removed_come_back(self):
+        """A work pushed out and seen again is suggested once"""
+
+        self.index.add_works([work(f"OL{num}M", f"Book {num}") for num in range(4)])
+        self.index.add_works([work("OL0M", "Book 0")])
+
+        self.assertEqual(sorted(self.titles("book")), ["Book 0", "Book 2", "Book 3"])
+        self.assertEqual(len(self.index._keys), len(set(self.index._keys)))
+
+
+class SuggestRefreshTestCase(TestCase):
+    """Test loading saved books into the index"""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            db.session.add_all([
+                Book(olid="OL1M", title="Dune", author="Frank Herbert"),
+                Book(olid="OL2M", title="OL2M", author="Unknown", pending=True),
+            ])
+            db.session.commit()
+
+        self.index = SuggestIndex()
+
+    def test_incremental(self):
+        """After the first load only changed books are read"""
+
+        with app.app_context():
+            self.assertEqual(self.index.refresh(), 2)
+            self.assertEqual(self.index.suggest("dune")[0]["olid"], "OL1M")
+
+            # long after the first load, the unchanged rows aren't read again
+            db.session.execute(db.text("UPDATE books SET updated_at = updated_at - interval '1 day'"))
+            db.session.commit()
+            self.assertEqual(self.index.refresh(), 0)
+
+            db.session.execute(db.update(Book)
+                .where(Book.olid == "OL2M")
+                .values(title="Children of Dune", author="Frank Herbert", pending=False))
+            db.session.add(Book(olid="OL3M", title="Dune Messiah", author="Frank Herbert"))
+            db.session.commit()
+
+            self.assertEqual(self.index.refresh(), 2)
+            titles = [suggestion["title"] for suggestion in self.index.suggest("dune")]
+            self.assertEqual(titles, ["Dune", "Dune Messiah", "Children of Dune"])
+            self.assertEqual(self.index.suggest("ol2m"), [])
+
+    def test_prune(self):
+        """Deleted books stop being suggested"""
+
+        self.index.prune_interval = 0
+        with app.app_context():
+            self.index.refresh()
+            self.index.add_works([work("OL9M", "Dune Remote")])
+            Book.query.filter_by(olid="OL1M").delete()
+            db.session.commit()
+
+            self.index.refresh()
+            self.assertEqual([suggestion["olid"] for suggestion in self.index.suggest("dune")], ["OL9M"])
+
+    def test_ensure_fresh(self):
+        """Loads in the background, the request never waits on it"""
+
+        self.index.refresh_interval = 60
+        self.assertFalse(self.index.ensure_fresh(app))
+        self.index.wait(5)
+        self.assertTrue(self.index.loaded)
+        self.assertEqual(self.index.suggest("dune")[0]["olid"], "OL1M")
+
+        with patch.object(self.index, "refresh") as mock_refresh:
+            self.assertTrue(self.index.ensure_fresh(app))
+            mock_refresh.assert_not_called()
+
+    def test_bulk_update(self):
+        """executemany updates (resync) move updated_at too"""
+
+        with app.app_context():
+            before = db.session.get(Book, "OL1M").updated_at
+            db.session.execute(db.text("UPDATE books SET updated_at = updated_at - interval '1 day'"))
+            db.session.commit()
+
+            db.session.execute(db.update(Book), [{"olid": "OL1M", "title": "Dune", "author": "F. Herbert",
+                "cover_url": None, "pending": False}])
+            db.session.commit()
+
+            self.assertGreaterEqual(db.session.get(Book, "OL1M").updated_at, before)
+
+
+class SuggestRouteTestCase(TestCase):
+    """Test /search/suggest"""
+
+    def setUp(self):
+        self.client = app.test_client()
+        suggest_index.clear()
+        with app.app_context():
+            db.create_all()
+            Book.query.filter(Book.olid == "OL77001M").delete()
+            db.session.add(Book(olid="OL77001M", title="Suggestible Saved Book", author="Author"))
+            db.session.commit()
+
+    def tearDown(self):
+        suggest_index.clear()
+        with app.app_context():
+            Book.query.filter(Book.olid == "OL77001M").delete()
+            db.session.commit()
+
+    def test_suggest(self):
+        """Saved books and works from earlier searches, no openlibrary.org call"""
+
+        remote = {"total": 1, "num_returned": 1, "works": [{
+            "workid": "OL77002W", "olid": "OL77002M", "isbn": None, "title": "Suggestible Remote Work",
+            "author_name": "Author", "cover_url": None, "book_url": "https://openlibrary.org/works/OL77002W"}]}
+
+        with self.client:
+            with patch("app.keyword_search", return_value=remote):
+                self.client.get('/search/suggestible?source=remote')
+
+            # saved books come from the database while the index loads
+            with patch.object(suggest_index, "ensure_fresh", return_value=False):
+                response = self.client.get('/search/suggest?prefix=suggestible')
+            self.assertEqual([suggestion["olid"] for suggestion in response.json["suggestions"]], ["OL77001M", "OL77002M"])
+
+            suggest_index.ensure_fresh(app)
+            suggest_index.wait(5)
+            with patch("app.keyword_search") as mock_search, patch("app.Book.search_local") as mock_local:
+                response = self.client.get('/search/suggest?prefix=suggestib')
+                mock_search.assert_not_called()
+                mock_local.assert_not_called()
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([suggestion["olid"] for suggestion in response.json["suggestions"]], ["OL77001M", "OL77002M"])
+
+            response = self.client.get('/search/suggest?prefix=suggestib&limit=1')
+            self.assertEqual(len(response.json["suggestions"]), 1)
+
+            for limit in ("many", "0", "-1"):
+                response = self.client.get(f'/search/suggest?prefix=suggestib&limit={limit}')
+                self.assertEqual(response.status_code, 400)
+
+    def test_no_prefix(self):
+        """Nothing to suggest without a prefix, and no search"""
+
+        with self.client, patch("app.keyword_search") as mock_search:
+            for url in ('/search/suggest', '/search/suggest?prefix=', '/search/suggest?prefix=%20'):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json, {"suggestions": []})
+            mock_search.assert_not_called()
@@ -0,0 +1,73 @@
+"""Trending refresher tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_trending.py
+
+
+import time
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from trending import TrendingRefresher
+
+
+class TrendingRefresherTestCase(TestCase):
+    """Test the background trending refresher"""
+
+    def test_refresh_all(self):
+        """Every feed gets a snapshot"""
+
+        fetch = MagicMock(side_effect=lambda trending_type: [{"title": trending_type}])
+        refresher = TrendingRefresher(fetch=fetch)
+        refresher.refresh_all()
+
+        self.assertEqual(fetch.call_count, 3)
+        works, age = refresher.get("monthly")
+        self.assertEqual(works, [{"title": "monthly"}])
+        self.assertLess(age, 1)
+
+        # snapshots are served without going upstream
+        refresher.get("popular")
+        self.assertEqual(fetch.call_count, 3)
+
+    def test_unknown_type(self):
+        """Unknown feeds fall back to recent"""
+
+        refresher = TrendingRefresher(fetch=lambda trending_type: [trending_type])
+        works, age = refresher.get(None)
+        self.assertEqual(works, ["recent"])
+
+    def test_stale_on_failure(self):
+        """Upstream failures keep serving the last good snapshot"""
+
+        fetch = MagicMock(return_value=[{"title": "Watchmen"}])
+        refresher = TrendingRefresher(fetch=fetch)
+        refresher.refresh("recent")
+
+        fetch.side_effect = ConnectionError("openlibrary.org is down")
+        self.assertFalse(refresher.refresh("recent"))
+        works, age = refresher.get("recent")
+        self.assertEqual(works, [{"title": "Watchmen"}])
+
+    def test_no_snapshot_failure(self):
+        """With nothing cached a failure gives an empty feed"""
+
+        refresher = TrendingRefresher(fetch=MagicMock(side_effect=ConnectionError()))
+        self.assertEqual(refresher.get("recent"), ([], None))
+
+    def test_background_thread(self):
+        """The refresh thread warms every feed"""
+
+        fetch = MagicMock(return_value=[])
+        refresher = TrendingRefresher(fetch=fetch, interval=60)
+        refresher.start()
+        refresher.start()
+
+        for _ in range(50):
+            if fetch.call_count >= 3:
+                break
+            time.sleep(0.01)
+        refresher.stop()
+
+        self.assertEqual(fetch.call_count, 3)
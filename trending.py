@@ -0,0 +1,101 @@
+"""Keep the trending feeds warm in the background"""
+
+import os
+import threading
+import time
+
+from open_library import fetch_trending_books
+from ratelimit import BACKGROUND, priority
+
+TRENDING_TYPES = ("recent", "monthly", "popular")
+
+# Seconds between refreshes of every feed
+REFRESH_INTERVAL = float(os.getenv("TRENDING_REFRESH_INTERVAL", 10 * 60))
+
+
+class TrendingRefresher:
+    """
+    Refreshes the trending feeds on a schedule and serves the last good
+    snapshot, so page loads never wait on openlibrary.org
+    """
+
+    def __init__(self, fetch=fetch_trending_books, interval=REFRESH_INTERVAL, types=TRENDING_TYPES):
+        self.fetch = fetch
+        self.interval = interval
+        self.types = types
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self, trending_type):
+        """Fetch one feed, keeping the previous snapshot if upstream fails"""
+
+        try:
+            works = self.fetch(trending_type)
+        except Exception as err:
+            print(f"WARNING: Refreshing trending { trending_type } failed: { err }")
+            return False
+
+        if works is None:
+            return False
+
+        with self._lock:
+            self._snapshots[trending_type] = (works, time.time())
+        return True
+
+    def refresh_all(self):
+        """Fetch every feed"""
+
+        for trending_type in self.types:
+            self.refresh(trending_type)
+
+    def get(self, trending_type):
+        """
+        Return (works, age in seconds) for the feed
+
+        Only fetches inline when there has never been a good snapshot,
+        returns ([], None) if that fails too.
+        """
+
+        if trending_type not in self.types:
+            trending_type = self.types[0]
+
+        snapshot = self._snapshots.get(trending_type)
+        if snapshot is None and self.refresh(trending_type):
+            snapshot = self._snapshots.get(trending_type)
+
+        if snapshot is None:
+            return [], None
+
+        works, fetched_at = snapshot
+        return works, time.time() - fetched_at
+
+    def start(self):
+        """Start the refresh thread for this worker (safe to call repeatedly)"""
+
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="trending-refresher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the refresh thread"""
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            # nobody waits on these, page loads that fetch inline go first
+            with priority(BACKGROUND):
+                self.refresh_all()
+            self._stop.wait(self.interval)
+
+
+trending_feeds = TrendingRefresher()